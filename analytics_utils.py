@@ -0,0 +1,544 @@
+"""
+统计分析模块
+概览页用到的聚合统计（总数、各城市次数、航线频次、按年月的里程和时长、热门航线）都写成同一套SQL，
+在可插拔的后端上执行：安装了DuckDB时直接扫描SQLite数据库文件或Parquet快照，否则用SQLite本身执行
+
+命令行用法:
+    python analytics_utils.py
+    python analytics_utils.py --backend duckdb --parquet
+    python analytics_utils.py --verify
+"""
+
+import argparse
+import glob
+import json
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import database_utils
+import export_utils
+import flight_utils
+import snapshot_utils
+
+try:
+    import duckdb
+except ImportError:  # DuckDB是可选的分析引擎，未安装时使用SQLite执行同样的SQL
+    duckdb = None
+
+logger = logging.getLogger(__name__)
+
+# 默认后端: 'auto'（有DuckDB时用DuckDB）、'duckdb' 或 'sqlite'
+ANALYTICS_BACKEND = 'auto'
+
+# 热门航线默认显示的条数
+TOP_ROUTES_LIMIT = 10
+
+# 比较不同后端的结果时允许的浮点误差（求和顺序不同会带来末位差异）
+VERIFY_TOLERANCE = 1e-6
+
+# 时间序列的粒度: 键 -> 显示名称
+TIME_SERIES_PERIODS = {
+    'year': "按年",
+    'month': "按月",
+}
+
+# 时间序列的指标列: 列名 -> 显示名称
+TIME_SERIES_METRICS = {
+    'flights': "航班次数",
+    'distance': "飞行里程（公里）",
+    'flight_time': "飞行时间（分钟）",
+    'new_cities': "首次到访城市",
+    'longest_distance': "最长航段（公里）",
+}
+
+# 中国大致范围（与flight_utils.is_in_china一致）
+_DOMESTIC_CONDITION = '''
+    departure_lat BETWEEN 18 AND 54 AND departure_lon BETWEEN 73 AND 135
+    AND arrival_lat BETWEEN 18 AND 54 AND arrival_lon BETWEEN 73 AND 135
+'''
+
+# 所有后端共用的统计查询，都基于flight_rows视图（列与export_utils.EXPORT_COLUMNS相同）
+# 只在SQL中做聚合，结果排序在Python中完成，避免不同引擎对城市名排序规则不同
+STATS_QUERIES = {
+    'totals': f'''
+        SELECT COUNT(*),
+               COALESCE(SUM(CASE WHEN {_DOMESTIC_CONDITION} THEN 1 ELSE 0 END), 0),
+               COALESCE(SUM(distance), 0),
+               COALESCE(SUM(flight_time), 0)
+        FROM flight_rows
+    ''',
+    # 出发和到达各算一次到访：与两行的常量表交叉连接，只扫描一遍flight_rows
+    # （不写成视图自身的UNION ALL：DuckDB通过sqlite扩展扫描时，两个分支会都返回到达城市）
+    'city_counts': '''
+        SELECT CASE WHEN side = 0 THEN departure_city ELSE arrival_city END AS city, COUNT(*)
+        FROM flight_rows CROSS JOIN (SELECT 0 AS side UNION ALL SELECT 1) AS sides
+        GROUP BY city
+    ''',
+    'route_counts': '''
+        SELECT departure_city, arrival_city, COUNT(*), SUM(distance)
+        FROM flight_rows
+        GROUP BY departure_city, arrival_city
+    ''',
+    'monthly': '''
+        SELECT substr(date, 1, 4), substr(date, 6, 2), COUNT(*), SUM(distance), COALESCE(SUM(flight_time), 0)
+        FROM flight_rows
+        GROUP BY substr(date, 1, 4), substr(date, 6, 2)
+    ''',
+}
+
+
+def _run_sqlite(queries, parquet_path=None):
+    """SQLite后端：在数据库连接上执行（不支持Parquet快照）"""
+    if parquet_path:
+        raise ValueError("SQLite后端不能读取Parquet快照")
+    return database_utils.run_flight_queries(queries)
+
+
+def _sql_string(value):
+    """把字符串写成SQL字符串字面量（DuckDB的ATTACH和read_parquet不支持参数绑定，路径只能写进SQL）"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _load_sqlite_extension(conn):
+    """加载DuckDB的sqlite扩展：已安装时直接加载，否则先安装（需要联网下载）"""
+    try:
+        conn.execute("LOAD sqlite")
+    except duckdb.Error:
+        conn.execute("INSTALL sqlite")
+        conn.execute("LOAD sqlite")
+
+
+def _duckdb_flight_rows(conn):
+    """在DuckDB连接上挂载SQLite主库和各归档库，创建与SQLite后端相同的flight_rows视图"""
+    _load_sqlite_extension(conn)
+    conn.execute(f"ATTACH {_sql_string(database_utils.current_db_file())} AS src (TYPE sqlite, READ_ONLY)")
+    selects = ['SELECT id, departure_city_id, arrival_city_id, date, distance, flight_time FROM src.flights']
+    for idx, path in enumerate(database_utils.list_archive_files()):
+        conn.execute(f"ATTACH {_sql_string(path)} AS archive_{idx} (TYPE sqlite, READ_ONLY)")
+        selects.append(
+            f'SELECT id, departure_city_id, arrival_city_id, date, distance, flight_time FROM archive_{idx}.flights'
+        )
+    conn.execute(f'''
+        CREATE TEMP VIEW flight_rows AS
+        SELECT f.id, dc.name AS departure_city, ac.name AS arrival_city, f.date, f.distance, f.flight_time,
+               dc.lat AS departure_lat, dc.lon AS departure_lon, ac.lat AS arrival_lat, ac.lon AS arrival_lon
+        FROM ({' UNION ALL '.join(selects)}) AS f
+        JOIN src.cities AS dc ON dc.id = f.departure_city_id
+        JOIN src.cities AS ac ON ac.id = f.arrival_city_id
+    ''')
+
+
+def _run_duckdb(queries, parquet_path=None):
+    """DuckDB后端：扫描Parquet快照，或通过sqlite扩展直接扫描数据库文件"""
+    if duckdb is None:
+        raise RuntimeError("DuckDB后端需要安装duckdb: pip install duckdb")
+    conn = duckdb.connect()
+    try:
+        if parquet_path:
+            conn.execute(f"CREATE TEMP VIEW flight_rows AS SELECT * FROM read_parquet({_sql_string(parquet_path)})")
+        else:
+            _duckdb_flight_rows(conn)
+        return {name: conn.execute(sql).fetchall() for name, sql in queries.items()}
+    finally:
+        conn.close()
+
+
+# 后端名称 -> 执行函数
+BACKENDS = {
+    'sqlite': _run_sqlite,
+    'duckdb': _run_duckdb,
+}
+
+
+def available_backends():
+    """返回当前环境可用的后端名称列表"""
+    return [name for name in BACKENDS if name != 'duckdb' or duckdb is not None]
+
+
+# DuckDB后端在本进程中能否使用：None表示尚未探测
+_duckdb_usable = None
+_duckdb_probe_lock = threading.Lock()
+
+
+def duckdb_usable():
+    """
+    探测DuckDB后端能否使用（已安装duckdb且能加载sqlite扩展），每个进程只探测一次
+    自动选择后端时据此决定，不能使用时记录一次日志并改用SQLite，不会每次统计都重新尝试
+    """
+    global _duckdb_usable
+    with _duckdb_probe_lock:
+        if _duckdb_usable is None:
+            _duckdb_usable = False
+            if duckdb is not None:
+                try:
+                    conn = duckdb.connect()
+                    try:
+                        _load_sqlite_extension(conn)
+                    finally:
+                        conn.close()
+                    _duckdb_usable = True
+                except Exception as e:
+                    logger.warning("DuckDB无法加载sqlite扩展，统计改用SQLite后端: %s", e)
+        return _duckdb_usable
+
+
+def resolve_backend(backend=None):
+    """
+    确定实际使用的后端
+    backend: 后端名称，省略时使用ANALYTICS_BACKEND；'auto'表示DuckDB可以使用时（见duckdb_usable）用DuckDB，否则用SQLite
+    """
+    backend = backend or ANALYTICS_BACKEND
+    if backend == 'auto':
+        return 'duckdb' if duckdb_usable() else 'sqlite'
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的统计后端: {backend}")
+    return backend
+
+
+def parquet_snapshot_path(version, db_file=None):
+    """
+    返回指定数据版本的Parquet快照路径
+    例如: flights_zwx.db, 版本12 -> flights_zwx_analytics_12.parquet
+    """
+    base, _ = os.path.splitext(db_file or database_utils.current_db_file())
+    return f"{base}_analytics_{version}.parquet"
+
+
+def ensure_parquet_snapshot():
+    """
+    确保当前数据版本的Parquet快照存在（用export_utils的Parquet导出生成），并删除旧版本的快照
+    返回: 快照文件路径
+    """
+    version = database_utils.get_data_version()
+    path = parquet_snapshot_path(version)
+    if not os.path.exists(path):
+        staging = f"{path}.tmp-{os.getpid()}"
+        export_utils.export_to_file('parquet', staging)
+        os.replace(staging, path)
+    base, _ = os.path.splitext(database_utils.current_db_file())
+    for old_path in glob.glob(f"{glob.escape(base)}_analytics_*.parquet"):
+        if old_path != path:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+    return path
+
+
+def _build_totals(row):
+    """把totals查询的结果行整理为总数统计字典"""
+    flight_count, domestic_count, total_distance, total_flight_time = row
+    return {
+        'flight_count': int(flight_count),
+        'domestic_count': int(domestic_count),
+        'international_count': int(flight_count) - int(domestic_count),
+        'total_distance': float(total_distance),
+        'total_flight_time': int(total_flight_time),
+    }
+
+
+def _build_stats(results, top_n):
+    """把各查询的原始结果行整理为统计字典（排序规则与后端无关）"""
+    routes = sorted(
+        (
+            {'departure_city': dep, 'arrival_city': arr, 'count': count, 'distance': float(distance or 0)}
+            for dep, arr, count, distance in results['route_counts']
+        ),
+        key=lambda route: (-route['count'], route['departure_city'], route['arrival_city'])
+    )
+    stats = _build_totals(results['totals'][0])
+    stats.update({
+        'city_counts': {
+            city: int(count)
+            for city, count in sorted(results['city_counts'], key=lambda row: (-row[1], row[0]))
+        },
+        'route_counts': {(route['departure_city'], route['arrival_city']): int(route['count']) for route in routes},
+        'top_routes': routes[:top_n],
+        'monthly': [
+            {
+                'year': int(year), 'month': int(month), 'count': int(count),
+                'distance': float(distance or 0), 'flight_time': int(flight_time)
+            }
+            for year, month, count, distance, flight_time in sorted(results['monthly'])
+        ],
+    })
+    return stats
+
+
+def compute_stats(backend=None, use_parquet=False, top_n=TOP_ROUTES_LIMIT):
+    """
+    计算概览页的全部统计
+
+    参数:
+        backend: 后端名称（见resolve_backend）
+        use_parquet: DuckDB后端是否扫描Parquet快照（快照过期时先重新生成）而不是数据库文件
+        top_n: 热门航线条数
+    返回: 统计字典，包含 flight_count, domestic_count, international_count, total_distance,
+          total_flight_time, city_counts {城市: 次数}, route_counts {(出发, 到达): 次数},
+          top_routes（按次数降序的航线列表）, monthly（按年月升序的列表）
+    """
+    return _build_stats(_run_queries(STATS_QUERIES, backend, use_parquet), top_n)
+
+
+def compute_totals(backend=None):
+    """
+    只计算总数类统计（接口等不需要排行和月度数据的场景使用，只扫描一遍航班表）
+    返回: {'flight_count', 'domestic_count', 'international_count', 'total_distance', 'total_flight_time'}
+    """
+    return _build_totals(_run_queries({'totals': STATS_QUERIES['totals']}, backend)['totals'][0])
+
+
+# 总数缓存最多保留的数据库（用户配置）数
+TOTALS_CACHE_SIZE = 8
+
+# 各数据库最近一次计算的总数: {数据库文件: (数据版本号, 总数字典)}，最近使用的在后
+_totals_cache = OrderedDict()
+_totals_lock = threading.Lock()
+
+
+def overview_totals():
+    """
+    概览页的总数类统计（同compute_totals），按数据库和数据版本缓存：
+    数据没有变化时页面重新执行不会再查询数据库（DuckDB后端也不会重新连接和附加数据库）
+    返回: compute_totals的结果字典（调用方不要修改）
+    """
+    version = database_utils.get_data_version()
+    db_file = os.path.abspath(database_utils.current_db_file())
+    with _totals_lock:
+        cached = _totals_cache.get(db_file)
+        if cached and cached[0] == version:
+            _totals_cache.move_to_end(db_file)
+            return cached[1]
+    totals = compute_totals()
+    with _totals_lock:
+        _totals_cache[db_file] = (version, totals)
+        _totals_cache.move_to_end(db_file)
+        while len(_totals_cache) > TOTALS_CACHE_SIZE:
+            _totals_cache.popitem(last=False)
+    return totals
+
+
+def _run_queries(queries, backend=None, use_parquet=False):
+    """
+    在选定的后端上执行一组统计查询
+    返回: {查询名: 结果行列表}
+    """
+    requested = backend or ANALYTICS_BACKEND
+    backend = resolve_backend(requested)
+    parquet_path = ensure_parquet_snapshot() if use_parquet and backend == 'duckdb' else None
+    try:
+        return BACKENDS[backend](queries, parquet_path)
+    except Exception as e:
+        # 自动选择时DuckDB出错退回SQLite（结果相同），并且本进程之后不再自动选择DuckDB
+        if requested != 'auto' or backend == 'sqlite':
+            raise
+        global _duckdb_usable
+        _duckdb_usable = False
+        logger.warning("DuckDB统计查询失败，改用SQLite后端: %s", e)
+        return _run_sqlite(queries)
+
+
+# 时间序列缓存最多保留的数据库（用户配置）数
+TIME_SERIES_CACHE_SIZE = 8
+
+# 各数据库最近一次计算的时间序列: {数据库文件: (数据版本号, {粒度: DataFrame})}，最近使用的在后
+_time_series_cache = OrderedDict()
+_time_series_lock = threading.Lock()
+
+
+def _period_index(frame, period):
+    """返回每条航班所属的时间段标签（'2024' 或 '2024-05'），以及覆盖首尾之间所有时间段的完整标签序列"""
+    if period == 'year':
+        labels = frame['when'].dt.year
+        full = pd.RangeIndex(labels.min(), labels.max() + 1)
+        return labels.astype(str), full.astype(str)
+    labels = frame['when'].dt.to_period('M')
+    full = pd.period_range(labels.min(), labels.max(), freq='M')
+    return labels.astype(str), full.astype(str)
+
+
+def _build_time_series(arrays):
+    """
+    在快照的列数组上用pandas分组聚合，一次算出按年和按月的时间序列
+    返回: {粒度: DataFrame}，索引为时间段标签，列为TIME_SERIES_METRICS中的指标以及longest_route（最长航段的航线）
+    """
+    columns = list(TIME_SERIES_METRICS) + ['longest_route']
+    if len(arrays['id']) == 0:
+        return {period: pd.DataFrame(columns=columns) for period in TIME_SERIES_PERIODS}
+
+    city_names = pd.Series(np.asarray(arrays['city_name']), index=np.asarray(arrays['city_id']))
+    flight_time = np.asarray(arrays['flight_time'])
+    frame = pd.DataFrame({
+        'when': pd.to_datetime(np.asarray(arrays['date']), format='%Y-%m-%d'),
+        'departure_city_id': np.asarray(arrays['departure_city_id']),
+        'arrival_city_id': np.asarray(arrays['arrival_city_id']),
+        'distance': np.asarray(arrays['distance']),
+        'flight_time': np.where(flight_time >= 0, flight_time, 0),
+    })
+    # 每个城市第一次出现（作为出发或到达城市）的日期
+    visits = pd.concat([
+        frame[['when', 'departure_city_id']].set_axis(['when', 'city_id'], axis=1),
+        frame[['when', 'arrival_city_id']].set_axis(['when', 'city_id'], axis=1),
+    ])
+    first_visits = visits.groupby('city_id')['when'].min().to_frame()
+
+    series = {}
+    for period in TIME_SERIES_PERIODS:
+        labels, full = _period_index(frame, period)
+        grouped = frame.groupby(labels.to_numpy())
+        result = grouped.agg(
+            flights=('distance', 'size'),
+            distance=('distance', 'sum'),
+            flight_time=('flight_time', 'sum'),
+            longest_distance=('distance', 'max'),
+        )
+        longest = frame.loc[grouped['distance'].idxmax().to_numpy()]
+        result['longest_route'] = (
+            city_names.reindex(longest['departure_city_id']).to_numpy() + ' → '
+            + city_names.reindex(longest['arrival_city_id']).to_numpy()
+        )
+        first_labels, _ = _period_index(first_visits, period)
+        result['new_cities'] = first_labels.value_counts()
+        result = result.reindex(full)
+        numeric = list(TIME_SERIES_METRICS)
+        result[numeric] = result[numeric].fillna(0)
+        result['longest_route'] = result['longest_route'].fillna('')
+        result = result.astype({'flights': 'int64', 'flight_time': 'int64', 'new_cities': 'int64'})
+        result.index.name = period
+        series[period] = result[columns]
+    return series
+
+
+def time_series(period='year'):
+    """
+    按年或按月的统计（航班次数、里程、飞行时间、首次到访的城市数、最长航段）
+    结果按数据版本缓存：数据没有变化时切换粒度或指标不会重新计算
+
+    参数:
+        period: TIME_SERIES_PERIODS中的粒度
+    返回: DataFrame，索引为时间段标签（中间没有航班的时间段也会列出，数值为0）
+    """
+    if period not in TIME_SERIES_PERIODS:
+        raise ValueError(f"不支持的时间粒度: {period}")
+    version = database_utils.get_data_version()
+    db_file = os.path.abspath(database_utils.current_db_file())
+    with _time_series_lock:
+        cached = _time_series_cache.get(db_file)
+        if cached and cached[0] == version:
+            _time_series_cache.move_to_end(db_file)
+            return cached[1][period]
+    series = _build_time_series(snapshot_utils.load_arrays(version))
+    with _time_series_lock:
+        _time_series_cache[db_file] = (version, series)
+        _time_series_cache.move_to_end(db_file)
+        while len(_time_series_cache) > TIME_SERIES_CACHE_SIZE:
+            _time_series_cache.popitem(last=False)
+    return series[period]
+
+
+def _diff_values(expected, actual, path):
+    """递归比较两个统计结果，浮点数允许VERIFY_TOLERANCE的相对误差，返回差异描述列表"""
+    if isinstance(expected, float) or isinstance(actual, float):
+        if math.isclose(expected, actual, rel_tol=VERIFY_TOLERANCE, abs_tol=VERIFY_TOLERANCE):
+            return []
+        return [f"{path}: {expected!r} != {actual!r}"]
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        if list(expected) != list(actual):
+            return [f"{path}: 键或顺序不同"]
+        diffs = []
+        for key in expected:
+            diffs.extend(_diff_values(expected[key], actual[key], f"{path}[{key!r}]"))
+        return diffs
+    if isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            return [f"{path}: 长度 {len(expected)} != {len(actual)}"]
+        diffs = []
+        for idx, (left, right) in enumerate(zip(expected, actual)):
+            diffs.extend(_diff_values(left, right, f"{path}[{idx}]"))
+        return diffs
+    return [] if expected == actual else [f"{path}: {expected!r} != {actual!r}"]
+
+
+def _reference_results(flights):
+    """
+    用Python逐条累加计算与STATS_QUERIES相同的原始结果（原来概览页的做法，作为校验基准）
+    flights: database_utils.load_flights_from_db返回的航班记录列表
+    """
+    domestic_count = 0
+    city_counts = {}
+    routes = {}
+    monthly = {}
+    for flight in flights:
+        dep_lat, dep_lon = flight['departure_coords']
+        arr_lat, arr_lon = flight['arrival_coords']
+        if flight_utils.is_in_china(dep_lat, dep_lon) and flight_utils.is_in_china(arr_lat, arr_lon):
+            domestic_count += 1
+        for city in (flight['departure_city'], flight['arrival_city']):
+            city_counts[city] = city_counts.get(city, 0) + 1
+        route = routes.setdefault((flight['departure_city'], flight['arrival_city']), [0, 0.0])
+        route[0] += 1
+        route[1] += flight['distance']
+        month = monthly.setdefault((flight['date'][:4], flight['date'][5:7]), [0, 0.0, 0])
+        month[0] += 1
+        month[1] += flight['distance']
+        month[2] += flight['flight_time'] or 0
+    return {
+        'totals': [(
+            len(flights), domestic_count,
+            sum(flight['distance'] for flight in flights),
+            sum(flight['flight_time'] or 0 for flight in flights)
+        )],
+        'city_counts': list(city_counts.items()),
+        'route_counts': [key + tuple(value) for key, value in routes.items()],
+        'monthly': [key + tuple(value) for key, value in monthly.items()],
+    }
+
+
+def verify_backends(top_n=TOP_ROUTES_LIMIT):
+    """
+    在所有可用的后端（DuckDB还会分别扫描数据库文件和Parquet快照）上计算统计，
+    与用Python逐条累加得到的基准结果逐项比较
+    返回: {来源名称: 差异描述列表}，列表为空表示结果一致
+    """
+    expected = _build_stats(_reference_results(database_utils.load_flights_from_db()), top_n)
+    report = {'sqlite': _diff_values(expected, compute_stats('sqlite', top_n=top_n), 'stats')}
+    if duckdb is not None:
+        for label, use_parquet in (('duckdb', False), ('duckdb+parquet', True)):
+            report[label] = _diff_values(expected, compute_stats('duckdb', use_parquet, top_n), 'stats')
+    return report
+
+
+def main(argv=None):
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="计算航班统计")
+    parser.add_argument('--db', default=database_utils.DB_FILE, help="数据库文件路径")
+    parser.add_argument('--backend', choices=['auto'] + sorted(BACKENDS), default=ANALYTICS_BACKEND, help="统计后端")
+    parser.add_argument('--parquet', action='store_true', help="DuckDB后端扫描Parquet快照")
+    parser.add_argument('--top', type=int, default=TOP_ROUTES_LIMIT, help="热门航线条数")
+    parser.add_argument('--verify', action='store_true', help="比较所有可用后端的结果是否一致")
+    args = parser.parse_args(argv)
+
+    with database_utils.use_db_file(args.db):
+        if args.verify:
+            report = verify_backends(args.top)
+            for label, diffs in report.items():
+                print(f"{label}: {'一致' if not diffs else '不一致'}")
+                for diff in diffs:
+                    print(f"    {diff}")
+            if any(report.values()):
+                raise SystemExit(1)
+            return
+
+        stats = compute_stats(args.backend, args.parquet, args.top)
+    stats['route_counts'] = {f"{dep} -> {arr}": count for (dep, arr), count in stats['route_counts'].items()}
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+"""
+JSON接口模块
+在应用旁边运行一个轻量的本地HTTP服务（只用标准库），供看板和脚本读取航班、总数、城市和航线排行以及GeoJSON航线，
+不必再抓取Streamlit页面。响应按数据版本号缓存，并带ETag：数据没有变化时客户端带If-None-Match轮询只会得到304
+
+命令行用法:
+    python api_utils.py --port 8600
+    curl http://127.0.0.1:8600/api/totals
+    curl "http://127.0.0.1:8600/api/flights?page=0&page_size=50&profile=alice"
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import analytics_utils
+import database_utils
+import estimate_utils
+
+# 默认监听地址和端口（只监听本机）
+API_HOST = '127.0.0.1'
+API_PORT = 8600
+
+# 分页参数的默认值和上限
+API_DEFAULT_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+
+# 响应缓存最多保留的条目数（按数据库、路径和查询参数区分）
+API_CACHE_SIZE = 256
+
+# 接口的媒体类型
+JSON_CONTENT_TYPE = 'application/json; charset=utf-8'
+GEOJSON_CONTENT_TYPE = 'application/geo+json; charset=utf-8'
+
+
+class ApiError(Exception):
+    """请求参数错误或资源不存在，status为HTTP状态码"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _int_param(params, name, default, minimum=0, maximum=None):
+    """读取整数查询参数，超出范围或不是整数时抛出ApiError(400)"""
+    value = params.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ApiError(400, f"参数{name}必须是整数")
+    if value < minimum or (maximum is not None and value > maximum):
+        raise ApiError(400, f"参数{name}超出范围")
+    return value
+
+
+def _page_params(params):
+    """返回 (页码, 每页条数)"""
+    return (
+        _int_param(params, 'page', 0),
+        _int_param(params, 'page_size', API_DEFAULT_PAGE_SIZE, minimum=1, maximum=API_MAX_PAGE_SIZE),
+    )
+
+
+def get_flights(params):
+    """航班记录（按日期从晚到早分页），带q参数时按search_flights的规则搜索"""
+    page, page_size = _page_params(params)
+    if params.get('q'):
+        result = database_utils.search_flights(params['q'], page, page_size)
+    else:
+        result = database_utils.load_flights_page(page, page_size)
+    return dict(result, page=page, page_size=page_size)
+
+
+def get_totals(params):
+    """总数统计（航班数、国内/国际、总里程和总飞行时间、估算的飞行时间、城市数、航线数）"""
+    totals = analytics_utils.compute_totals()
+    totals['city_count'], totals['route_count'] = database_utils.get_ranking_sizes()
+    estimates = estimate_utils.flight_time_totals()
+    totals['estimated_flight_time'] = estimates['estimated_minutes']
+    totals['estimated_flight_count'] = estimates['estimated_count']
+    return totals
+
+
+def get_cities(params):
+    """城市到访次数排行（分页）"""
+    page, page_size = _page_params(params)
+    city_count, _ = database_utils.get_ranking_sizes()
+    rows = database_utils.get_top_cities(page_size, page * page_size)
+    return {
+        'total': city_count, 'page': page, 'page_size': page_size,
+        'cities': [{'name': name, 'visits': visits} for name, visits in rows],
+    }
+
+
+def get_routes(params):
+    """航线次数排行（分页，有方向）"""
+    page, page_size = _page_params(params)
+    _, route_count = database_utils.get_ranking_sizes()
+    rows = database_utils.get_top_routes(page_size, page * page_size)
+    return {
+        'total': route_count, 'page': page, 'page_size': page_size,
+        'routes': [{'departure_city': dep, 'arrival_city': arr, 'flights': n} for dep, arr, n in rows],
+    }
+
+
+def get_routes_geojson(params):
+    """航线排行的GeoJSON（每条航线一个LineString，properties中带航班次数）"""
+    result = get_routes(params)
+    coords = {city['name']: city['coords'] for city in database_utils.load_cities()}
+    features = []
+    for route in result['routes']:
+        (dep_lat, dep_lon), (arr_lat, arr_lon) = coords[route['departure_city']], coords[route['arrival_city']]
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'LineString', 'coordinates': [[dep_lon, dep_lat], [arr_lon, arr_lat]]},
+            'properties': route,
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def get_version(params):
+    """当前数据版本号"""
+    return {'data_version': database_utils.get_data_version()}
+
+
+# 路径 -> (处理函数, 媒体类型)
+API_ROUTES = {
+    '/api/flights': (get_flights, JSON_CONTENT_TYPE),
+    '/api/totals': (get_totals, JSON_CONTENT_TYPE),
+    '/api/cities': (get_cities, JSON_CONTENT_TYPE),
+    '/api/routes': (get_routes, JSON_CONTENT_TYPE),
+    '/api/routes.geojson': (get_routes_geojson, GEOJSON_CONTENT_TYPE),
+    '/api/version': (get_version, JSON_CONTENT_TYPE),
+}
+
+
+class ResponseCache:
+    """
+    按数据版本号缓存序列化后的响应体
+    键为 (数据库文件, 路径, 查询参数)，值为 (数据版本号, ETag, 响应体)，数据版本变化后的第一次请求重新生成
+    """
+
+    def __init__(self, size=API_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """返回 (ETag, 响应体)，缓存不存在或已过期时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def put(self, key, version, body):
+        """
+        缓存响应体
+        ETag取响应体的摘要，数据版本变化但这个接口的结果没变时ETag也不变，客户端仍然得到304
+        返回: ETag
+        """
+        etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+        with self._lock:
+            self._entries[key] = (version, etag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return etag
+
+
+_cache = ResponseCache()
+
+# 本进程已经初始化过的数据库文件
+_initialized = set()
+_initialized_lock = threading.Lock()
+
+
+def _resolve_db_file(profile):
+    """
+    返回用户配置对应的数据库文件（默认配置的数据库在第一次请求时初始化，其他配置必须已经存在）
+    不带profile的请求使用当前线程的数据库（服务器的默认数据库，见make_server）
+    """
+    try:
+        db_file = database_utils.profile_db_file(profile) if profile else database_utils.current_db_file()
+    except ValueError as e:
+        raise ApiError(400, str(e))
+    if profile and not os.path.exists(db_file):
+        raise ApiError(404, f"用户配置不存在: {profile}")
+    with _initialized_lock:
+        if db_file not in _initialized:
+            with database_utils.use_db_file(db_file):
+                database_utils.init_database()
+            _initialized.add(db_file)
+    return db_file
+
+
+def handle_request(path, query, if_none_match=None):
+    """
+    处理一个GET请求（与HTTP服务器无关，便于在其他框架中复用）
+    返回: (状态码, 媒体类型, 响应体, ETag)，304时响应体为空
+    """
+    if path not in API_ROUTES:
+        raise ApiError(404, f"未知的接口: {path}（可用: {', '.join(API_ROUTES)}）")
+    handler, content_type = API_ROUTES[path]
+    params = dict(parse_qsl(query))
+    db_file = _resolve_db_file(params.pop('profile', ''))
+    with database_utils.use_db_file(db_file):
+        version = database_utils.get_data_version()
+        key = (db_file, path, tuple(sorted(params.items())))
+        cached = _cache.get(key, version)
+        if cached is None:
+            body = json.dumps(handler(params), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            etag = _cache.put(key, version, body)
+        else:
+            etag, body = cached
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(',')]:
+        return 304, content_type, b'', etag
+    return 200, content_type, body, etag
+
+
+class ApiRequestHandler(BaseHTTPRequestHandler):
+    """把GET请求交给handle_request，并写出带ETag的响应（HTTP/1.1长连接）"""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'SkyLinkAPI/1.0'
+    # 响应头和响应体分两次写出，长连接上不关闭Nagle算法会与客户端的延迟确认叠加，每个请求多等约40毫秒
+    disable_nagle_algorithm = True
+    quiet = True
+    db_file = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        try:
+            # 请求在服务器的连接线程中处理，需要重新设置线程的默认数据库
+            with database_utils.use_db_file(self.db_file):
+                status, content_type, body, etag = handle_request(
+                    url.path.rstrip('/') or '/', url.query, self.headers.get('If-None-Match')
+                )
+        except ApiError as e:
+            status, content_type, etag = e.status, JSON_CONTENT_TYPE, None
+            body = json.dumps({'error': str(e)}, ensure_ascii=False).encode('utf-8')
+        except Exception as e:
+            status, content_type, etag = 500, JSON_CONTENT_TYPE, None
+            body = json.dumps({'error': str(e)}, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+            # 允许缓存，但每次使用前都要带If-None-Match重新验证
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+def make_server(host=API_HOST, port=API_PORT, quiet=True, db_file=None):
+    """
+    创建接口服务器（每个连接一个线程），调用serve_forever()开始服务
+    db_file: 不带profile的请求使用的数据库，省略时为创建服务器的线程当前使用的数据库
+    """
+    handler = type('Handler', (ApiRequestHandler,), {
+        'quiet': quiet, 'db_file': db_file or database_utils.current_db_file()
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_background(host=API_HOST, port=API_PORT):
+    """
+    在后台线程中启动接口服务器（与Streamlit应用在同一进程中运行时使用）
+    返回: 服务器对象，调用shutdown()停止
+    """
+    server = make_server(host, port)
+    threading.Thread(target=server.serve_forever, name='flight-api', daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="运行航班数据的JSON接口")
+    parser.add_argument('--db', default=database_utils.DB_FILE, help="默认用户配置的数据库文件路径")
+    parser.add_argument('--host', default=API_HOST, help="监听地址")
+    parser.add_argument('--port', type=int, default=API_PORT, help="监听端口")
+    parser.add_argument('--verbose', action='store_true', help="打印每个请求")
+    args = parser.parse_args(argv)
+
+    with database_utils.use_db_file(args.db):
+        server = make_server(args.host, args.port, quiet=not args.verbose)
+    print(f"接口已启动: http://{args.host}:{server.server_address[1]}/api/totals")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,147 +5,2741 @@
 
 import sqlite3
 import json
+import os
+import glob
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
 
-# 数据库文件路径
+import dedup_utils
+import search_utils
+import trip_utils
+
+# 数据库文件路径（默认用户配置使用的数据库，其他用户配置各自使用PROFILES_DIR中的独立文件）
 DB_FILE = 'flights_zwx.db'
 
+# 用户配置的数据库目录：配置名为alice时使用 profiles/alice.db
+PROFILES_DIR = 'profiles'
+
+# 合法的用户配置名（同时也是文件名的一部分）
+PROFILE_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+
+# 连接注册表最多保留的空闲连接数，超过时关闭最久未使用的连接
+CONNECTION_POOL_SIZE = 16
+
+# 空闲超过该秒数的连接在下次取用连接时关闭
+CONNECTION_IDLE_SECONDS = 300
+
+# 按年份分区：热分区（DB_FILE）只保留最近N年的记录，更早的记录移入归档数据库
+# 设为None时不分区，所有记录都保存在DB_FILE中
+HOT_PARTITION_YEARS = None
+
+# 每个归档数据库覆盖的年数（SQLite默认最多同时ATTACH 10个数据库，按十年分桶足够覆盖很长的历史）
+ARCHIVE_SPAN_YEARS = 10
+
+# 修改日志：日志批次超过JOURNAL_MAX_BATCHES时，只保留最近JOURNAL_KEEP_BATCHES个批次（含撤销/重做产生的批次，
+# 决定了最多能撤销多少步），更早的日志折叠进检查点
+JOURNAL_MAX_BATCHES = 200
+JOURNAL_KEEP_BATCHES = 100
+
+# flights表的列（热分区和归档分区共用，UNION ALL视图按此顺序选择列）
+FLIGHT_COLUMNS = (
+    'id', 'departure_city_id', 'arrival_city_id', 'date', 'distance',
+    'flight_time', 'created_at', 'fingerprint', 'uid', 'updated_at', 'updated_by', 'change_seq',
+    'estimated_flight_time'
+)
+
+# 规范化后的flights表结构：城市名和坐标统一保存在cities表中，这里只保存整数外键
+FLIGHTS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        departure_city_id INTEGER NOT NULL REFERENCES cities(id),
+        arrival_city_id INTEGER NOT NULL REFERENCES cities(id),
+        date TEXT NOT NULL,
+        distance REAL NOT NULL,
+        flight_time INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        fingerprint TEXT,
+        uid TEXT,
+        updated_at TEXT,
+        updated_by TEXT,
+        change_seq INTEGER,
+        estimated_flight_time INTEGER
+    )
+'''
+
+# 同步相关的列：uid是跨设备不变的全局ID，(updated_at, updated_by)是记录的版本（冲突时较大者胜出），
+# change_seq是本机的修改序号（增量同步的水位线）
+SYNC_COLUMNS = (
+    ('uid', 'TEXT'), ('updated_at', 'TEXT'), ('updated_by', 'TEXT'), ('change_seq', 'INTEGER')
+)
+
+
+class DuplicateFlightError(ValueError):
+    """要写入的航班与已有记录的指纹相同（同一航线、同一天、同样的飞行时间）"""
+
+    def __init__(self, flight_id):
+        super().__init__(f"与已有航班记录重复 (ID: {flight_id})")
+        self.flight_id = flight_id
+
+
+_current = threading.local()
+
+
+def current_db_file():
+    """
+    返回当前线程使用的数据库文件：通过use_db_file/set_current_db_file切换过用户配置时为该配置的文件，否则为DB_FILE
+    """
+    return getattr(_current, 'db_file', None) or DB_FILE
+
+
+def set_current_db_file(db_file):
+    """
+    设置当前线程使用的数据库文件（None表示恢复为DB_FILE）
+    Streamlit每次执行脚本都在新的线程中，需要在脚本开头根据会话的用户配置重新设置
+    """
+    _current.db_file = db_file
+
+
+@contextmanager
+def use_db_file(db_file):
+    """在with块内让当前线程使用指定的数据库文件（后台任务、命令行同步等场景使用）"""
+    previous = getattr(_current, 'db_file', None)
+    _current.db_file = db_file
+    try:
+        yield
+    finally:
+        _current.db_file = previous
+
+
+def profile_db_file(profile=None):
+    """
+    返回用户配置对应的数据库文件
+    profile: 配置名，省略或为空时返回默认数据库DB_FILE
+    例如: 'alice' -> profiles/alice.db
+    """
+    if not profile:
+        return DB_FILE
+    if not PROFILE_NAME_PATTERN.match(profile):
+        raise ValueError("配置名只能包含字母、数字、下划线和减号（最多32个字符）")
+    return os.path.join(PROFILES_DIR, f"{profile}.db")
+
+
+def list_profiles():
+    """
+    列出已有的用户配置（PROFILES_DIR中的数据库文件，不含归档文件）
+    返回: 按名称排序的配置名列表
+    """
+    names = []
+    for path in glob.glob(os.path.join(glob.escape(PROFILES_DIR), '*.db')):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if PROFILE_NAME_PATTERN.match(name) and not re.search(r'_archive_\d{4}$', name):
+            names.append(name)
+    return sorted(names)
+
+
+def _archive_file(start_year, db_file=None):
+    """
+    返回覆盖 [start_year, start_year + ARCHIVE_SPAN_YEARS) 的归档数据库文件路径
+    例如: flights_zwx.db, 2010 -> flights_zwx_archive_2010.db
+    """
+    base, ext = os.path.splitext(db_file or current_db_file())
+    return f"{base}_archive_{start_year}{ext or '.db'}"
+
+
+def list_archive_files(db_file=None):
+    """
+    列出当前数据库已有的归档文件（按年份升序）
+    返回: 文件路径列表
+    """
+    base, ext = os.path.splitext(db_file or current_db_file())
+    pattern = f"{glob.escape(base)}_archive_[0-9][0-9][0-9][0-9]{ext or '.db'}"
+    return sorted(glob.glob(pattern))
+
+
+def _ensure_archive_schema(cursor, alias):
+    """
+    确保归档数据库中存在与热分区结构一致的flights表和日期索引
+    热分区后续新增的列会以ALTER TABLE的方式补到归档表上
+    """
+    _migrate_legacy_flights(cursor, alias)
+    cursor.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = 'flights'")
+    create_sql = cursor.fetchone()[0]
+    # 去掉 "CREATE TABLE flights" 前缀，换成归档库中的表名
+    columns_sql = create_sql[create_sql.index('('):]
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS {alias}.flights {columns_sql}')
+    _create_flight_indexes(cursor, alias)
+
+    cursor.execute(f'PRAGMA {alias}.table_info(flights)')
+    archive_columns = {column[1] for column in cursor.fetchall()}
+    cursor.execute('PRAGMA main.table_info(flights)')
+    for column in cursor.fetchall():
+        if column[1] not in archive_columns:
+            cursor.execute(f'ALTER TABLE {alias}.flights ADD COLUMN {column[1]} {column[2]}')
+    _ensure_fingerprints(cursor, alias)
+    _ensure_sync_columns(cursor, alias)
+
+
+def _create_flight_indexes(cursor, alias='main'):
+    """
+    创建flights表的索引
+    日期索引服务于 ORDER BY date DESC 和按年份分区；城市外键索引服务于按城市的聚合和查找
+    """
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS {alias}.idx_flights_date ON flights(date)')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS {alias}.idx_flights_departure_city ON flights(departure_city_id)')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS {alias}.idx_flights_arrival_city ON flights(arrival_city_id)')
+
+
+def _assign_fingerprints(cursor, alias='main', where='', params=()):
+    """
+    重新计算指定分区中（满足where条件的）记录的指纹
+    与已有记录指纹冲突的记录视为重复，其指纹保持为NULL（不删除数据，留给find_duplicate_flights报告）
+    返回: 冲突的记录数
+    """
+    cursor.execute(f'''
+        SELECT id, departure_city_id, arrival_city_id, date, flight_time
+        FROM {alias}.flights {where} ORDER BY id
+    ''', params)
+    rows = cursor.fetchall()
+    cursor.execute(f'UPDATE {alias}.flights SET fingerprint = NULL {where}', params)
+    conflicts = 0
+    for row in rows:
+        try:
+            cursor.execute(
+                f'UPDATE {alias}.flights SET fingerprint = ? WHERE id = ?',
+                (dedup_utils.flight_fingerprint(*row[1:]), row[0])
+            )
+        except sqlite3.IntegrityError:
+            conflicts += 1
+    return conflicts
+
+
+def _ensure_fingerprints(cursor, alias='main'):
+    """
+    确保flights表有指纹列和指纹唯一索引（旧表补列后回填已有记录的指纹）
+    """
+    cursor.execute(
+        f"SELECT 1 FROM {alias}.sqlite_master WHERE type = 'index' AND name = 'idx_flights_fingerprint'"
+    )
+    if cursor.fetchone():
+        return
+    cursor.execute(f'PRAGMA {alias}.table_info(flights)')
+    if 'fingerprint' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute(f'ALTER TABLE {alias}.flights ADD COLUMN fingerprint TEXT')
+    # 指纹为NULL的记录不参与唯一性约束，先建索引再逐条回填，冲突由索引检测
+    cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {alias}.idx_flights_fingerprint ON flights(fingerprint)')
+    _assign_fingerprints(cursor, alias)
+
+
+def _utc_timestamp():
+    """返回当前UTC时间戳字符串（微秒精度，字典序即时间顺序），例如 '2026-01-02T03:04:05.123456Z'"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _device_id(cursor):
+    """返回本机数据库的设备ID（初始化时随机生成，同步时用来区分记录来自哪台设备）"""
+    cursor.execute("SELECT value FROM main.meta WHERE key = 'device_id'")
+    return cursor.fetchone()[0]
+
+
+def _next_change_seq(cursor):
+    """递增并返回本机的修改序号（与修改操作处于同一事务）"""
+    cursor.execute("UPDATE main.meta SET value = value + 1 WHERE key = 'change_seq'")
+    cursor.execute("SELECT value FROM main.meta WHERE key = 'change_seq'")
+    return int(cursor.fetchone()[0])
+
+
+def _change_stamp(cursor, flight_record=None):
+    """
+    返回写入记录时使用的 (updated_at, updated_by, change_seq)
+    应用同步过来的记录时沿用对端的版本，本地修改使用当前时间和本机设备ID；change_seq总是本机递增的序号
+    """
+    if flight_record and flight_record.get('updated_at'):
+        updated_at, updated_by = flight_record['updated_at'], flight_record['updated_by']
+    else:
+        updated_at, updated_by = _utc_timestamp(), _device_id(cursor)
+    return updated_at, updated_by, _next_change_seq(cursor)
+
+
+def _ensure_estimate_column(cursor, alias='main'):
+    """
+    确保flights表有估算飞行时间的列（旧表补列，估算值由estimate_utils在数据变化后补上）
+    """
+    cursor.execute(f'PRAGMA {alias}.table_info(flights)')
+    if 'estimated_flight_time' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute(f'ALTER TABLE {alias}.flights ADD COLUMN estimated_flight_time INTEGER')
+
+
+def _ensure_sync_columns(cursor, alias='main'):
+    """
+    确保flights表有同步所需的列和索引（旧表补列后为已有记录生成uid和初始版本）
+    """
+    cursor.execute(f"SELECT 1 FROM {alias}.sqlite_master WHERE type = 'index' AND name = 'idx_flights_uid'")
+    if cursor.fetchone():
+        return
+    cursor.execute(f'PRAGMA {alias}.table_info(flights)')
+    columns = [column[1] for column in cursor.fetchall()]
+    for name, column_type in SYNC_COLUMNS:
+        if name not in columns:
+            cursor.execute(f'ALTER TABLE {alias}.flights ADD COLUMN {name} {column_type}')
+    # 已有记录的初始版本取创建时间，change_seq取1（从水位线0开始的首次同步会包含它们）
+    cursor.execute(f'''
+        UPDATE {alias}.flights
+        SET uid = lower(hex(randomblob(16))),
+            updated_at = strftime('%Y-%m-%dT%H:%M:%f000Z', COALESCE(created_at, 'now')),
+            updated_by = ?,
+            change_seq = 1
+        WHERE uid IS NULL
+    ''', (_device_id(cursor),))
+    cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {alias}.idx_flights_uid ON flights(uid)')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS {alias}.idx_flights_change_seq ON flights(change_seq)')
+
+
+def _check_duplicate(cursor, fingerprint, flight_id=None):
+    """
+    按指纹检查是否已有相同的航班（走各分区的指纹唯一索引，需要连接上已有all_flights视图）
+    flight_id: 修改已有记录时排除记录本身
+    有重复时抛出DuplicateFlightError
+    """
+    cursor.execute(
+        'SELECT id FROM all_flights WHERE fingerprint = ? AND id IS NOT ? LIMIT 1',
+        (fingerprint, flight_id)
+    )
+    row = cursor.fetchone()
+    if row:
+        raise DuplicateFlightError(row[0])
+
+
+def _create_city_search(cursor):
+    """
+    创建城市搜索的FTS5全文索引（trigram分词，支持子串和模糊匹配），并用触发器与cities、city_aliases保持同步
+    SQLite未启用FTS5时什么都不做，搜索退回到LIKE查询
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'city_search'")
+    if cursor.fetchone():
+        return
+    try:
+        cursor.execute("CREATE VIRTUAL TABLE city_search USING fts5(name, aliases, tokenize = 'trigram')")
+    except sqlite3.OperationalError:
+        return
+    # FTS表的rowid就是城市ID，别名用 | 连接成一列
+    aliases_sql = "COALESCE((SELECT group_concat(alias, '|') FROM city_aliases WHERE city_id = {}), '')"
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS cities_search_insert AFTER INSERT ON cities BEGIN
+            INSERT INTO city_search (rowid, name, aliases) VALUES (new.id, new.name, '');
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS cities_search_update AFTER UPDATE OF name ON cities BEGIN
+            UPDATE city_search SET name = new.name WHERE rowid = new.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS cities_search_delete AFTER DELETE ON cities BEGIN
+            DELETE FROM city_search WHERE rowid = old.id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS city_aliases_search_insert AFTER INSERT ON city_aliases BEGIN
+            UPDATE city_search SET aliases = {aliases_sql.format('new.city_id')} WHERE rowid = new.city_id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS city_aliases_search_delete AFTER DELETE ON city_aliases BEGIN
+            UPDATE city_search SET aliases = {aliases_sql.format('old.city_id')} WHERE rowid = old.city_id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS city_aliases_search_update AFTER UPDATE ON city_aliases BEGIN
+            UPDATE city_search SET aliases = {aliases_sql.format('old.city_id')} WHERE rowid = old.city_id;
+            UPDATE city_search SET aliases = {aliases_sql.format('new.city_id')} WHERE rowid = new.city_id;
+        END
+    ''')
+    cursor.execute(f'''
+        INSERT INTO city_search (rowid, name, aliases)
+        SELECT c.id, c.name, {aliases_sql.format('c.id')} FROM cities AS c
+    ''')
+
+
+def _add_city_aliases(cursor, city_id, aliases):
+    """为城市添加别名（已有的别名忽略）"""
+    cursor.executemany(
+        'INSERT OR IGNORE INTO main.city_aliases (city_id, alias) VALUES (?, ?)',
+        [(city_id, alias.strip()) for alias in aliases if alias.strip()]
+    )
+
+
+def _get_or_create_city(cursor, name, coords, country=None):
+    """
+    返回城市在cities表中的ID，不存在时以给定坐标新建
+    城市名不区分大小写，已存在的城市保留其规范名称和坐标（只补全缺失的国家）
+    """
+    name = name.strip()
+    cursor.execute('SELECT id, country FROM main.cities WHERE name = ?', (name,))
+    row = cursor.fetchone()
+    if row:
+        if country and not row[1]:
+            cursor.execute('UPDATE main.cities SET country = ? WHERE id = ?', (country, row[0]))
+        return row[0]
+    cursor.execute(
+        'INSERT INTO main.cities (name, lat, lon, country) VALUES (?, ?, ?, ?)',
+        (name, coords[0], coords[1], country)
+    )
+    city_id = cursor.lastrowid
+    _add_city_aliases(cursor, city_id, search_utils.city_aliases(name))
+    return city_id
+
+
+def _migrate_legacy_flights(cursor, alias='main'):
+    """
+    将旧版flights表（每行重复保存城市名和JSON坐标）迁移为引用cities表的规范化结构
+    旧表不存在或已迁移时什么都不做
+    返回: 是否执行了迁移
+    """
+    cursor.execute(f'PRAGMA {alias}.table_info(flights)')
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'departure_coords' not in columns:
+        return False
+
+    flight_time_sql = 'flight_time' if 'flight_time' in columns else 'NULL'
+    cursor.execute(f"""
+        SELECT id, departure_city, arrival_city, date, distance,
+               departure_coords, arrival_coords, {flight_time_sql}, created_at
+        FROM {alias}.flights
+    """)
+    rows = cursor.fetchall()
+
+    # 同名城市只建一次，以最先出现的坐标为准
+    city_ids = {}
+
+    def intern_city(name, coords_json):
+        key = name.strip()
+        if key not in city_ids:
+            city_ids[key] = _get_or_create_city(cursor, name, json.loads(coords_json))
+        return city_ids[key]
+
+    migrated = []
+    for row in rows:
+        migrated.append((
+            row[0],
+            intern_city(row[1], row[5]),
+            intern_city(row[2], row[6]),
+            row[3], row[4], row[7], row[8]
+        ) + (None,) * (len(FLIGHT_COLUMNS) - 7))
+
+    cursor.execute(FLIGHTS_TABLE_SQL.format(table=f'{alias}.flights_normalized'))
+    cursor.executemany(f"""
+        INSERT INTO {alias}.flights_normalized ({', '.join(FLIGHT_COLUMNS)})
+        VALUES ({', '.join('?' * len(FLIGHT_COLUMNS))})
+    """, migrated)
+    # 保留自增序列的高水位，避免已删除记录的ID被重新使用
+    cursor.execute(f"SELECT seq FROM {alias}.sqlite_sequence WHERE name = 'flights'")
+    sequence = cursor.fetchone()
+    cursor.execute(f'DROP TABLE {alias}.flights')
+    cursor.execute(f'ALTER TABLE {alias}.flights_normalized RENAME TO flights')
+    if sequence:
+        cursor.execute(
+            f"UPDATE {alias}.sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'flights'",
+            (sequence[0],)
+        )
+    return True
+
+
+def _attach_archives(conn, db_file=None):
+    """
+    ATTACH所有归档数据库，并创建临时视图all_flights（热分区 UNION ALL 各归档分区）
+    没有归档文件时视图只包含热分区，查询方可以始终使用all_flights
+    返回: 已挂载的归档别名列表
+    """
+    cursor = conn.cursor()
+    columns = ', '.join(FLIGHT_COLUMNS)
+    selects = [f'SELECT {columns} FROM main.flights']
+    aliases = []
+    for idx, path in enumerate(list_archive_files(db_file)):
+        alias = f'archive_{idx}'
+        cursor.execute(f'ATTACH DATABASE ? AS {alias}', (path,))
+        _ensure_archive_schema(cursor, alias)
+        selects.append(f'SELECT {columns} FROM {alias}.flights')
+        aliases.append(alias)
+    cursor.execute('DROP VIEW IF EXISTS temp.all_flights')
+    cursor.execute('CREATE TEMP VIEW all_flights AS ' + ' UNION ALL '.join(selects))
+    conn.commit()
+    return aliases
+
+
+class _PooledConnection(sqlite3.Connection):
+    """
+    连接注册表中的连接：close()时不真正关闭，回滚未提交的事务后放回注册表供下次复用
+    """
+
+    def close(self):
+        _registry.release(self)
+
+
+class ConnectionRegistry:
+    """
+    按 (数据库文件, 是否挂载归档) 缓存打开的连接
+    每个连接同一时间只借给一个线程使用，归还后按最近使用顺序保存；
+    空闲连接超过max_idle个时关闭最久未使用的，空闲超过idle_seconds秒的在下次取用时关闭
+    """
+
+    def __init__(self, max_idle=CONNECTION_POOL_SIZE, idle_seconds=CONNECTION_IDLE_SECONDS):
+        self.max_idle = max_idle
+        self.idle_seconds = idle_seconds
+        self._idle = OrderedDict()  # 连接 -> 归还时间，最久未使用的在前
+        self._lock = threading.Lock()
+
+    def acquire(self, db_file, attach_archives=False):
+        """借出一个连接（有空闲连接时复用，否则新建）"""
+        key = (os.path.abspath(db_file), attach_archives)
+        expired = []
+        conn = None
+        with self._lock:
+            now = time.monotonic()
+            for idle_conn, released_at in list(self._idle.items()):
+                if now - released_at > self.idle_seconds:
+                    del self._idle[idle_conn]
+                    expired.append(idle_conn)
+            for idle_conn in reversed(self._idle):
+                if idle_conn.registry_key == key:
+                    del self._idle[idle_conn]
+                    conn = idle_conn
+                    break
+        for idle_conn in expired:
+            sqlite3.Connection.close(idle_conn)
+
+        if conn is None:
+            conn = sqlite3.connect(db_file, check_same_thread=False, factory=_PooledConnection)
+            conn.registry_key = key
+            conn.archive_files = None
+        if attach_archives:
+            archive_files = list_archive_files(db_file)
+            if conn.archive_files != archive_files:
+                # 新增了归档文件（或第一次使用），重新挂载所有归档分区
+                for alias in _archive_aliases(conn.cursor()):
+                    conn.execute(f'DETACH DATABASE {alias}')
+                _attach_archives(conn, db_file)
+                conn.archive_files = archive_files
+        return conn
+
+    def release(self, conn):
+        """归还连接；连接状态异常时直接关闭"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            sqlite3.Connection.close(conn)
+            return
+        evicted = []
+        with self._lock:
+            self._idle[conn] = time.monotonic()
+            while len(self._idle) > self.max_idle:
+                evicted.append(self._idle.popitem(last=False)[0])
+        for idle_conn in evicted:
+            sqlite3.Connection.close(idle_conn)
+
+    def close_all(self, db_file=None):
+        """关闭所有空闲连接（指定db_file时只关闭该数据库的连接，例如删除或替换数据库文件之前）"""
+        path = os.path.abspath(db_file) if db_file else None
+        with self._lock:
+            closing = [conn for conn in self._idle if path is None or conn.registry_key[0] == path]
+            for conn in closing:
+                del self._idle[conn]
+        for conn in closing:
+            sqlite3.Connection.close(conn)
+
+
+_registry = ConnectionRegistry()
+
+
+def _connect(attach_archives=False, db_file=None):
+    """
+    从连接注册表取得数据库连接（用完调用close()归还）
+    attach_archives: 是否挂载归档分区并创建全量历史视图all_flights
+    db_file: 数据库文件，省略时使用当前线程的用户配置（current_db_file）
+    """
+    return _registry.acquire(db_file or current_db_file(), attach_archives)
+
+
+def _archive_aliases(cursor):
+    """返回当前连接上已挂载的归档分区别名列表"""
+    cursor.execute('PRAGMA database_list')
+    return [row[1] for row in cursor.fetchall() if row[1].startswith('archive_')]
+
+
+def _find_partition(cursor, flight_id, aliases):
+    """
+    查找指定ID的记录所在的分区
+    返回: 分区别名（'main' 或归档别名），找不到时返回None
+    """
+    for alias in ['main'] + aliases:
+        cursor.execute(f'SELECT 1 FROM {alias}.flights WHERE id = ?', (flight_id,))
+        if cursor.fetchone():
+            return alias
+    return None
+
+
+def _bump_data_version(cursor):
+    """
+    递增数据版本号（与修改操作处于同一事务）
+    快照、统计缓存等通过比较版本号判断数据是否发生了变化
+    """
+    cursor.execute("UPDATE main.meta SET value = value + 1 WHERE key = 'data_version'")
+
+
+def get_data_version():
+    """
+    获取当前数据版本号，每次提交航班或城市的修改后都会递增
+    （SQLite的PRAGMA data_version只在单个连接内有效，无法跨进程重启比较，所以持久化在meta表中）
+    返回: 整数版本号
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT value FROM meta WHERE key = 'data_version'")
+    row = cursor.fetchone()
+    conn.close()
+    return int(row[0]) if row else 0
+
+
+def get_write_marker():
+    """
+    返回 (数据版本号, 最新的日志批次ID)
+    会话写入前取一次，写入后用writes_since判断期间的变化是否只来自自己的这一次写入
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT value FROM meta WHERE key = 'data_version'")
+    row = cursor.fetchone()
+    cursor.execute('SELECT COALESCE(MAX(id), 0) FROM journal_batches')
+    batch_id = cursor.fetchone()[0]
+    conn.close()
+    return (int(row[0]) if row else 0, batch_id)
+
+
+def writes_since(marker):
+    """
+    返回get_write_marker取得marker之后 (数据版本号增加了多少, 新增了多少个日志批次)
+    一次用户操作是一个日志批次，写入队列合并提交的一批修改只递增一次版本号，
+    所以结果为 (1, 1) 说明期间只有一次提交、其中只有一个操作
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT value FROM meta WHERE key = 'data_version'")
+    row = cursor.fetchone()
+    cursor.execute('SELECT COUNT(*) FROM journal_batches WHERE id > ?', (marker[1],))
+    batches = cursor.fetchone()[0]
+    conn.close()
+    return ((int(row[0]) if row else 0) - marker[0], batches)
+
+
+def load_flight_time_inputs():
+    """
+    读取估算飞行时间所需的数据（与数据版本号在同一个读事务中读取，两者一致）
+    返回: (数据版本号, 行列表)，每行为 (航班ID, 出发城市ID, 到达城市ID, 距离, 飞行时间, 估算的飞行时间)
+    """
+    conn = _connect(attach_archives=True)
+    cursor = conn.cursor()
+    cursor.execute('BEGIN')
+    cursor.execute("SELECT value FROM meta WHERE key = 'data_version'")
+    row = cursor.fetchone()
+    cursor.execute('''
+        SELECT id, departure_city_id, arrival_city_id, distance, flight_time, estimated_flight_time
+        FROM all_flights
+    ''')
+    rows = cursor.fetchall()
+    conn.rollback()
+    conn.close()
+    return (int(row[0]) if row else 0), rows
+
+
+def get_flight_time_estimate_state():
+    """
+    读取上次估算飞行时间的状态（estimate_utils写入的模型和实测/估算合计）
+    返回: 状态字典，从未估算过时返回None
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT value FROM meta WHERE key = 'flight_time_estimates'")
+    row = cursor.fetchone()
+    conn.close()
+    return json.loads(row[0]) if row else None
+
+
+def store_flight_time_estimates(version, estimates, state):
+    """
+    写入估算的飞行时间和估算状态
+    估算值是由航班数据推导出的结果，写入时不递增数据版本号（否则各处按版本缓存的结果都会失效）；
+    读取数据之后如果又有新的修改（数据版本号已不是version），放弃写入，由调用方重新估算
+
+    参数:
+        version: 估算所依据的数据版本号
+        estimates: [(估算的分钟数, 航班ID)]，分钟数为None表示清除估算值
+        state: 估算状态字典，以JSON保存在meta表中
+    返回: 是否已写入
+    """
+    conn = _connect(attach_archives=True)
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    cursor.execute("SELECT value FROM meta WHERE key = 'data_version'")
+    row = cursor.fetchone()
+    if (int(row[0]) if row else 0) != version:
+        conn.rollback()
+        conn.close()
+        return False
+    for alias in ['main'] + _archive_aliases(cursor):
+        cursor.executemany(f'UPDATE {alias}.flights SET estimated_flight_time = ? WHERE id = ?', estimates)
+    cursor.execute(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES ('flight_time_estimates', ?)",
+        (json.dumps(state),)
+    )
+    conn.commit()
+    conn.close()
+    return True
+
+def _hot_partition_cutoff(hot_years):
+    """
+    返回热分区的起始日期字符串，早于该日期的记录属于归档分区
+    例如: 当前为2026年、hot_years=2 -> '2025-01-01'
+    """
+    return f"{datetime.now().year - hot_years + 1:04d}-01-01"
+
+
+def _move_flights(cursor, source, target, where, params):
+    """
+    把source分区中满足where条件的记录移动到target分区
+    WAL模式下跨数据库文件的提交不是原子的（各文件分别提交，中途崩溃时可能只有一部分生效），
+    所以分两步各自提交：先复制target中还没有的记录（按uid判断），再删除source中target已有uid的记录。
+    中途中断时记录只会暂时同时出现在两个分区中，不会丢失，重新执行即可完成移动
+    返回: 移动的记录数
+    """
+    columns = ', '.join(FLIGHT_COLUMNS)
+    cursor.execute(f'''
+        INSERT INTO {target}.flights ({columns})
+        SELECT {columns} FROM {source}.flights AS f
+        WHERE {where} AND NOT EXISTS (SELECT 1 FROM {target}.flights AS t WHERE t.uid = f.uid)
+    ''', params)
+    if cursor.rowcount:
+        _bump_data_version(cursor)
+    cursor.connection.commit()
+    cursor.execute(f'''
+        DELETE FROM {source}.flights
+        WHERE {where} AND uid IN (SELECT uid FROM {target}.flights)
+    ''', params)
+    moved = cursor.rowcount
+    if moved:
+        _bump_data_version(cursor)
+    cursor.connection.commit()
+    return moved
+
+
+def archive_old_flights(hot_years=None):
+    """
+    分区维护：将早于热分区起始年份的记录移动到按年份分桶的归档数据库中，
+    并把归档数据库中修改后属于热分区年份的记录移回热分区（init_database时执行）
+    每一步移动都可以安全地重复执行，上次中途中断留下的重复记录会在这里完成移动
+    hot_years: 热分区保留的年数，默认使用HOT_PARTITION_YEARS
+    返回: 移动的记录数
+    """
+    hot_years = hot_years or HOT_PARTITION_YEARS
+    if not hot_years:
+        return 0
+    cutoff = _hot_partition_cutoff(hot_years)
+
+    conn = _connect()
+    cursor = conn.cursor()
+    # 借助日期索引，只需检查热分区中早于cutoff的部分
+    cursor.execute('SELECT DISTINCT substr(date, 1, 4) FROM flights WHERE date < ?', (cutoff,))
+    years = sorted(int(row[0]) for row in cursor.fetchall())
+    buckets = sorted({year - year % ARCHIVE_SPAN_YEARS for year in years})
+
+    # (归档文件, 移动方向, 条件, 参数)
+    moves = []
+    for start_year in buckets:
+        low = f"{start_year:04d}-01-01"
+        high = min(f"{start_year + ARCHIVE_SPAN_YEARS:04d}-01-01", cutoff)
+        moves.append((_archive_file(start_year), ('main', 'archive'), 'date >= ? AND date < ?', (low, high)))
+    for path in list_archive_files():
+        moves.append((path, ('archive', 'main'), 'date >= ?', (cutoff,)))
+
+    moved = 0
+    for path, (source, target), where, params in moves:
+        # 逐个归档库挂载，避免超过SQLite的ATTACH数量上限
+        cursor.execute('ATTACH DATABASE ? AS archive', (path,))
+        try:
+            _ensure_archive_schema(cursor, 'archive')
+            conn.commit()
+            moved += _move_flights(cursor, source, target, where, params)
+        finally:
+            # 连接会被注册表复用，出错时也要先回滚再卸载
+            conn.rollback()
+            cursor.execute('DETACH DATABASE archive')
+    conn.close()
+    return moved
+
+
+def _flights_in_range(cursor, start_key=None, end_key=None):
+    """
+    按 (date, id) 升序读取全量历史中位于 [start_key, end_key] 区间内的航班（供行程拼接使用）
+    start_key/end_key: (date, id) 元组，None表示不设边界
+    """
+    conditions = []
+    params = []
+    if start_key:
+        conditions.append('(date, id) >= (?, ?)')
+        params.extend(start_key)
+    if end_key:
+        conditions.append('(date, id) <= (?, ?)')
+        params.extend(end_key)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    cursor.execute(f'''
+        SELECT id, date, departure_city_id, arrival_city_id, distance, flight_time
+        FROM all_flights {where}
+        ORDER BY date, id
+    ''', params)
+    return [
+        {
+            'id': row[0], 'date': row[1], 'departure_city_id': row[2],
+            'arrival_city_id': row[3], 'distance': row[4], 'flight_time': row[5]
+        }
+        for row in cursor.fetchall()
+    ]
+
+
+def _insert_trips(cursor, flights):
+    """对一段连续的航班做线性拼接，并把得到的行程写入trips表"""
+    for legs in trip_utils.stitch_trips(flights):
+        trip = trip_utils.summarize_trip(legs)
+        cursor.execute('''
+            INSERT INTO main.trips (start_date, start_flight_id, end_date, end_flight_id,
+                                    origin_city_id, destination_city_id, leg_count,
+                                    total_distance, total_flight_time, layover_city_ids)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            trip['start_date'], trip['start_flight_id'], trip['end_date'], trip['end_flight_id'],
+            trip['origin_city_id'], trip['destination_city_id'], trip['leg_count'],
+            trip['total_distance'], trip['total_flight_time'], json.dumps(trip['layover_city_ids'])
+        ))
+
+
+def _refresh_trips(cursor, dates):
+    """
+    增量更新受影响日期附近的行程（需要连接上已有all_flights视图）
+    行程是 (date, id) 排序序列上的连续片段，某个位置的增删改只会影响与其相邻的断点，
+    所以只需从"变化位置之前最后一个航班所在行程"的起点，重算到"变化位置之后第一个航班所在行程"的终点
+    dates: 发生变化的日期（修改日期时同时传入新旧日期）
+    """
+    low, high = min(dates), max(dates)
+
+    start_key = None
+    cursor.execute(
+        'SELECT date, id FROM all_flights WHERE date < ? ORDER BY date DESC, id DESC LIMIT 1', (low,)
+    )
+    previous = cursor.fetchone()
+    if previous:
+        cursor.execute('''
+            SELECT start_date, start_flight_id FROM main.trips
+            WHERE (start_date, start_flight_id) <= (?, ?)
+            ORDER BY start_date DESC, start_flight_id DESC LIMIT 1
+        ''', previous)
+        start_key = cursor.fetchone() or previous
+
+    end_key = None
+    cursor.execute(
+        'SELECT date, id FROM all_flights WHERE date > ? ORDER BY date, id LIMIT 1', (high,)
+    )
+    following = cursor.fetchone()
+    if following:
+        cursor.execute('''
+            SELECT end_date, end_flight_id FROM main.trips
+            WHERE (end_date, end_flight_id) >= (?, ?)
+            ORDER BY end_date, end_flight_id LIMIT 1
+        ''', following)
+        end_key = cursor.fetchone() or following
+
+    conditions = []
+    params = []
+    if start_key:
+        conditions.append('(start_date, start_flight_id) >= (?, ?)')
+        params.extend(start_key)
+    if end_key:
+        conditions.append('(end_date, end_flight_id) <= (?, ?)')
+        params.extend(end_key)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    cursor.execute(f'DELETE FROM main.trips {where}', params)
+    _insert_trips(cursor, _flights_in_range(cursor, start_key, end_key))
+
+
+def rebuild_trips():
+    """
+    根据全量历史重新拼接所有行程
+    （修改trip_utils.MAX_LAYOVER_DAYS之后需要调用一次）
+    """
+    conn = _connect(attach_archives=True)
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM trips')
+    _insert_trips(cursor, _flights_in_range(cursor))
+    _bump_data_version(cursor)
+    conn.commit()
+    conn.close()
+
+
+def _count_flight(cursor, departure_city_id, arrival_city_id, delta):
+    """
+    在当前事务中更新城市和航线计数表（新增记录delta为1，删除记录为-1），计数归零的行随即删除
+    """
+    cursor.executemany('''
+        INSERT INTO main.city_visit_counts (city_id, visits) VALUES (?, ?)
+        ON CONFLICT (city_id) DO UPDATE SET visits = visits + excluded.visits
+    ''', [(departure_city_id, delta), (arrival_city_id, delta)])
+    cursor.execute('''
+        INSERT INTO main.route_counts (departure_city_id, arrival_city_id, flights) VALUES (?, ?, ?)
+        ON CONFLICT (departure_city_id, arrival_city_id) DO UPDATE SET flights = flights + excluded.flights
+    ''', (departure_city_id, arrival_city_id, delta))
+    if delta < 0:
+        cursor.execute(
+            'DELETE FROM main.city_visit_counts WHERE city_id IN (?, ?) AND visits <= 0',
+            (departure_city_id, arrival_city_id)
+        )
+        cursor.execute(
+            'DELETE FROM main.route_counts WHERE departure_city_id = ? AND arrival_city_id = ? AND flights <= 0',
+            (departure_city_id, arrival_city_id)
+        )
+
+
+def _rebuild_counts(cursor):
+    """在当前事务中根据全量历史（需要all_flights视图）重新计算城市和航线计数表"""
+    cursor.execute('DELETE FROM main.city_visit_counts')
+    cursor.execute('DELETE FROM main.route_counts')
+    cursor.execute('''
+        INSERT INTO main.city_visit_counts (city_id, visits)
+        SELECT city_id, COUNT(*)
+        FROM (
+            SELECT departure_city_id AS city_id FROM all_flights
+            UNION ALL
+            SELECT arrival_city_id AS city_id FROM all_flights
+        )
+        GROUP BY city_id
+    ''')
+    cursor.execute('''
+        INSERT INTO main.route_counts (departure_city_id, arrival_city_id, flights)
+        SELECT departure_city_id, arrival_city_id, COUNT(*)
+        FROM all_flights
+        GROUP BY departure_city_id, arrival_city_id
+    ''')
+
+
+def rebuild_rankings():
+    """
+    根据全量历史重新计算城市和航线计数表
+    （计数表在每次写入时增量维护，正常情况下不需要调用）
+    """
+    conn = _connect(attach_archives=True)
+    cursor = conn.cursor()
+    _rebuild_counts(cursor)
+    _bump_data_version(cursor)
+    conn.commit()
+    conn.close()
+
+
+def get_top_cities(limit=20, offset=0):
+    """
+    按到访次数读取城市排行的一页（作为出发城市和到达城市各算一次）
+    直接按计数表的 (visits, city_id) 索引顺序读取，开销只与limit有关，与去过的城市总数无关
+    返回: [(城市名, 次数)]，次数相同时先去过的城市（ID较小）在前
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT c.name, r.visits
+        FROM city_visit_counts AS r
+        JOIN cities AS c ON c.id = r.city_id
+        ORDER BY r.visits DESC, r.city_id
+        LIMIT ? OFFSET ?
+    ''', (limit, offset))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def get_top_routes(limit=20, offset=0):
+    """
+    按航班次数读取航线排行的一页（有方向：A → B 与 B → A 分别统计）
+    返回: [(出发城市, 到达城市, 次数)]
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT dc.name, ac.name, r.flights
+        FROM route_counts AS r
+        JOIN cities AS dc ON dc.id = r.departure_city_id
+        JOIN cities AS ac ON ac.id = r.arrival_city_id
+        ORDER BY r.flights DESC, r.departure_city_id, r.arrival_city_id
+        LIMIT ? OFFSET ?
+    ''', (limit, offset))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def get_ranking_sizes():
+    """
+    返回: (去过的城市数, 飞过的航线数)
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    city_count = cursor.execute('SELECT COUNT(*) FROM city_visit_counts').fetchone()[0]
+    route_count = cursor.execute('SELECT COUNT(*) FROM route_counts').fetchone()[0]
+    conn.close()
+    return city_count, route_count
+
+
+def get_trip_stats():
+    """
+    获取行程统计（直接读取trips表，不需要重新拼接）
+    返回: 字典，包含行程数、多段行程数、总距离、最长行程和各中转城市的次数
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT COUNT(*), COALESCE(SUM(leg_count > 1), 0), COALESCE(SUM(total_distance), 0)
+        FROM trips
+    ''')
+    trip_count, multi_leg_count, total_distance = cursor.fetchone()
+
+    cursor.execute('''
+        SELECT o.name, d.name, t.leg_count, t.total_distance
+        FROM trips AS t
+        JOIN cities AS o ON o.id = t.origin_city_id
+        JOIN cities AS d ON d.id = t.destination_city_id
+        ORDER BY t.total_distance DESC LIMIT 1
+    ''')
+    longest = cursor.fetchone()
+
+    city_names = dict(cursor.execute('SELECT id, name FROM cities').fetchall())
+    layover_counts = {}
+    cursor.execute('SELECT layover_city_ids FROM trips WHERE leg_count > 1')
+    for (layover_json,) in cursor.fetchall():
+        for city_id in json.loads(layover_json):
+            name = city_names.get(city_id)
+            if name:
+                layover_counts[name] = layover_counts.get(name, 0) + 1
+    conn.close()
+
+    return {
+        'trip_count': trip_count,
+        'multi_leg_count': multi_leg_count,
+        'total_distance': total_distance,
+        'longest_trip': {
+            'origin': longest[0], 'destination': longest[1],
+            'leg_count': longest[2], 'distance': longest[3]
+        } if longest else None,
+        'layover_counts': layover_counts
+    }
+
+
+def init_database():
+    """
+    初始化SQLite数据库，创建cities表和flights表（如果不存在）
+    旧版数据库（城市名和坐标直接存在flights表中）会被迁移为规范化结构
+    启用分区时，顺便把过期的记录移入归档数据库
+    """
+    directory = os.path.dirname(current_db_file())
+    if directory:
+        # 用户配置的数据库放在PROFILES_DIR中，第一次使用时创建目录
+        os.makedirs(directory, exist_ok=True)
+    conn = _connect()
+    cursor = conn.cursor()
+    # WAL模式下读操作不会阻塞写操作（后台任务边流式读取边写入、多个会话同时访问时都依赖这一点）
+    cursor.execute('PRAGMA journal_mode=WAL')
+    # 键值元数据（数据版本号等）
+    cursor.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)')
+    cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('data_version', 0)")
+    # 已折叠进检查点的最大日志ID（增量同步时早于它的位置需要全量同步）
+    cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('journal_checkpoint', 0)")
+    # 同步：本机设备ID和本机修改序号
+    cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('device_id', ?)", (uuid.uuid4().hex,))
+    cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('change_seq', 1)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cities (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE COLLATE NOCASE,
+            lat REAL NOT NULL,
+            lon REAL NOT NULL,
+            country TEXT
+        )
+    ''')
+
+    # 城市别名（中英文名、拼音、旧称等），与城市名一起建立全文索引供搜索使用
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'city_aliases'")
+    aliases_missing = cursor.fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS city_aliases (
+            city_id INTEGER NOT NULL REFERENCES cities(id),
+            alias TEXT NOT NULL COLLATE NOCASE,
+            PRIMARY KEY (city_id, alias)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_city_aliases_alias ON city_aliases(alias)')
+    _create_city_search(cursor)
+
+    # 检查旧版flights表：缺少flight_time列的先补上，再整体迁移到规范化结构
+    cursor.execute("PRAGMA table_info(flights)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if columns and 'flight_time' not in columns:
+        cursor.execute('ALTER TABLE flights ADD COLUMN flight_time INTEGER')
+    migrated = _migrate_legacy_flights(cursor)
+    if aliases_missing:
+        # 为已有城市补上内置别名
+        cursor.execute('SELECT id, name FROM cities')
+        for city_id, name in cursor.fetchall():
+            _add_city_aliases(cursor, city_id, search_utils.city_aliases(name))
+
+    cursor.execute(FLIGHTS_TABLE_SQL.format(table='flights'))
+    _create_flight_indexes(cursor)
+    _ensure_fingerprints(cursor)
+    _ensure_sync_columns(cursor)
+    _ensure_estimate_column(cursor)
+
+    # 删除记录的墓碑：同步时把删除传播到其他设备
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS flight_tombstones (
+            uid TEXT PRIMARY KEY,
+            deleted_at TEXT NOT NULL,
+            deleted_by TEXT NOT NULL,
+            change_seq INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tombstones_change_seq ON flight_tombstones(change_seq)')
+    # 同步对端的水位线：sent_seq是已发给对端的本机修改序号，received_seq是已应用的对端修改序号
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_peers (
+            peer_id TEXT PRIMARY KEY,
+            sent_seq INTEGER NOT NULL DEFAULT 0,
+            received_seq INTEGER NOT NULL DEFAULT 0,
+            synced_at TIMESTAMP
+        )
+    ''')
+
+    # 行程表：每行是一段连续航班，起止位置用 (date, flight_id) 表示
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'trips'")
+    trips_missing = cursor.fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS trips (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            start_date TEXT NOT NULL,
+            start_flight_id INTEGER NOT NULL,
+            end_date TEXT NOT NULL,
+            end_flight_id INTEGER NOT NULL,
+            origin_city_id INTEGER NOT NULL REFERENCES cities(id),
+            destination_city_id INTEGER NOT NULL REFERENCES cities(id),
+            leg_count INTEGER NOT NULL,
+            total_distance REAL NOT NULL,
+            total_flight_time INTEGER,
+            layover_city_ids TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_trips_start ON trips(start_date, start_flight_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_trips_end ON trips(end_date, end_flight_id)')
+
+    # 城市到访次数和航线次数的计数表，每次写入航班时增量维护，排行直接按索引读取前几名
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'route_counts'")
+    counts_missing = cursor.fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS city_visit_counts (
+            city_id INTEGER PRIMARY KEY REFERENCES cities(id),
+            visits INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_city_visit_counts_rank ON city_visit_counts(visits DESC, city_id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS route_counts (
+            departure_city_id INTEGER NOT NULL REFERENCES cities(id),
+            arrival_city_id INTEGER NOT NULL REFERENCES cities(id),
+            flights INTEGER NOT NULL,
+            PRIMARY KEY (departure_city_id, arrival_city_id)
+        )
+    ''')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_route_counts_rank ON route_counts(flights DESC, departure_city_id, arrival_city_id)'
+    )
+
+    # 后台任务表：progress是已处理的条数，同时作为重启后恢复执行的断点
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL,
+            status TEXT NOT NULL,
+            progress INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            result TEXT,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)')
+    # 任务的日志批次：分块提交的任务把所有块的修改写入同一个批次，整个任务作为一步撤销（旧表补列）
+    cursor.execute('PRAGMA table_info(jobs)')
+    if 'batch_id' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE jobs ADD COLUMN batch_id INTEGER')
+
+    # 只追加的修改日志：每次用户操作是一个批次，批次内每条航班的增删改（以及城市的修改和合并）是一条日志（前后快照为JSON）
+    # 撤销/重做不修改已有日志，而是追加一个反向操作的批次（kind为undo/redo，reverts指向被撤销的批次）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS journal_batches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            action TEXT NOT NULL,
+            kind TEXT NOT NULL DEFAULT 'change',
+            reverts INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS journal (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            batch_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            flight_id INTEGER NOT NULL,
+            before TEXT,
+            after TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_journal_batch ON journal(batch_id)')
+
+    conn.commit()
+    if migrated:
+        # 迁移后回收旧表占用的空间
+        conn.execute('VACUUM')
+    conn.close()
+
+    if HOT_PARTITION_YEARS:
+        archive_old_flights()
+    if trips_missing:
+        rebuild_trips()
+    if counts_missing:
+        rebuild_rankings()
+
+
+def _flight_snapshots(cursor, where='', params=()):
+    """
+    读取航班的完整快照（连同城市名和坐标，之后城市被修改或合并也能按原样恢复）
+    where: 针对all_flights（别名f）的筛选条件
+    返回: {航班ID: 快照字典}，快照的字段与save_flight_to_db接受的航班信息字典相同
+    """
+    cursor.execute(f'''
+        SELECT f.id, dc.name, ac.name, dc.lat, dc.lon, ac.lat, ac.lon, f.date, f.distance, f.flight_time, f.uid
+        FROM all_flights AS f
+        JOIN main.cities AS dc ON dc.id = f.departure_city_id
+        JOIN main.cities AS ac ON ac.id = f.arrival_city_id
+        {where}
+    ''', params)
+    return {
+        row[0]: {
+            'departure_city': row[1],
+            'arrival_city': row[2],
+            'departure_coords': [row[3], row[4]],
+            'arrival_coords': [row[5], row[6]],
+            'date': row[7],
+            'distance': row[8],
+            'flight_time': row[9],
+            'uid': row[10]
+        }
+        for row in cursor.fetchall()
+    }
+
+
+def _compact_journal(cursor, keep_batches):
+    """
+    把最近keep_batches个批次之前的日志折叠进检查点
+    航班表本身就是检查点时刻之后的完整状态，所以折叠只需记下被删除的最大日志ID
+    返回: 删除的日志条数
+    """
+    cursor.execute(
+        'SELECT id FROM main.journal_batches ORDER BY id DESC LIMIT 1 OFFSET ?', (max(keep_batches, 1) - 1,)
+    )
+    row = cursor.fetchone()
+    if not row:
+        return 0
+    cursor.execute('SELECT MAX(id) FROM main.journal WHERE batch_id < ?', (row[0],))
+    checkpoint = cursor.fetchone()[0]
+    if checkpoint:
+        cursor.execute(
+            "UPDATE main.meta SET value = MAX(value, ?) WHERE key = 'journal_checkpoint'", (checkpoint,)
+        )
+    cursor.execute('DELETE FROM main.journal WHERE batch_id < ?', (row[0],))
+    removed = cursor.rowcount
+    cursor.execute('DELETE FROM main.journal_batches WHERE id < ?', (row[0],))
+    return removed
+
+
+def compact_journal(keep_batches=None):
+    """
+    压缩修改日志，只保留最近keep_batches个批次（默认JOURNAL_KEEP_BATCHES；写入时超过JOURNAL_MAX_BATCHES会自动压缩）
+    返回: 删除的日志条数
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    removed = _compact_journal(cursor, keep_batches or JOURNAL_KEEP_BATCHES)
+    conn.commit()
+    conn.close()
+    return removed
+
+
+def _begin_batch(cursor, action, kind='change', reverts=None):
+    """
+    在当前事务中开始一个日志批次（一次用户操作对应一个批次，撤销和重做都以批次为单位）
+    action: 操作名称（显示在撤销/重做按钮上）
+    返回: 批次ID
+    """
+    cursor.execute('SELECT COUNT(*) FROM main.journal_batches')
+    if cursor.fetchone()[0] >= JOURNAL_MAX_BATCHES:
+        _compact_journal(cursor, JOURNAL_KEEP_BATCHES)
+    cursor.execute(
+        'INSERT INTO main.journal_batches (action, kind, reverts) VALUES (?, ?, ?)', (action, kind, reverts)
+    )
+    return cursor.lastrowid
+
+
+def _use_batch(cursor, batch_id, action):
+    """
+    返回本次写入使用的日志批次：指定的batch_id仍然存在时沿用它（后台任务分块提交时），
+    否则（未指定，或已被折叠进检查点）开始一个新的批次
+    """
+    if batch_id is not None:
+        cursor.execute('SELECT 1 FROM main.journal_batches WHERE id = ?', (batch_id,))
+        if cursor.fetchone():
+            return batch_id
+    return _begin_batch(cursor, action)
+
+
+def begin_batch(action):
+    """
+    单独开始一个日志批次（后台任务分多个事务写入时使用：各块都传入这个批次ID，整个任务作为一步撤销）
+    返回: 批次ID
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    batch_id = _begin_batch(cursor, action)
+    conn.commit()
+    conn.close()
+    return batch_id
+
+
+def discard_empty_batch(batch_id):
+    """删除没有任何日志的批次（例如导入的记录全部重复），不留下撤销后什么也不做的步骤"""
+    conn = _connect()
+    conn.execute(
+        'DELETE FROM journal_batches WHERE id = ? AND NOT EXISTS (SELECT 1 FROM journal WHERE batch_id = ?)',
+        (batch_id, batch_id)
+    )
+    conn.commit()
+    conn.close()
+
+
+def _journal(cursor, batch_id, op, flight_id, before=None, after=None):
+    """
+    追加一条日志
+    op: insert / update / delete；before/after: 修改前后的航班快照
+        city / merge / split（城市的修改、合并和撤销合并）: flight_id为城市ID，before/after见_set_city、_merge_city
+    """
+    cursor.execute(
+        'INSERT INTO main.journal (batch_id, op, flight_id, before, after) VALUES (?, ?, ?, ?, ?)',
+        (
+            batch_id, op, flight_id,
+            json.dumps(before, ensure_ascii=False) if before else None,
+            json.dumps(after, ensure_ascii=False) if after else None
+        )
+    )
+
+
+def _insert_flight(cursor, flight_record, batch_id, flight_id=None):
+    """
+    在当前事务中插入一条航班记录（城市不存在时自动创建），并写入日志批次batch_id
+    flight_id: 指定记录ID（撤销删除时恢复原ID），默认自动分配
+    flight_record中的uid、updated_at、updated_by（同步时使用）可选，省略时生成新的uid和本地版本
+    与已有记录重复时抛出DuplicateFlightError
+    返回: 插入的记录ID
+    """
+    departure_city_id = _get_or_create_city(
+        cursor, flight_record['departure_city'], flight_record['departure_coords'],
+        flight_record.get('departure_country')
+    )
+    arrival_city_id = _get_or_create_city(
+        cursor, flight_record['arrival_city'], flight_record['arrival_coords'],
+        flight_record.get('arrival_country')
+    )
+    fingerprint = dedup_utils.flight_fingerprint(
+        departure_city_id, arrival_city_id, flight_record['date'], flight_record.get('flight_time')
+    )
+    _check_duplicate(cursor, fingerprint)
+    uid = flight_record.get('uid') or uuid.uuid4().hex
+    cursor.execute('''
+        INSERT INTO main.flights (id, departure_city_id, arrival_city_id, date, distance, flight_time, fingerprint,
+                                  uid, updated_at, updated_by, change_seq)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        flight_id,
+        departure_city_id,
+        arrival_city_id,
+        flight_record['date'],
+        flight_record['distance'],
+        flight_record.get('flight_time', None),  # 飞行时间（分钟），可选
+        fingerprint,
+        uid
+    ) + _change_stamp(cursor, flight_record))
+    flight_id = cursor.lastrowid
+    _count_flight(cursor, departure_city_id, arrival_city_id, 1)
+    # 恢复已删除的记录（撤销删除、同步）时去掉它的墓碑
+    cursor.execute('DELETE FROM main.flight_tombstones WHERE uid = ?', (uid,))
+    _journal(cursor, batch_id, 'insert', flight_id,
+             after=_flight_snapshots(cursor, 'WHERE f.id = ?', (flight_id,))[flight_id])
+    return flight_id
+
+
+def save_flight_to_db(flight_record):
+    """
+    保存航班记录到数据库（新记录总是写入热分区）
+    flight_record: 包含航班信息的字典
+    返回: 插入的记录ID；与已有记录重复时抛出DuplicateFlightError
+    """
+    return save_flights_to_db([flight_record])[0]
+
+
+def save_flights_to_db(flight_records, skip_duplicates=False, action="添加航班", batch_id=None):
+    """
+    在一个事务中批量保存航班记录（导入等批量写入场景使用）
+    flight_records: 航班信息字典列表
+    skip_duplicates: 为True时跳过重复记录，否则遇到重复记录时整批回滚并抛出DuplicateFlightError
+    action: 日志中的操作名称（整批作为一步撤销）
+    batch_id: 写入已有的日志批次（见begin_batch），省略时整批作为新的一步
+    返回: 插入的记录ID列表（与输入顺序一致，跳过的记录为None）
+    """
+    if not flight_records:
+        return []
+    conn = _connect(attach_archives=True)
+    cursor = conn.cursor()
+    try:
+        batch_id = _use_batch(cursor, batch_id, action)
+        flight_ids = []
+        for record in flight_records:
+            try:
+                flight_ids.append(_insert_flight(cursor, record, batch_id))
+            except DuplicateFlightError:
+                if not skip_duplicates:
+                    raise
+                flight_ids.append(None)
+        dates = [record['date'] for record, flight_id in zip(flight_records, flight_ids) if flight_id]
+        if dates:
+            _refresh_trips(cursor, dates)
+            _bump_data_version(cursor)
+            conn.commit()
+        else:
+            # 全部被跳过时不留下空的日志批次
+            conn.rollback()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return flight_ids
+
+
+def update_flight_distances(distances, batch_id=None):
+    """
+    批量更新航班距离（记录可能位于任一分区）
+    distances: {航班ID: 新距离}
+    batch_id: 写入已有的日志批次（见begin_batch），省略时作为新的一步
+    """
+    if not distances:
+        return
+    conn = _connect(attach_archives=True)
+    cursor = conn.cursor()
+    placeholders = ', '.join('?' * len(distances))
+    before = _flight_snapshots(cursor, f'WHERE f.id IN ({placeholders})', list(distances))
+    params = [(distance,) + _change_stamp(cursor) + (flight_id,) for flight_id, distance in distances.items()]
+    for alias in ['main'] + _archive_aliases(cursor):
+        cursor.executemany(f'''
+            UPDATE {alias}.flights
+            SET distance = ?, updated_at = ?, updated_by = ?, change_seq = ?, estimated_flight_time = NULL
+            WHERE id = ?
+        ''', params)
+    batch_id = _use_batch(cursor, batch_id, "重新计算距离")
+    for flight_id, snapshot in before.items():
+        _journal(cursor, batch_id, 'update', flight_id, before=snapshot,
+                 after=dict(snapshot, distance=distances[flight_id]))
+    # 距离变化不影响行程的拼接方式，只需刷新涉及日期范围内行程的汇总
+    dates = [snapshot['date'] for snapshot in before.values()]
+    if dates:
+        _refresh_trips(cursor, dates)
+    _bump_data_version(cursor)
+    conn.commit()
+    conn.close()
+
+
+def _load_city_map(cursor):
+    """
+    一次性读取cities表
+    返回: {城市ID: (城市名, (纬度, 经度))}，同一城市的名称和坐标对象在所有航班记录间共享
+    """
+    cursor.execute('SELECT id, name, lat, lon FROM main.cities')
+    return {row[0]: (row[1], (row[2], row[3])) for row in cursor.fetchall()}
+
+
+def load_flights_from_db(include_archive=True):
+    """
+    从数据库加载所有航班记录
+    include_archive: 是否包含归档分区的历史记录；为False时只读取热分区
+    返回: 航班记录列表
+    """
+    conn = _connect(attach_archives=include_archive)
+    cursor = conn.cursor()
+    city_map = _load_city_map(cursor)
+    source = 'all_flights' if include_archive else 'flights'
+    cursor.execute(f'''
+        SELECT id, departure_city_id, arrival_city_id, date, distance, flight_time
+        FROM {source} ORDER BY date DESC, id DESC
+    ''')
+    rows = cursor.fetchall()
+    conn.close()
+    return [_flight_dict(row, city_map) for row in rows]
+
+
+def load_flights_by_ids(flight_ids):
+    """
+    按ID加载航班记录（写入后只刷新受影响的记录时使用，城市名和坐标以数据库中解析后的为准）
+    flight_ids: 航班ID列表
+    返回: 航班记录列表（字段与load_flights_from_db相同），不存在的ID会被忽略
+    """
+    flight_ids = list(flight_ids)
+    if not flight_ids:
+        return []
+    conn = _connect(attach_archives=True)
+    cursor = conn.cursor()
+    city_map = _load_city_map(cursor)
+    rows = []
+    # 分批查询，避免超过SQLite的参数个数上限
+    for start in range(0, len(flight_ids), 500):
+        chunk = flight_ids[start:start + 500]
+        cursor.execute(f'''
+            SELECT id, departure_city_id, arrival_city_id, date, distance, flight_time
+            FROM all_flights WHERE id IN ({', '.join('?' * len(chunk))})
+        ''', chunk)
+        rows.extend(cursor.fetchall())
+    conn.close()
+    return [_flight_dict(row, city_map) for row in rows]
+
+
+def _flight_dict(row, city_map):
+    """把 (id, departure_city_id, arrival_city_id, date, distance, flight_time) 行转换为航班记录字典"""
+    departure_city, departure_coords = city_map[row[1]]
+    arrival_city, arrival_coords = city_map[row[2]]
+    flight_dict = {
+        'id': row[0],
+        'departure_city_id': row[1],
+        'arrival_city_id': row[2],
+        'departure_city': departure_city,
+        'arrival_city': arrival_city,
+        'date': row[3],
+        'distance': row[4],
+        'departure_coords': departure_coords,
+        'arrival_coords': arrival_coords
+    }
+    # 确保flight_time是整数类型（SQLite可能返回字符串）
+    flight_time = row[5]
+    try:
+        flight_dict['flight_time'] = int(flight_time) if flight_time is not None else None
+    except (ValueError, TypeError):
+        flight_dict['flight_time'] = None
+    return flight_dict
+
+
+def count_flights(include_archive=True):
+    """
+    统计航班记录数
+    返回: 记录条数
+    """
+    conn = _connect(attach_archives=include_archive)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT COUNT(*) FROM {'all_flights' if include_archive else 'flights'}")
+    count = cursor.fetchone()[0]
+    conn.close()
+    return count
+
+
+def load_flights_page(page=0, page_size=50):
+    """
+    按日期从晚到早读取一页航班记录（分页在SQL中完成，供接口等只需要一页数据的场景使用）
+    返回: {'total': 记录总数, 'flights': 当前页的航班字典列表}，字段与search_flights的结果相同
+    """
+    conn = _connect(attach_archives=True)
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM all_flights')
+    total = cursor.fetchone()[0]
+    cursor.execute('''
+        SELECT f.id, dc.name, ac.name, f.date, f.distance, f.flight_time
+        FROM all_flights AS f
+        JOIN main.cities AS dc ON dc.id = f.departure_city_id
+        JOIN main.cities AS ac ON ac.id = f.arrival_city_id
+        ORDER BY f.date DESC, f.id DESC
+        LIMIT ? OFFSET ?
+    ''', (page_size, page * page_size))
+    flights = [
+        {
+            'id': row[0], 'departure_city': row[1], 'arrival_city': row[2],
+            'date': row[3], 'distance': row[4], 'flight_time': row[5]
+        }
+        for row in cursor.fetchall()
+    ]
+    conn.close()
+    return {'total': total, 'flights': flights}
+
+
+def iter_flight_chunks(chunk_size=1000, include_archive=True):
+    """
+    按日期从晚到早分块读取航班记录（供导出等需要流式处理全表的场景使用）
+    每次只从游标取出chunk_size行，调用方消费完一块再读下一块，内存占用与总行数无关
+    返回: 生成器，每次产出一个元组列表，元组字段依次为
+          id, 出发城市, 到达城市, 日期, 距离, 飞行时间, 出发纬度, 出发经度, 到达纬度, 到达经度
+    """
+    conn = _connect(attach_archives=include_archive)
+    try:
+        cursor = conn.cursor()
+        source = 'all_flights' if include_archive else 'flights'
+        cursor.execute(f'''
+            SELECT f.id, dc.name, ac.name, f.date, f.distance, f.flight_time,
+                   dc.lat, dc.lon, ac.lat, ac.lon
+            FROM {source} AS f
+            JOIN main.cities AS dc ON dc.id = f.departure_city_id
+            JOIN main.cities AS ac ON ac.id = f.arrival_city_id
+            ORDER BY f.date DESC, f.id DESC
+        ''')
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def find_duplicate_flights(max_day_gap=dedup_utils.FUZZY_MAX_DAY_GAP,
+                           max_time_diff=dedup_utils.FUZZY_MAX_TIME_DIFF):
+    """
+    生成疑似重复航班报告：在SQL中按 (航线, 日期) 排序后线性分组，不做两两比较
+    参数含义见dedup_utils.group_near_duplicates
+    返回: 重复组列表，每组是航班字典列表（id, departure_city, arrival_city, date, distance, flight_time）
+    """
+    conn = _connect(attach_archives=True)
+    cursor = conn.cursor()
+    city_map = _load_city_map(cursor)
+    cursor.execute('''
+        SELECT id, departure_city_id, arrival_city_id, date, distance, flight_time
+        FROM all_flights ORDER BY departure_city_id, arrival_city_id, date, id
+    ''')
+    flights = [
+        {
+            'id': row[0], 'departure_city_id': row[1], 'arrival_city_id': row[2],
+            'date': row[3], 'distance': row[4], 'flight_time': row[5]
+        }
+        for row in cursor.fetchall()
+    ]
+    conn.close()
+
+    groups = dedup_utils.group_near_duplicates(flights, max_day_gap, max_time_diff)
+    for group in groups:
+        for flight in group:
+            flight['departure_city'] = city_map[flight['departure_city_id']][0]
+            flight['arrival_city'] = city_map[flight['arrival_city_id']][0]
+    return groups
 
-def init_database():
+
+def load_cities():
     """
-    初始化SQLite数据库，创建flights表（如果不存在），并添加flight_time列（如果不存在）
+    加载cities表中的所有城市
+    返回: 城市字典列表（id, name, coords, country），按名称排序
     """
-    conn = sqlite3.connect(DB_FILE)
+    conn = _connect()
     cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS flights (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            departure_city TEXT NOT NULL,
-            arrival_city TEXT NOT NULL,
-            date TEXT NOT NULL,
-            distance REAL NOT NULL,
-            departure_coords TEXT NOT NULL,
-            arrival_coords TEXT NOT NULL,
-            flight_time INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    cursor.execute('SELECT id, name, lat, lon, country FROM cities ORDER BY name')
+    rows = cursor.fetchall()
+    conn.close()
+    return [
+        {'id': row[0], 'name': row[1], 'coords': (row[2], row[3]), 'country': row[4]}
+        for row in rows
+    ]
+
+
+def find_city(name):
+    """
+    按名称查找已知城市（不区分大小写）
+    返回: 城市字典（id, name, coords, country），不存在时返回None
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, name, lat, lon, country FROM cities WHERE name = ?', (name.strip(),))
+    row = cursor.fetchone()
+    conn.close()
+    if not row:
+        return None
+    return {'id': row[0], 'name': row[1], 'coords': (row[2], row[3]), 'country': row[4]}
+
+
+def add_city_alias(city_id, alias):
+    """为城市添加一个别名（例如中文名、拼音或旧称），搜索时别名与城市名等效"""
+    conn = _connect()
+    _add_city_aliases(conn.cursor(), city_id, [alias])
+    conn.commit()
+    conn.close()
+
+
+def _escape_like(text):
+    """转义LIKE模式中的通配符（配合 ESCAPE '\\' 使用）"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _match_cities(cursor, term, limit=search_utils.SEARCH_CITY_LIMIT):
+    """
+    查找名称或别名与搜索词匹配的城市
+    三个字符以上的词先在FTS索引中做子串匹配，没有结果时再按三元组做模糊匹配（容忍拼写错误）；
+    更短的词（例如两个字的中文城市名）按前缀匹配，走城市名和别名上的NOCASE索引
+    返回: 城市ID列表
+    """
+    cursor.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = 'city_search'")
+    fts_available = cursor.fetchone() is not None
+    if len(term) >= 3 and fts_available:
+        cursor.execute(
+            'SELECT rowid FROM city_search WHERE city_search MATCH ? ORDER BY rank LIMIT ?',
+            ('"' + term.replace('"', '""') + '"', limit)
+        )
+        city_ids = [row[0] for row in cursor.fetchall()]
+        if city_ids:
+            return city_ids
+        grams = search_utils.trigrams(term)
+        cursor.execute(
+            'SELECT rowid, name, aliases FROM city_search WHERE city_search MATCH ? ORDER BY rank LIMIT ?',
+            (' OR '.join('"' + gram.replace('"', '""') + '"' for gram in grams), limit * 4)
         )
+        return [
+            row[0] for row in cursor.fetchall()
+            if search_utils.similarity(term, [row[1]] + row[2].split('|')) >= search_utils.FUZZY_THRESHOLD
+        ][:limit]
+
+    pattern = _escape_like(term) + '%'
+    if len(term) >= 3:
+        pattern = '%' + pattern
+    cursor.execute(r'''
+        SELECT id FROM main.cities WHERE name LIKE ? ESCAPE '\'
+        UNION
+        SELECT city_id FROM main.city_aliases WHERE alias LIKE ? ESCAPE '\'
+        LIMIT ?
+    ''', (pattern, pattern, limit))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def search_flights(query, page=0, page_size=search_utils.SEARCH_PAGE_SIZE):
+    """
+    搜索航班：城市词匹配出发或到达城市（名称或别名，支持前缀、子串和模糊匹配），
+    日期词（2024、2024-05、2024-05-01）按日期前缀筛选，多个词之间是"并且"的关系
+    结果按日期从晚到早在SQL中分页
+
+    参数:
+        query: 搜索框输入，例如 "北京 东京 2024"
+        page: 页码（从0开始）
+        page_size: 每页条数
+    返回: {'total': 匹配总数, 'flights': 当前页的航班字典列表}
+    """
+    date_terms, city_terms = search_utils.parse_query(query)
+    empty = {'total': 0, 'flights': []}
+    if not date_terms and not city_terms:
+        return empty
+
+    conn = _connect(attach_archives=True)
+    cursor = conn.cursor()
+    conditions = []
+    params = []
+    for term in date_terms:
+        # 按区间比较可以使用日期索引（'~'排在数字和'-'之后）
+        conditions.append('f.date >= ? AND f.date < ?')
+        params.extend([term, term + '~'])
+    for term in city_terms:
+        city_ids = _match_cities(cursor, term)
+        if not city_ids:
+            conn.close()
+            return empty
+        placeholders = ', '.join('?' * len(city_ids))
+        conditions.append(f'(f.departure_city_id IN ({placeholders}) OR f.arrival_city_id IN ({placeholders}))')
+        params.extend(city_ids + city_ids)
+    where = ' AND '.join(conditions)
+
+    cursor.execute(f'SELECT COUNT(*) FROM all_flights AS f WHERE {where}', params)
+    total = cursor.fetchone()[0]
+    cursor.execute(f'''
+        SELECT f.id, dc.name, ac.name, f.date, f.distance, f.flight_time
+        FROM all_flights AS f
+        JOIN main.cities AS dc ON dc.id = f.departure_city_id
+        JOIN main.cities AS ac ON ac.id = f.arrival_city_id
+        WHERE {where}
+        ORDER BY f.date DESC, f.id DESC
+        LIMIT ? OFFSET ?
+    ''', params + [page_size, page * page_size])
+    flights = [
+        {
+            'id': row[0], 'departure_city': row[1], 'arrival_city': row[2],
+            'date': row[3], 'distance': row[4], 'flight_time': row[5]
+        }
+        for row in cursor.fetchall()
+    ]
+    conn.close()
+    return {'total': total, 'flights': flights}
+
+
+def get_city_counts(include_archive=True):
+    """
+    统计每个城市出现的次数（作为出发城市和到达城市各算一次）
+    直接在SQL中按整数城市ID分组
+    返回: {城市名: 次数}
+    """
+    conn = _connect(attach_archives=include_archive)
+    cursor = conn.cursor()
+    source = 'all_flights' if include_archive else 'flights'
+    cursor.execute(f'''
+        SELECT c.name, counts.visits
+        FROM (
+            SELECT city_id, COUNT(*) AS visits
+            FROM (
+                SELECT departure_city_id AS city_id FROM {source}
+                UNION ALL
+                SELECT arrival_city_id AS city_id FROM {source}
+            )
+            GROUP BY city_id
+        ) AS counts
+        JOIN main.cities AS c ON c.id = counts.city_id
     ''')
-    
-    # 检查并添加flight_time列（如果表已存在但列不存在）
-    cursor.execute("PRAGMA table_info(flights)")
-    columns = [column[1] for column in cursor.fetchall()]
-    if 'flight_time' not in columns:
-        cursor.execute('ALTER TABLE flights ADD COLUMN flight_time INTEGER')
-    
+    city_counts = dict(cursor.fetchall())
+    conn.close()
+    return city_counts
+
+
+def run_flight_queries(queries, include_archive=True):
+    """
+    在航班明细视图flight_rows上执行只读统计查询（analytics_utils的SQLite后端使用）
+    flight_rows的列与export_utils.EXPORT_COLUMNS相同：航班字段加上出发/到达城市的名称和坐标
+
+    参数:
+        queries: {查询名: SQL}
+        include_archive: 是否包含归档分区的历史记录
+    返回: {查询名: 结果行列表}
+    """
+    conn = _connect(attach_archives=include_archive)
+    cursor = conn.cursor()
+    source = 'all_flights' if include_archive else 'main.flights'
+    # 复用的连接上可能还留着上次创建的视图
+    cursor.execute('DROP VIEW IF EXISTS temp.flight_rows')
+    cursor.execute(f'''
+        CREATE TEMP VIEW flight_rows AS
+        SELECT f.id, dc.name AS departure_city, ac.name AS arrival_city, f.date, f.distance, f.flight_time,
+               dc.lat AS departure_lat, dc.lon AS departure_lon, ac.lat AS arrival_lat, ac.lon AS arrival_lon
+        FROM {source} AS f
+        JOIN main.cities AS dc ON dc.id = f.departure_city_id
+        JOIN main.cities AS ac ON ac.id = f.arrival_city_id
+    ''')
+    results = {name: cursor.execute(sql).fetchall() for name, sql in queries.items()}
+    conn.close()
+    return results
+
+
+def _city_values(cursor, city_id):
+    """返回城市的 {'name', 'lat', 'lon', 'country'}，城市不存在时返回None"""
+    cursor.execute('SELECT name, lat, lon, country FROM main.cities WHERE id = ?', (city_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return {'name': row[0], 'lat': row[1], 'lon': row[2], 'country': row[3]}
+
+
+def _restamp_flights(cursor, where, params=()):
+    """
+    把所有分区中满足where条件的航班标记为已修改
+    同步时航班记录携带城市名和坐标，城市改名、改坐标或合并之后，引用它的航班都要重新发送给对端
+    """
+    stamp = _change_stamp(cursor)
+    for alias in ['main'] + _archive_aliases(cursor):
+        cursor.execute(
+            f'UPDATE {alias}.flights SET updated_at = ?, updated_by = ?, change_seq = ? {where}', stamp + tuple(params)
+        )
+
+
+def _set_city(cursor, batch_id, city_id, values):
+    """
+    在当前事务中修改城市的名称、坐标或国家，并写入日志批次batch_id（撤销时按修改前的值改回）
+    values: {'name', 'lat', 'lon', 'country'} 中要修改的键
+    新名称与另一个城市重名时抛出ValueError（合并见_merge_city）
+    返回: 是否有变化
+    """
+    before = _city_values(cursor, city_id)
+    after = dict(before, **values)
+    if after == before:
+        return False
+    renamed = after['name'] != before['name']
+    if renamed:
+        cursor.execute('SELECT 1 FROM main.cities WHERE name = ? AND id != ?', (after['name'], city_id))
+        if cursor.fetchone():
+            raise ValueError(f"已有名为 {after['name']} 的城市")
+    cursor.execute(
+        'UPDATE main.cities SET name = ?, lat = ?, lon = ?, country = ? WHERE id = ?',
+        (after['name'], after['lat'], after['lon'], after['country'], city_id)
+    )
+    if renamed:
+        _add_city_aliases(cursor, city_id, search_utils.city_aliases(after['name']))
+    if renamed or (after['lat'], after['lon']) != (before['lat'], before['lon']):
+        _restamp_flights(cursor, 'WHERE departure_city_id = ? OR arrival_city_id = ?', (city_id, city_id))
+    _journal(cursor, batch_id, 'city', city_id, before=before, after=after)
+    return True
+
+
+def _repoint_city_flights(cursor, city_id, departures, arrivals):
+    """
+    在当前事务中把departures中航班的出发城市、arrivals中航班的到达城市改为city_id，
+    然后重新计算两边城市涉及记录的指纹，整体重新拼接行程、重算城市和航线计数
+    departures, arrivals: 航班ID列表（记录可能位于任一分区）
+    """
+    aliases = ['main'] + _archive_aliases(cursor)
+    for column, flight_ids in (('departure_city_id', departures), ('arrival_city_id', arrivals)):
+        for alias in aliases:
+            cursor.execute(
+                f'UPDATE {alias}.flights SET {column} = ?, estimated_flight_time = NULL '
+                'WHERE id IN (SELECT value FROM json_each(?))',
+                (city_id, json.dumps(flight_ids))
+            )
+    # 合并或拆分后部分航班可能与已有航班重复（或不再重复），重新计算涉及记录的指纹
+    for alias in aliases:
+        _assign_fingerprints(
+            cursor, alias, 'WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(departures + arrivals),)
+        )
+    # 城市合并可能让原本断开的航段连成行程（拆分则相反），整体重新拼接
+    cursor.execute('DELETE FROM main.trips')
+    _insert_trips(cursor, _flights_in_range(cursor))
+    _rebuild_counts(cursor)
+    _restamp_flights(cursor, 'WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(departures + arrivals),))
+
+
+def _merge_city(cursor, batch_id, city_id, target_id):
+    """
+    在当前事务中把城市city_id合并到target_id：所有分区中的航班改为引用target_id，
+    被合并城市的名称和别名转为target_id的别名（原来的名称仍然可以搜索到），然后删除被合并的城市
+    合并前的城市信息、转移的别名和引用它的航班写入日志批次batch_id，撤销时据此拆分（见_split_city）
+    """
+    merged = {'city': _city_values(cursor, city_id), 'aliases': [], 'moved_aliases': [], 'departures': [], 'arrivals': []}
+    cursor.execute('SELECT alias FROM main.city_aliases WHERE city_id = ?', (city_id,))
+    merged['aliases'] = [row[0] for row in cursor.fetchall()]
+    for alias in [merged['city']['name']] + merged['aliases']:
+        cursor.execute('SELECT 1 FROM main.city_aliases WHERE city_id = ? AND alias = ?', (target_id, alias))
+        if not cursor.fetchone() and alias not in merged['moved_aliases']:
+            merged['moved_aliases'].append(alias)
+    for alias in ['main'] + _archive_aliases(cursor):
+        cursor.execute(f'SELECT id FROM {alias}.flights WHERE departure_city_id = ?', (city_id,))
+        merged['departures'] += [row[0] for row in cursor.fetchall()]
+        cursor.execute(f'SELECT id FROM {alias}.flights WHERE arrival_city_id = ?', (city_id,))
+        merged['arrivals'] += [row[0] for row in cursor.fetchall()]
+
+    cursor.execute('DELETE FROM main.city_aliases WHERE city_id = ?', (city_id,))
+    _add_city_aliases(cursor, target_id, merged['moved_aliases'])
+    _repoint_city_flights(cursor, target_id, merged['departures'], merged['arrivals'])
+    cursor.execute('DELETE FROM main.cities WHERE id = ?', (city_id,))
+    _journal(cursor, batch_id, 'merge', city_id, before=merged, after={'city_id': target_id})
+
+
+def _split_city(cursor, batch_id, city_id, target_id, merged):
+    """
+    撤销合并：按_merge_city记录的合并前信息merged以原ID重新创建城市city_id，
+    把转移给target_id的别名和原来引用它的航班移回，并写入日志批次batch_id（重做时再次合并）
+    合并之后又有同名城市被创建时抛出ValueError
+    """
+    city = merged['city']
+    cursor.execute('SELECT 1 FROM main.cities WHERE name = ?', (city['name'],))
+    if cursor.fetchone():
+        raise ValueError(f"已有名为 {city['name']} 的城市，无法撤销合并")
+    cursor.execute(
+        'INSERT INTO main.cities (id, name, lat, lon, country) VALUES (?, ?, ?, ?, ?)',
+        (city_id, city['name'], city['lat'], city['lon'], city['country'])
+    )
+    cursor.execute(
+        'DELETE FROM main.city_aliases WHERE city_id = ? AND alias IN (SELECT value FROM json_each(?))',
+        (target_id, json.dumps(merged['moved_aliases']))
+    )
+    _add_city_aliases(cursor, city_id, merged['aliases'])
+    _repoint_city_flights(cursor, city_id, merged['departures'], merged['arrivals'])
+    _journal(cursor, batch_id, 'split', city_id, before={'city_id': target_id}, after=merged)
+
+
+def update_city(city_id, name=None, coords=None, country=None):
+    """
+    修正城市信息（名称、坐标、国家），所有引用该城市的航班记录随之生效
+    如果新名称与另一个已有城市重名，则把当前城市合并到那个城市
+    与现有值相同的字段不做修改；没有任何变化时不写数据库，引用该城市的航班也不会被标记为已修改
+    修改和合并都写入日志，可以作为一步撤销
+    返回: 修改后的城市ID
+    """
+    conn = _connect(attach_archives=True)
+    cursor = conn.cursor()
+    try:
+        current = _city_values(cursor, city_id)
+        if not current:
+            return city_id
+        values = {}
+        target_id = city_id
+        if name is not None and name.strip() != current['name']:
+            cursor.execute('SELECT id FROM main.cities WHERE name = ? AND id != ?', (name.strip(), city_id))
+            row = cursor.fetchone()
+            if row:
+                target_id = row[0]
+            else:
+                values['name'] = name.strip()
+        if coords is not None:
+            values['lat'], values['lon'] = float(coords[0]), float(coords[1])
+        if country is not None:
+            values['country'] = country
+        target = _city_values(cursor, target_id)
+        if target_id == city_id and dict(target, **values) == target:
+            return city_id
+
+        batch_id = _begin_batch(cursor, "修改城市")
+        if target_id != city_id:
+            _merge_city(cursor, batch_id, city_id, target_id)
+        _set_city(cursor, batch_id, target_id, values)
+        _bump_data_version(cursor)
+        conn.commit()
+        return target_id
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def clear_all_flights_from_db():
+    """
+    清空数据库中的所有航班记录（包括归档分区），清空前的记录写入日志，可以撤销
+    """
+    conn = _connect(attach_archives=True)
+    cursor = conn.cursor()
+    batch_id = _begin_batch(cursor, "清空所有记录")
+    deleted_at, deleted_by, change_seq = _change_stamp(cursor)
+    for flight_id, snapshot in _flight_snapshots(cursor).items():
+        _journal(cursor, batch_id, 'delete', flight_id, before=snapshot)
+        cursor.execute(
+            'INSERT OR REPLACE INTO main.flight_tombstones (uid, deleted_at, deleted_by, change_seq) VALUES (?, ?, ?, ?)',
+            (snapshot['uid'], deleted_at, deleted_by, change_seq)
+        )
+    cursor.execute('DELETE FROM main.flights')
+    for alias in _archive_aliases(cursor):
+        cursor.execute(f'DELETE FROM {alias}.flights')
+    cursor.execute('DELETE FROM main.trips')
+    cursor.execute('DELETE FROM main.city_visit_counts')
+    cursor.execute('DELETE FROM main.route_counts')
+    _bump_data_version(cursor)
     conn.commit()
     conn.close()
 
 
-def save_flight_to_db(flight_record):
+def _delete_flight(cursor, aliases, flight_id, batch_id, tombstone=None):
     """
-    保存航班记录到数据库
-    flight_record: 包含航班信息的字典
-    返回: 插入的记录ID
+    在当前事务中删除一条航班记录（记录可能位于热分区或任一归档分区），留下墓碑并写入日志批次batch_id
+    tombstone: 同步过来的删除（含updated_at、updated_by），省略时使用本地版本
+    返回: 被删除记录的日期，记录不存在时返回None
+    """
+    partition = _find_partition(cursor, flight_id, aliases)
+    if not partition:
+        return None
+    before = _flight_snapshots(cursor, 'WHERE f.id = ?', (flight_id,))[flight_id]
+    cursor.execute(f'SELECT departure_city_id, arrival_city_id FROM {partition}.flights WHERE id = ?', (flight_id,))
+    _count_flight(cursor, *cursor.fetchone(), -1)
+    cursor.execute(f'DELETE FROM {partition}.flights WHERE id = ?', (flight_id,))
+    cursor.execute(
+        'INSERT OR REPLACE INTO main.flight_tombstones (uid, deleted_at, deleted_by, change_seq) VALUES (?, ?, ?, ?)',
+        (before['uid'],) + _change_stamp(cursor, tombstone)
+    )
+    _journal(cursor, batch_id, 'delete', flight_id, before=before)
+    return before['date']
+
+
+def delete_flight_from_db(flight_id):
+    """
+    从数据库删除指定ID的航班记录（记录可能位于热分区或任一归档分区）
     """
-    conn = sqlite3.connect(DB_FILE)
+    conn = _connect(attach_archives=True)
     cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO flights (departure_city, arrival_city, date, distance, departure_coords, arrival_coords, flight_time)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
+    batch_id = _begin_batch(cursor, "删除航班")
+    old_date = _delete_flight(cursor, _archive_aliases(cursor), flight_id, batch_id)
+    if old_date:
+        _refresh_trips(cursor, [old_date])
+        _bump_data_version(cursor)
+        conn.commit()
+    else:
+        conn.rollback()
+    conn.close()
+
+
+def _update_flight(cursor, aliases, flight_id, flight_record, batch_id):
+    """
+    在当前事务中更新一条航班记录，并写入日志批次batch_id
+    记录在原分区中原地更新（归档分区中的记录被改到热分区的年份时，由下次分区维护archive_old_flights移回热分区）；
+    改成与其他记录重复时抛出DuplicateFlightError
+    返回: 受影响的日期列表（新日期和原日期），记录不存在时返回空列表
+    """
+    partition = _find_partition(cursor, flight_id, aliases)
+    if not partition:
+        return []
+    before = _flight_snapshots(cursor, 'WHERE f.id = ?', (flight_id,))[flight_id]
+    departure_city_id = _get_or_create_city(
+        cursor, flight_record['departure_city'], flight_record['departure_coords'],
+        flight_record.get('departure_country')
+    )
+    arrival_city_id = _get_or_create_city(
+        cursor, flight_record['arrival_city'], flight_record['arrival_coords'],
+        flight_record.get('arrival_country')
+    )
+    fingerprint = dedup_utils.flight_fingerprint(
+        departure_city_id, arrival_city_id, flight_record['date'], flight_record.get('flight_time')
+    )
+    _check_duplicate(cursor, fingerprint, flight_id)
+    cursor.execute(f'SELECT departure_city_id, arrival_city_id FROM {partition}.flights WHERE id = ?', (flight_id,))
+    old_route = cursor.fetchone()
+    if old_route != (departure_city_id, arrival_city_id):
+        _count_flight(cursor, *old_route, -1)
+        _count_flight(cursor, departure_city_id, arrival_city_id, 1)
+    cursor.execute(f'''
+        UPDATE {partition}.flights
+        SET departure_city_id = ?, arrival_city_id = ?, date = ?, distance = ?, flight_time = ?,
+            fingerprint = ?, updated_at = ?, updated_by = ?, change_seq = ?, estimated_flight_time = NULL
+        WHERE id = ?
     ''', (
-        flight_record['departure_city'],
-        flight_record['arrival_city'],
+        departure_city_id,
+        arrival_city_id,
         flight_record['date'],
         flight_record['distance'],
-        json.dumps(flight_record['departure_coords']),  # 将tuple转为JSON字符串存储
-        json.dumps(flight_record['arrival_coords']),
-        flight_record.get('flight_time', None)  # 飞行时间（分钟），可选
-    ))
-    conn.commit()
-    flight_id = cursor.lastrowid
+        flight_record.get('flight_time', None),
+        fingerprint
+    ) + _change_stamp(cursor, flight_record) + (flight_id,))
+
+    _journal(cursor, batch_id, 'update', flight_id, before=before,
+             after=_flight_snapshots(cursor, 'WHERE f.id = ?', (flight_id,))[flight_id])
+    return [flight_record['date'], before['date']]
+
+
+def update_flight_in_db(flight_id, flight_record):
+    """
+    更新数据库中的航班记录
+    flight_id: 要更新的记录ID
+    flight_record: 包含更新后航班信息的字典
+    """
+    conn = _connect(attach_archives=True)
+    cursor = conn.cursor()
+    try:
+        batch_id = _begin_batch(cursor, "修改航班")
+        dates = _update_flight(cursor, _archive_aliases(cursor), flight_id, flight_record, batch_id)
+        if dates:
+            _refresh_trips(cursor, dates)
+            _bump_data_version(cursor)
+            conn.commit()
+    finally:
+        # 未提交的事务（记录不存在或出错）在关闭连接时回滚
+        conn.close()
+
+
+def apply_flight_changes(inserts=(), updates=None, deletes=(), action="批量编辑"):
+    """
+    在一个事务中批量应用新增、修改和删除（批量编辑器保存时使用），任何一步失败（例如DuplicateFlightError）都会整体回滚
+    inserts: 新航班信息字典列表
+    updates: {航班ID: 更新后的航班信息字典}
+    deletes: 要删除的航班ID列表
+    action: 日志中的操作名称（全部修改作为一步撤销）
+    返回: 新增记录的ID列表（与inserts顺序一致）
+    """
+    updates = updates or {}
+    conn = _connect(attach_archives=True)
+    cursor = conn.cursor()
+    try:
+        aliases = _archive_aliases(cursor)
+        batch_id = _begin_batch(cursor, action)
+        dates = []
+        for flight_id in deletes:
+            old_date = _delete_flight(cursor, aliases, flight_id, batch_id)
+            if old_date:
+                dates.append(old_date)
+        for flight_id, flight_record in updates.items():
+            dates.extend(_update_flight(cursor, aliases, flight_id, flight_record, batch_id))
+        new_ids = []
+        for flight_record in inserts:
+            new_ids.append(_insert_flight(cursor, flight_record, batch_id))
+            dates.append(flight_record['date'])
+        if dates:
+            _refresh_trips(cursor, dates)
+            _bump_data_version(cursor)
+            conn.commit()
+        else:
+            conn.rollback()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return new_ids
+
+
+# 合并提交时各类修改在日志中的操作名称（与单独调用时一致，每个修改仍是独立的一步撤销）
+MUTATION_ACTIONS = {'save': "添加航班", 'update': "修改航班", 'delete': "删除航班"}
+
+
+def apply_mutations(mutations):
+    """
+    在一个事务中依次应用多个会话提交的修改（写入队列合并提交时使用，整批只提交一次）
+    每个修改放在自己的保存点中：某个修改失败（例如DuplicateFlightError）只回滚它自己，不影响同批的其他修改
+    mutations: [(操作, 参数元组)] 列表，操作为 'save' (flight_record,)、'update' (flight_id, flight_record)
+               或 'delete' (flight_id,)
+    返回: 与mutations顺序一致的结果列表：save为新记录ID，update/delete为是否找到了记录，失败的修改为对应的异常对象
+    """
+    results = []
+    dates = []
+    conn = _connect(attach_archives=True)
+    cursor = conn.cursor()
+    try:
+        # 立即加写锁，整批修改只等待一次锁
+        cursor.execute('BEGIN IMMEDIATE')
+        aliases = _archive_aliases(cursor)
+        for op, args in mutations:
+            cursor.execute('SAVEPOINT mutation')
+            try:
+                batch_id = _begin_batch(cursor, MUTATION_ACTIONS[op])
+                if op == 'save':
+                    result = _insert_flight(cursor, args[0], batch_id)
+                    changed = [args[0]['date']]
+                elif op == 'update':
+                    changed = _update_flight(cursor, aliases, args[0], args[1], batch_id)
+                    result = bool(changed)
+                else:
+                    old_date = _delete_flight(cursor, aliases, args[0], batch_id)
+                    changed = [old_date] if old_date else []
+                    result = bool(changed)
+            except Exception as e:
+                changed = []
+                result = e
+            if changed:
+                dates.extend(changed)
+            else:
+                # 失败或记录不存在时不留下空的日志批次
+                cursor.execute('ROLLBACK TO mutation')
+            cursor.execute('RELEASE mutation')
+            results.append(result)
+        if dates:
+            _refresh_trips(cursor, dates)
+            # 整批只递增一次版本号，按版本号缓存的数据（快照、表格、统计）每次提交只失效一次
+            _bump_data_version(cursor)
+            conn.commit()
+        else:
+            conn.rollback()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return results
+
+
+def _undo_redo_stacks(cursor):
+    """
+    按时间顺序回放日志批次，得到撤销栈和重做栈
+    普通修改入撤销栈并清空重做栈；撤销把目标批次移到重做栈，重做再把它移回撤销栈
+    目标批次已经折叠进检查点的撤销/重做批次按普通修改处理
+    返回: (撤销栈, 重做栈)，元素为 (批次ID, 操作名称)，栈顶在列表末尾
+    """
+    cursor.execute('SELECT id, action, kind, reverts FROM main.journal_batches ORDER BY id')
+    undo_stack = []
+    redo_stack = []
+    for batch_id, action, kind, reverts in cursor.fetchall():
+        if kind == 'undo' and undo_stack and undo_stack[-1][0] == reverts:
+            undo_stack.pop()
+            redo_stack.append((batch_id, action))
+        elif kind == 'redo' and redo_stack and redo_stack[-1][0] == reverts:
+            redo_stack.pop()
+            undo_stack.append((batch_id, action))
+        else:
+            undo_stack.append((batch_id, action))
+            redo_stack.clear()
+    return undo_stack, redo_stack
+
+
+def _revert_batch(cursor, batch_id, action, kind):
+    """
+    按相反顺序执行批次batch_id中每条日志的反向操作，反向操作本身记为一个新的kind批次
+    返回: 受影响的日期列表
+    """
+    revert_batch_id = _begin_batch(cursor, action, kind, batch_id)
+    cursor.execute(
+        'SELECT op, flight_id, before, after FROM main.journal WHERE batch_id = ? ORDER BY id DESC', (batch_id,)
+    )
+    entries = cursor.fetchall()
+    aliases = _archive_aliases(cursor)
+    dates = []
+    for op, flight_id, before, after in entries:
+        # 城市修改的日志中flight_id是城市ID；合并和拆分时已整体重新拼接行程，不需要返回日期
+        if op == 'city':
+            _set_city(cursor, revert_batch_id, flight_id, json.loads(before))
+        elif op == 'merge':
+            _split_city(cursor, revert_batch_id, flight_id, json.loads(after)['city_id'], json.loads(before))
+        elif op == 'split':
+            _merge_city(cursor, revert_batch_id, flight_id, json.loads(before)['city_id'])
+        elif op == 'insert':
+            dates.append(_delete_flight(cursor, aliases, flight_id, revert_batch_id))
+        elif op == 'delete':
+            before = json.loads(before)
+            _insert_flight(cursor, before, revert_batch_id, flight_id)
+            dates.append(before['date'])
+        else:
+            dates.extend(_update_flight(cursor, aliases, flight_id, json.loads(before), revert_batch_id))
+    return [date for date in dates if date]
+
+
+def get_undo_redo_state():
+    """
+    获取当前可撤销和可重做的操作
+    返回: {'undo': 可撤销的操作名称或None, 'redo': 可重做的操作名称或None}
+    """
+    conn = _connect()
+    undo_stack, redo_stack = _undo_redo_stacks(conn.cursor())
     conn.close()
-    return flight_id
+    return {
+        'undo': undo_stack[-1][1] if undo_stack else None,
+        'redo': redo_stack[-1][1] if redo_stack else None
+    }
+
+
+def _undo_or_redo(kind):
+    """撤销（kind='undo'）或重做（kind='redo'）最近的一步操作"""
+    conn = _connect(attach_archives=True)
+    cursor = conn.cursor()
+    try:
+        # 立即加写锁，避免两个会话同时撤销同一步
+        cursor.execute('BEGIN IMMEDIATE')
+        undo_stack, redo_stack = _undo_redo_stacks(cursor)
+        stack = undo_stack if kind == 'undo' else redo_stack
+        if not stack:
+            conn.rollback()
+            return None
+        batch_id, action = stack[-1]
+        dates = _revert_batch(cursor, batch_id, action, kind)
+        if dates:
+            _refresh_trips(cursor, dates)
+        _bump_data_version(cursor)
+        conn.commit()
+        return action
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
 
-def load_flights_from_db():
+def undo_last_change():
     """
-    从数据库加载所有航班记录
-    返回: 航班记录列表
+    撤销最近的一步操作（可多次调用，逐步撤销）
+    返回: 被撤销的操作名称，没有可撤销的操作时返回None
+    """
+    return _undo_or_redo('undo')
+
+
+def redo_last_change():
+    """
+    重做最近撤销的一步操作（撤销之后有新的修改时不能再重做）
+    返回: 被重做的操作名称，没有可重做的操作时返回None
+    """
+    return _undo_or_redo('redo')
+
+
+def read_journal(since_id=0, limit=None):
     """
-    conn = sqlite3.connect(DB_FILE)
+    读取since_id之后的日志（增量同步的基础：记住已处理的最大日志ID，下次只回放之后的部分）
+    返回: 日志字典列表（id, batch_id, op, flight_id, before, after），按ID升序；
+          since_id早于检查点（需要的日志已被折叠）时返回None，调用方需要全量同步
+    """
+    conn = _connect()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM flights ORDER BY date DESC, id DESC')
+    cursor.execute("SELECT value FROM meta WHERE key = 'journal_checkpoint'")
+    row = cursor.fetchone()
+    if row and since_id < int(row[0]):
+        conn.close()
+        return None
+    cursor.execute(
+        'SELECT id, batch_id, op, flight_id, before, after FROM journal WHERE id > ? ORDER BY id LIMIT ?',
+        (since_id, -1 if limit is None else limit)
+    )
     rows = cursor.fetchall()
     conn.close()
-    
-    flights = []
-    for row in rows:
-        flight_dict = {
-            'id': row[0],
+    return [
+        {
+            'id': row[0], 'batch_id': row[1], 'op': row[2], 'flight_id': row[3],
+            'before': json.loads(row[4]) if row[4] else None,
+            'after': json.loads(row[5]) if row[5] else None
+        }
+        for row in rows
+    ]
+
+
+def get_device_id():
+    """返回本机数据库的设备ID"""
+    conn = _connect()
+    device_id = _device_id(conn.cursor())
+    conn.close()
+    return device_id
+
+
+def reset_device_id():
+    """
+    为本机数据库重新生成设备ID（直接复制数据库文件到另一台设备后，需要在其中一份上调用一次）
+    返回: 新的设备ID
+    """
+    device_id = uuid.uuid4().hex
+    conn = _connect()
+    conn.execute("UPDATE meta SET value = ? WHERE key = 'device_id'", (device_id,))
+    conn.execute('DELETE FROM sync_peers')
+    conn.commit()
+    conn.close()
+    return device_id
+
+
+def get_sync_peer(peer_id):
+    """
+    获取与对端设备的同步水位线
+    返回: 字典（peer_id, sent_seq, received_seq, synced_at），从未同步过的对端水位线为0
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute('SELECT sent_seq, received_seq, synced_at FROM sync_peers WHERE peer_id = ?', (peer_id,))
+    row = cursor.fetchone() or (0, 0, None)
+    conn.close()
+    return {'peer_id': peer_id, 'sent_seq': row[0], 'received_seq': row[1], 'synced_at': row[2]}
+
+
+def _update_sync_peer(cursor, peer_id, sent_seq=None, received_seq=None):
+    """推进对端的水位线（只增不减）"""
+    cursor.execute('INSERT OR IGNORE INTO main.sync_peers (peer_id) VALUES (?)', (peer_id,))
+    cursor.execute('''
+        UPDATE main.sync_peers
+        SET sent_seq = MAX(sent_seq, ?), received_seq = MAX(received_seq, ?), synced_at = CURRENT_TIMESTAMP
+        WHERE peer_id = ?
+    ''', (sent_seq or 0, received_seq or 0, peer_id))
+
+
+def update_sync_peer(peer_id, sent_seq=None, received_seq=None):
+    """
+    记录与对端设备的同步进度
+    sent_seq: 已发给对端的本机修改序号；received_seq: 已应用的对端修改序号
+    """
+    conn = _connect()
+    _update_sync_peer(conn.cursor(), peer_id, sent_seq, received_seq)
+    conn.commit()
+    conn.close()
+
+
+def export_changes(since=0, exclude_device=None):
+    """
+    导出本机修改序号大于since的航班记录和墓碑（走change_seq索引，开销与修改条数成正比，与表大小无关）
+    exclude_device: 跳过最后一次修改来自该设备的记录（对端自己的修改不需要再发回去）
+    返回: 变更集字典 {'device_id', 'since', 'until', 'flights': [...], 'tombstones': [...]}，
+          until是导出时本机的修改序号，下次从它开始导出
+    """
+    conn = _connect(attach_archives=True)
+    cursor = conn.cursor()
+    # 在同一个读事务中读取序号和数据，保证快照一致
+    cursor.execute('BEGIN')
+    cursor.execute("SELECT value FROM main.meta WHERE key = 'change_seq'")
+    until = int(cursor.fetchone()[0])
+    cursor.execute('''
+        SELECT f.uid, dc.name, ac.name, dc.lat, dc.lon, ac.lat, ac.lon, dc.country, ac.country,
+               f.date, f.distance, f.flight_time, f.updated_at, f.updated_by
+        FROM all_flights AS f
+        JOIN main.cities AS dc ON dc.id = f.departure_city_id
+        JOIN main.cities AS ac ON ac.id = f.arrival_city_id
+        WHERE f.change_seq > ? AND f.change_seq <= ? AND f.updated_by IS NOT ?
+        ORDER BY f.change_seq
+    ''', (since, until, exclude_device))
+    flights = [
+        {
+            'uid': row[0],
             'departure_city': row[1],
             'arrival_city': row[2],
-            'date': row[3],
-            'distance': row[4],
-            'departure_coords': json.loads(row[5]),  # 从JSON字符串解析回tuple
-            'arrival_coords': json.loads(row[6])
+            'departure_coords': [row[3], row[4]],
+            'arrival_coords': [row[5], row[6]],
+            'departure_country': row[7],
+            'arrival_country': row[8],
+            'date': row[9],
+            'distance': row[10],
+            'flight_time': row[11],
+            'updated_at': row[12],
+            'updated_by': row[13]
         }
-        # 处理flight_time字段（可能在旧数据中不存在）
-        if len(row) > 7:
-            flight_time = row[7]
-            # 确保flight_time是整数类型（SQLite可能返回字符串）
-            try:
-                flight_dict['flight_time'] = int(flight_time) if flight_time is not None else None
-            except (ValueError, TypeError):
-                flight_dict['flight_time'] = None
+        for row in cursor.fetchall()
+    ]
+    cursor.execute('''
+        SELECT uid, deleted_at, deleted_by FROM main.flight_tombstones
+        WHERE change_seq > ? AND change_seq <= ? AND deleted_by IS NOT ?
+        ORDER BY change_seq
+    ''', (since, until, exclude_device))
+    tombstones = [
+        {'uid': row[0], 'deleted_at': row[1], 'deleted_by': row[2]}
+        for row in cursor.fetchall()
+    ]
+    device_id = _device_id(cursor)
+    conn.close()
+    return {
+        'device_id': device_id, 'since': since, 'until': until,
+        'flights': flights, 'tombstones': tombstones
+    }
+
+
+def _local_version(cursor, uid):
+    """
+    查找uid对应的本地记录和版本
+    返回: (本地航班ID或None, 本地版本)，版本是记录或墓碑中较新的 (时间, 设备ID)，两者都没有时为None
+    """
+    cursor.execute('SELECT id, updated_at, updated_by FROM all_flights WHERE uid = ?', (uid,))
+    row = cursor.fetchone()
+    cursor.execute('SELECT deleted_at, deleted_by FROM main.flight_tombstones WHERE uid = ?', (uid,))
+    tombstone = cursor.fetchone()
+    versions = [tuple(version) for version in (row[1:] if row else None, tombstone) if version]
+    return (row[0] if row else None), (max(versions) if versions else None)
+
+
+def _write_tombstone(cursor, uid, stamp_record=None):
+    """为本地不存在的记录写入（或更新）墓碑"""
+    cursor.execute(
+        'INSERT OR REPLACE INTO main.flight_tombstones (uid, deleted_at, deleted_by, change_seq) VALUES (?, ?, ?, ?)',
+        (uid,) + _change_stamp(cursor, stamp_record)
+    )
+
+
+def _apply_remote_flight(cursor, aliases, batch_id, record, stats):
+    """
+    应用对端的一条航班记录：对端版本较新时覆盖本地（版本相同或较旧时跳过）
+    两台设备各自记录了同一航班（指纹相同、uid不同）时保留uid较小的一条，另一条删除，
+    两边按同样的规则处理，同步之后结果一致
+    返回: 受影响的日期列表
+    """
+    flight_id, local_version = _local_version(cursor, record['uid'])
+    if local_version is not None and (record['updated_at'], record['updated_by']) <= local_version:
+        stats['skipped'] += 1
+        return []
+    try:
+        if flight_id:
+            dates = _update_flight(cursor, aliases, flight_id, record, batch_id)
         else:
-            flight_dict['flight_time'] = None
-        flights.append(flight_dict)
-    return flights
+            _insert_flight(cursor, record, batch_id)
+            dates = [record['date']]
+    except DuplicateFlightError as e:
+        stats['conflicts'] += 1
+        cursor.execute('SELECT uid FROM all_flights WHERE id = ?', (e.flight_id,))
+        other_uid = cursor.fetchone()[0]
+        if record['uid'] < other_uid:
+            other_date = _delete_flight(cursor, aliases, e.flight_id, batch_id)
+            return [other_date] + _apply_remote_flight(cursor, aliases, batch_id, record, stats)
+        # 对端的这条是重复记录：删除（或直接记墓碑），下次同步时把删除传回对端
+        if flight_id:
+            return [_delete_flight(cursor, aliases, flight_id, batch_id)]
+        _write_tombstone(cursor, record['uid'])
+        return []
+    stats['applied'] += 1
+    return dates
 
 
-def clear_all_flights_from_db():
+def _apply_remote_tombstone(cursor, aliases, batch_id, tombstone, stats):
+    """
+    应用对端的一条删除：删除比本地版本新时删除本地记录（本地没有该记录时也保存墓碑，以免旧的记录再同步回来）
+    返回: 受影响的日期列表
+    """
+    flight_id, local_version = _local_version(cursor, tombstone['uid'])
+    if local_version is not None and (tombstone['deleted_at'], tombstone['deleted_by']) <= local_version:
+        stats['skipped'] += 1
+        return []
+    stamp_record = {'updated_at': tombstone['deleted_at'], 'updated_by': tombstone['deleted_by']}
+    stats['deleted'] += 1
+    if flight_id:
+        return [_delete_flight(cursor, aliases, flight_id, batch_id, stamp_record)]
+    _write_tombstone(cursor, tombstone['uid'], stamp_record)
+    return []
+
+
+def apply_changes(changeset):
+    """
+    在一个事务中应用对端导出的变更集，冲突按版本 (修改时间, 设备ID) 较大者胜出
+    应用的修改作为一个"同步"批次写入修改日志，可以撤销
+    返回: 统计字典（applied: 新增或更新的记录数, deleted: 删除数, skipped: 本地已是最新而跳过的条数,
+          conflicts: 重复航班冲突数）
+    """
+    stats = {'applied': 0, 'deleted': 0, 'skipped': 0, 'conflicts': 0}
+    conn = _connect(attach_archives=True)
+    cursor = conn.cursor()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        aliases = _archive_aliases(cursor)
+        batch_id = _begin_batch(cursor, "同步")
+        dates = []
+        for record in changeset['flights']:
+            dates.extend(_apply_remote_flight(cursor, aliases, batch_id, record, stats))
+        for tombstone in changeset['tombstones']:
+            dates.extend(_apply_remote_tombstone(cursor, aliases, batch_id, tombstone, stats))
+        dates = [date for date in dates if date]
+        if dates:
+            _refresh_trips(cursor, dates)
+            _bump_data_version(cursor)
+        else:
+            cursor.execute('DELETE FROM main.journal_batches WHERE id = ?', (batch_id,))
+        _update_sync_peer(cursor, changeset['device_id'], received_seq=changeset['until'])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return stats
+
+
+# 后台任务的状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_CANCELLING = 'cancelling'
+JOB_CANCELLED = 'cancelled'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# 尚未结束的任务状态（重启后需要恢复或收尾）
+JOB_UNFINISHED_STATUSES = (JOB_QUEUED, JOB_RUNNING, JOB_CANCELLING)
+
+
+def _job_from_row(row):
+    """把jobs表的一行转换为任务字典"""
+    return {
+        'id': row[0],
+        'kind': row[1],
+        'params': json.loads(row[2]),
+        'status': row[3],
+        'progress': row[4],
+        'total': row[5],
+        'result': json.loads(row[6]) if row[6] else None,
+        'error': row[7],
+        'created_at': row[8],
+        'updated_at': row[9],
+        'batch_id': row[10]
+    }
+
+
+def create_job(kind, params):
     """
-    清空数据库中的所有航班记录
+    新建一个排队中的后台任务
+    返回: 任务ID
     """
-    conn = sqlite3.connect(DB_FILE)
+    conn = _connect()
     cursor = conn.cursor()
-    cursor.execute('DELETE FROM flights')
+    cursor.execute(
+        'INSERT INTO jobs (kind, params, status) VALUES (?, ?, ?)',
+        (kind, json.dumps(params, ensure_ascii=False), JOB_QUEUED)
+    )
     conn.commit()
+    job_id = cursor.lastrowid
     conn.close()
+    return job_id
 
 
-def delete_flight_from_db(flight_id):
+def get_job(job_id):
+    """
+    获取任务详情
+    返回: 任务字典，不存在时返回None
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute('SELECT * FROM jobs WHERE id = ?', (job_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return _job_from_row(row) if row else None
+
+
+def list_jobs(limit=20, statuses=None):
+    """
+    按创建时间从新到旧列出任务
+    statuses: 只返回这些状态的任务，None表示全部
+    返回: 任务字典列表
     """
-    从数据库删除指定ID的航班记录
+    conn = _connect()
+    cursor = conn.cursor()
+    if statuses:
+        placeholders = ', '.join('?' * len(statuses))
+        cursor.execute(
+            f'SELECT * FROM jobs WHERE status IN ({placeholders}) ORDER BY id DESC LIMIT ?',
+            (*statuses, limit)
+        )
+    else:
+        cursor.execute('SELECT * FROM jobs ORDER BY id DESC LIMIT ?', (limit,))
+    rows = cursor.fetchall()
+    conn.close()
+    return [_job_from_row(row) for row in rows]
+
+
+def update_job(job_id, **fields):
     """
-    conn = sqlite3.connect(DB_FILE)
+    更新任务字段（status, progress, total, result, error, batch_id）
+    result会被序列化为JSON保存
+    """
+    if 'result' in fields:
+        fields['result'] = json.dumps(fields['result'], ensure_ascii=False)
+    assignments = ', '.join(f'{name} = ?' for name in fields)
+    conn = _connect()
     cursor = conn.cursor()
-    cursor.execute('DELETE FROM flights WHERE id = ?', (flight_id,))
+    cursor.execute(
+        f'UPDATE jobs SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+        (*fields.values(), job_id)
+    )
     conn.commit()
     conn.close()
 
 
-def update_flight_in_db(flight_id, flight_record):
+def claim_job(job_id):
     """
-    更新数据库中的航班记录
-    flight_id: 要更新的记录ID
-    flight_record: 包含更新后航班信息的字典
+    把排队中（或重启前运行中）的任务标记为运行中
+    返回: 是否成功认领（任务已被取消或已结束时返回False）
     """
-    conn = sqlite3.connect(DB_FILE)
+    conn = _connect()
     cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE flights 
-        SET departure_city = ?, arrival_city = ?, date = ?, distance = ?, 
-            departure_coords = ?, arrival_coords = ?, flight_time = ?
-        WHERE id = ?
-    ''', (
-        flight_record['departure_city'],
-        flight_record['arrival_city'],
-        flight_record['date'],
-        flight_record['distance'],
-        json.dumps(flight_record['departure_coords']),
-        json.dumps(flight_record['arrival_coords']),
-        flight_record.get('flight_time', None),
-        flight_id
-    ))
+    cursor.execute(
+        'UPDATE jobs SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND status IN (?, ?)',
+        (JOB_RUNNING, job_id, JOB_QUEUED, JOB_RUNNING)
+    )
+    claimed = cursor.rowcount > 0
+    conn.commit()
+    conn.close()
+    return claimed
+
+
+def request_job_cancel(job_id):
+    """
+    请求取消任务：排队中的任务直接取消，运行中的任务由执行线程在下一个检查点停止
+    返回: 是否发出了取消请求
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        'UPDATE jobs SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND status = ?',
+        (JOB_CANCELLED, job_id, JOB_QUEUED)
+    )
+    cancelled = cursor.rowcount
+    cursor.execute(
+        'UPDATE jobs SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND status = ?',
+        (JOB_CANCELLING, job_id, JOB_RUNNING)
+    )
+    cancelled += cursor.rowcount
     conn.commit()
     conn.close()
+    return cancelled > 0
@@ -0,0 +1,62 @@
+"""
+重复航班检测模块
+精确重复用规范化指纹（航线、日期、飞行时间）判断，数据库中对指纹建唯一索引；
+疑似重复（日期相差一两天、飞行时间略有出入）通过排序后分组扫描找出，不做两两比较
+"""
+
+from datetime import date
+
+# 疑似重复：同一航线上相邻两条记录的日期最多相差的天数
+FUZZY_MAX_DAY_GAP = 1
+
+# 疑似重复：两条记录都填写了飞行时间时，最多相差的分钟数
+FUZZY_MAX_TIME_DIFF = 30
+
+
+def flight_fingerprint(departure_city_id, arrival_city_id, flight_date, flight_time=None):
+    """
+    计算航班的规范化指纹
+    城市使用cities表的ID（城市名已不区分大小写地归一），未填写飞行时间时该部分为空
+    例如: (1, 2, '2024-05-01', 125) -> '1>2@2024-05-01#125'
+    """
+    return f"{departure_city_id}>{arrival_city_id}@{flight_date}#{flight_time or ''}"
+
+
+def _is_close(previous, current, max_day_gap, max_time_diff):
+    """判断同一航线上按日期相邻的两条记录是否疑似重复"""
+    gap = (date.fromisoformat(current['date']) - date.fromisoformat(previous['date'])).days
+    if gap > max_day_gap:
+        return False
+    if previous['flight_time'] and current['flight_time']:
+        return abs(previous['flight_time'] - current['flight_time']) <= max_time_diff
+    return True
+
+
+def group_near_duplicates(flights, max_day_gap=FUZZY_MAX_DAY_GAP, max_time_diff=FUZZY_MAX_TIME_DIFF):
+    """
+    找出疑似重复的航班组（一次线性扫描）
+    同一航线上日期相邻且满足_is_close的记录归为一组，组内只有一条记录时不算重复
+
+    参数:
+        flights: 已按 (departure_city_id, arrival_city_id, date, id) 排序的航班列表，每项包含
+                 id, departure_city_id, arrival_city_id, date, flight_time
+        max_day_gap: 允许的最大日期差（天）
+        max_time_diff: 允许的最大飞行时间差（分钟）
+    返回: 重复组列表，每组是按日期排列的航班列表
+    """
+    groups = []
+    current = []
+    for flight in flights:
+        if current:
+            previous = current[-1]
+            if previous['departure_city_id'] == flight['departure_city_id'] and \
+                    previous['arrival_city_id'] == flight['arrival_city_id'] and \
+                    _is_close(previous, flight, max_day_gap, max_time_diff):
+                current.append(flight)
+                continue
+            if len(current) > 1:
+                groups.append(current)
+        current = [flight]
+    if len(current) > 1:
+        groups.append(current)
+    return groups
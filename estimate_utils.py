@@ -0,0 +1,226 @@
+"""
+飞行时间估算模块
+很多记录没有填写飞行时间，累计飞行时间因此偏少。这里用已填写飞行时间的记录拟合"距离 -> 飞行时间"的模型
+（同一航线有足够记录时取该航线的中位数，否则用对异常值稳健的Huber线性回归），一次性按列为所有缺失的记录估算，
+结果写入flights表单独的estimated_flight_time列（实测的flight_time不受影响）。
+估算状态按数据版本号记录在meta表中：数据没有变化时不重新计算；有飞行时间的记录集合没有变化时沿用已有模型，
+只为新增或修改过的记录补估算值；有新的实测飞行时间时才重新拟合
+
+命令行用法:
+    python estimate_utils.py
+    python estimate_utils.py --db flights_zwx.db --refit
+"""
+
+import argparse
+import hashlib
+
+import numpy as np
+
+import database_utils
+import flight_utils
+
+# 数据不足以拟合时使用的默认模型：按约800公里/小时巡航，另加30分钟起降时间
+FALLBACK_MINUTES_PER_KM = 60 / 800
+FALLBACK_OVERHEAD_MINUTES = 30
+
+# 拟合直线至少需要的有飞行时间的记录数
+ESTIMATE_MIN_TIMED_FLIGHTS = 5
+
+# 航线至少有N条有飞行时间的记录时，直接取该航线的中位数（往返视为同一条航线）
+ROUTE_MIN_FLIGHTS = 2
+
+# 估算值的下限（分钟）
+ESTIMATE_MIN_MINUTES = 10
+
+# Huber回归的调节常数（以残差的稳健标准差为单位）和迭代重加权的最大次数
+HUBER_K = 1.345
+HUBER_MAX_ITERATIONS = 50
+
+# 写入时发现数据已被修改，重新估算的最多次数
+ESTIMATE_RETRIES = 3
+
+# 航线键中出发城市ID的位移（两个城市ID合成一个整数）
+_ROUTE_KEY_SHIFT = 32
+
+
+def route_keys(departure_ids, arrival_ids):
+    """
+    把出发/到达城市ID合成为航线键（往返两个方向得到同一个键）
+    返回: int64数组
+    """
+    departure_ids = np.asarray(departure_ids, dtype=np.int64)
+    arrival_ids = np.asarray(arrival_ids, dtype=np.int64)
+    low, high = np.minimum(departure_ids, arrival_ids), np.maximum(departure_ids, arrival_ids)
+    return (low << _ROUTE_KEY_SHIFT) | high
+
+
+def huber_line(x, y):
+    """
+    Huber稳健线性回归（迭代重加权最小二乘）：残差超过HUBER_K倍稳健标准差的点按残差大小降低权重，
+    个别填错的飞行时间（例如把小时填成分钟）不会把整条直线拉偏
+    返回: (截距, 斜率)
+    """
+    design = np.column_stack([np.ones_like(x), x])
+    beta = np.linalg.lstsq(design, y, rcond=None)[0]
+    for _ in range(HUBER_MAX_ITERATIONS):
+        residuals = y - design @ beta
+        # 残差的稳健标准差（中位数绝对偏差换算）
+        scale = np.median(np.abs(residuals - np.median(residuals))) / 0.6745
+        if scale <= 0:
+            break
+        weights = np.minimum(1.0, HUBER_K * scale / np.maximum(np.abs(residuals), 1e-12))
+        root = np.sqrt(weights)
+        updated = np.linalg.lstsq(design * root[:, None], y * root, rcond=None)[0]
+        if np.allclose(updated, beta, rtol=0, atol=1e-6):
+            beta = updated
+            break
+        beta = updated
+    return float(beta[0]), float(beta[1])
+
+
+def fit_model(departure_ids, arrival_ids, distances, minutes):
+    """
+    用有飞行时间的记录拟合估算模型
+
+    参数:
+        departure_ids, arrival_ids: 出发/到达城市ID数组
+        distances: 距离数组（公里）
+        minutes: 飞行时间数组（分钟，均大于0）
+    返回: 模型字典 {'intercept', 'slope', 'routes': [[航线键, 中位数分钟数], ...], 'timed_count'}
+    """
+    intercept, slope = FALLBACK_OVERHEAD_MINUTES, FALLBACK_MINUTES_PER_KM
+    usable = distances > 0
+    if usable.sum() >= ESTIMATE_MIN_TIMED_FLIGHTS:
+        fitted = huber_line(distances[usable], minutes[usable])
+        # 数据太少或太集中时可能拟合出不合理的直线（飞行时间随距离减少），这时仍用默认模型
+        if fitted[1] > 0:
+            intercept, slope = fitted
+    routes = []
+    if len(minutes):
+        keys = route_keys(departure_ids, arrival_ids)
+        order = np.argsort(keys, kind='stable')
+        keys, sorted_minutes = keys[order], minutes[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        counts = np.diff(np.r_[starts, len(keys)])
+        for start, count in zip(starts[counts >= ROUTE_MIN_FLIGHTS], counts[counts >= ROUTE_MIN_FLIGHTS]):
+            routes.append([int(keys[start]), float(np.median(sorted_minutes[start:start + count]))])
+    return {'intercept': intercept, 'slope': slope, 'routes': routes, 'timed_count': int(len(minutes))}
+
+
+def predict(model, departure_ids, arrival_ids, distances):
+    """
+    按模型估算飞行时间（按列一次计算）：有航线中位数的取中位数，否则按直线估算
+    返回: 分钟数数组（整数，不小于ESTIMATE_MIN_MINUTES）
+    """
+    estimates = model['intercept'] + model['slope'] * np.asarray(distances, dtype=float)
+    if model['routes'] and len(estimates):
+        route_table = np.array(model['routes'])
+        known_keys = route_table[:, 0].astype(np.int64)
+        keys = route_keys(departure_ids, arrival_ids)
+        positions = np.minimum(np.searchsorted(known_keys, keys), len(known_keys) - 1)
+        found = known_keys[positions] == keys
+        estimates[found] = route_table[positions[found], 1]
+    return np.maximum(np.rint(estimates), ESTIMATE_MIN_MINUTES).astype(np.int64)
+
+
+def _timed_signature(ids, departure_ids, arrival_ids, distances, minutes):
+    """有飞行时间的记录集合的摘要（按ID排序后对各列取摘要），集合不变时不需要重新拟合"""
+    order = np.argsort(ids, kind='stable')
+    digest = hashlib.sha1()
+    for column in (ids, departure_ids, arrival_ids, distances, minutes):
+        digest.update(np.ascontiguousarray(column[order], dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def _estimate(version, rows, state, refit):
+    """
+    根据读取的数据计算需要写入的估算值和新的估算状态
+    返回: (估算值列表 [(分钟数或None, 航班ID)], 新的状态字典)
+    """
+    data = np.array(rows, dtype=float).reshape(-1, 6)
+    ids = data[:, 0].astype(np.int64)
+    departure_ids, arrival_ids = data[:, 1].astype(np.int64), data[:, 2].astype(np.int64)
+    distances, minutes, existing = data[:, 3], data[:, 4], data[:, 5]
+    # 与格式化显示一致：飞行时间为空或0都视为未设置
+    timed = minutes > 0
+    untimed = ~timed
+
+    signature = _timed_signature(
+        ids[timed], departure_ids[timed], arrival_ids[timed], distances[timed], minutes[timed]
+    )
+    refitted = refit or state is None or state.get('signature') != signature
+    if refitted:
+        model = fit_model(departure_ids[timed], arrival_ids[timed], distances[timed], minutes[timed])
+        candidates = untimed
+    else:
+        # 模型不变，只为新增或修改过（估算值被清空）的记录补估算值
+        model = state['model']
+        candidates = untimed & np.isnan(existing)
+    estimated = existing.copy()
+    estimated[candidates] = predict(model, departure_ids[candidates], arrival_ids[candidates], distances[candidates])
+    changed = candidates & (estimated != existing)
+
+    updates = [(int(value), int(flight_id)) for value, flight_id in zip(estimated[changed], ids[changed])]
+    # 补填了实测飞行时间的记录不再保留估算值
+    updates += [(None, int(flight_id)) for flight_id in ids[timed & ~np.isnan(existing)]]
+    new_state = {
+        'version': version,
+        'signature': signature,
+        'model': model,
+        'measured_minutes': int(minutes[timed].sum()),
+        'measured_count': int(timed.sum()),
+        'estimated_minutes': int(estimated[untimed].sum()),
+        'estimated_count': int(untimed.sum()),
+        'refitted': refitted,
+    }
+    return updates, new_state
+
+
+def refresh_estimates(refit=False):
+    """
+    为当前数据库中没有飞行时间的记录补全估算值（数据版本没有变化时直接返回上次的状态）
+
+    参数:
+        refit: 是否强制重新拟合模型
+    返回: 估算状态字典（模型，以及实测/估算的飞行时间合计和记录数）
+    """
+    state = database_utils.get_flight_time_estimate_state()
+    if not refit and state and state['version'] == database_utils.get_data_version():
+        return state
+    for _ in range(ESTIMATE_RETRIES):
+        version, rows = database_utils.load_flight_time_inputs()
+        updates, new_state = _estimate(version, rows, state, refit)
+        if database_utils.store_flight_time_estimates(version, updates, new_state):
+            return new_state
+    # 写入期间数据一直在变化：返回按最后一次读取的数据算出的合计，下次调用时再写入
+    return new_state
+
+
+def flight_time_totals():
+    """
+    返回累计飞行时间的实测和估算部分
+    返回: {'measured_minutes', 'measured_count', 'estimated_minutes', 'estimated_count'}
+    """
+    state = refresh_estimates()
+    return {key: state[key] for key in ('measured_minutes', 'measured_count', 'estimated_minutes', 'estimated_count')}
+
+
+def main(argv=None):
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="为没有飞行时间的航班估算飞行时间")
+    parser.add_argument('--db', default=database_utils.DB_FILE, help="数据库文件路径")
+    parser.add_argument('--refit', action='store_true', help="强制重新拟合模型")
+    args = parser.parse_args(argv)
+
+    with database_utils.use_db_file(args.db):
+        database_utils.init_database()
+        state = refresh_estimates(refit=args.refit)
+    model = state['model']
+    print(f"模型: {model['intercept']:.1f} 分钟 + {model['slope'] * 1000:.1f} 分钟/千公里"
+          f"（{model['timed_count']} 条实测记录，{len(model['routes'])} 条航线使用中位数）")
+    print(f"实测: {flight_utils.format_total_flight_time(state['measured_minutes'])}（{state['measured_count']} 条）")
+    print(f"估算: {flight_utils.format_total_flight_time(state['estimated_minutes'])}（{state['estimated_count']} 条）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""
+数据导出模块
+以流式生成器的方式导出航班记录（CSV / GeoJSON / Parquet / KML），不会一次性把整张表读入内存
+
+命令行用法:
+    python export_utils.py csv flights.csv
+    python export_utils.py geojson - --chunk-size 5000
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+from xml.sax.saxutils import escape
+
+import database_utils
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet导出是可选功能，需要额外安装pyarrow
+    pa = None
+    pq = None
+
+# 每次从数据库游标读取的行数
+EXPORT_CHUNK_SIZE = 1000
+
+# 导出的字段（与database_utils.iter_flight_chunks返回的元组顺序一致）
+EXPORT_COLUMNS = (
+    'id', 'departure_city', 'arrival_city', 'date', 'distance', 'flight_time',
+    'departure_lat', 'departure_lon', 'arrival_lat', 'arrival_lon'
+)
+
+# 支持的导出格式: 格式名 -> (文件扩展名, MIME类型)
+EXPORT_FORMATS = {
+    'csv': ('csv', 'text/csv'),
+    'geojson': ('geojson', 'application/geo+json'),
+    'kml': ('kml', 'application/vnd.google-earth.kml+xml'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+
+
+def stream_csv(chunks):
+    """
+    将航班数据块转换为CSV文本片段
+    chunks: database_utils.iter_flight_chunks产出的数据块
+    返回: 生成器，每个数据块产出一段CSV文本（第一段包含表头）
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _geojson_feature(row):
+    """把一行航班数据转换为GeoJSON Feature（航线为LineString，坐标顺序为[经度, 纬度]）"""
+    return {
+        'type': 'Feature',
+        'id': row[0],
+        'geometry': {
+            'type': 'LineString',
+            'coordinates': [[row[7], row[6]], [row[9], row[8]]]
+        },
+        'properties': {
+            'departure_city': row[1],
+            'arrival_city': row[2],
+            'date': row[3],
+            'distance': row[4],
+            'flight_time': row[5]
+        }
+    }
+
+
+def stream_geojson(chunks):
+    """
+    将航班数据块转换为GeoJSON FeatureCollection文本片段
+    返回: 生成器，依次产出开头、每个数据块的Feature列表和结尾
+    """
+    yield '{"type": "FeatureCollection", "features": ['
+    first = True
+    for rows in chunks:
+        features = ',\n'.join(json.dumps(_geojson_feature(row), ensure_ascii=False) for row in rows)
+        yield ('\n' if first else ',\n') + features
+        first = False
+    yield '\n]}\n'
+
+
+def stream_kml(chunks):
+    """
+    将航班数据块转换为KML文本片段（每条航班一个带LineString的Placemark）
+    返回: 生成器，依次产出文档头、每个数据块的Placemark和文档尾
+    """
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<kml xmlns="http://www.opengis.net/kml/2.2">\n<Document>\n'
+        '<name>SkyLink Flights</name>\n'
+    )
+    for rows in chunks:
+        placemarks = []
+        for row in rows:
+            name = escape(f"{row[1]} → {row[2]}")
+            placemarks.append(
+                f'<Placemark><name>{name}</name>'
+                f'<description>{escape(row[3])} | {row[4]:.0f} km</description>'
+                f'<TimeStamp><when>{escape(row[3])}</when></TimeStamp>'
+                f'<LineString><tessellate>1</tessellate><coordinates>'
+                f'{row[7]},{row[6]},0 {row[9]},{row[8]},0'
+                f'</coordinates></LineString></Placemark>\n'
+            )
+        yield ''.join(placemarks)
+    yield '</Document>\n</kml>\n'
+
+
+# 文本格式对应的流式生成函数
+TEXT_STREAMERS = {
+    'csv': stream_csv,
+    'geojson': stream_geojson,
+    'kml': stream_kml,
+}
+
+
+def write_parquet(chunks, output):
+    """
+    按数据块写出Parquet文件（每个数据块一个row group，列式存储并使用zstd压缩）
+    output: 文件路径或二进制文件对象
+    """
+    if pa is None:
+        raise RuntimeError("导出Parquet需要安装pyarrow: pip install pyarrow")
+    schema = pa.schema([
+        ('id', pa.int64()),
+        ('departure_city', pa.string()),
+        ('arrival_city', pa.string()),
+        ('date', pa.string()),
+        ('distance', pa.float64()),
+        ('flight_time', pa.int64()),
+        ('departure_lat', pa.float64()),
+        ('departure_lon', pa.float64()),
+        ('arrival_lat', pa.float64()),
+        ('arrival_lon', pa.float64()),
+    ])
+    with pq.ParquetWriter(output, schema, compression='zstd') as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema
+            ))
+
+
+def export_flights(fmt, output, chunk_size=EXPORT_CHUNK_SIZE, include_archive=True):
+    """
+    导出所有航班记录
+
+    参数:
+        fmt: 导出格式（EXPORT_FORMATS中的键）
+        output: 文件路径或文件对象（文本格式需要文本文件对象，Parquet需要二进制文件对象）
+        chunk_size: 每次从数据库读取的行数
+        include_archive: 是否包含归档分区的历史记录
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    chunks = database_utils.iter_flight_chunks(chunk_size, include_archive)
+    if fmt == 'parquet':
+        write_parquet(chunks, output)
+        return
+
+    if isinstance(output, str):
+        with open(output, 'w', encoding='utf-8', newline='') as f:
+            for piece in TEXT_STREAMERS[fmt](chunks):
+                f.write(piece)
+    else:
+        for piece in TEXT_STREAMERS[fmt](chunks):
+            output.write(piece)
+
+
+def export_to_file(fmt, path, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    导出到指定路径的文件（界面下载和后台任务使用）
+    返回: 文件路径
+    """
+    if fmt == 'parquet':
+        with open(path, 'wb') as f:
+            export_flights(fmt, f, chunk_size)
+    else:
+        export_flights(fmt, path, chunk_size)
+    return path
+
+
+def main(argv=None):
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="导出航班记录")
+    parser.add_argument('format', choices=sorted(EXPORT_FORMATS), help="导出格式")
+    parser.add_argument('output', help="输出文件路径，文本格式可以用 - 表示标准输出")
+    parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE, help="每次读取的行数")
+    parser.add_argument('--hot-only', action='store_true', help="只导出热分区（不含归档的历史记录）")
+    parser.add_argument('--db', default=database_utils.DB_FILE, help="数据库文件路径")
+    args = parser.parse_args(argv)
+
+    include_archive = not args.hot_only
+    if args.output == '-' and args.format == 'parquet':
+        parser.error("Parquet格式不能输出到标准输出")
+    with database_utils.use_db_file(args.db):
+        if args.output == '-':
+            export_flights(args.format, sys.stdout, args.chunk_size, include_archive)
+        elif args.format == 'parquet':
+            with open(args.output, 'wb') as f:
+                export_flights(args.format, f, args.chunk_size, include_archive)
+        else:
+            export_flights(args.format, args.output, args.chunk_size, include_archive)
+
+
+if __name__ == '__main__':
+    main()
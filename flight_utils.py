@@ -0,0 +1,246 @@
+"""
+航班通用工具模块
+包含飞行时间格式化、国内/国际判断和航线地图构建等与界面框架无关的函数
+"""
+
+import folium
+
+
+def format_flight_time(minutes):
+    """
+    格式化飞行时间（分钟）为可读字符串
+    例如: 90 -> "1小时30分钟", 120 -> "2小时"
+    """
+    if minutes is None or minutes == 0:
+        return "未设置"
+    # 确保minutes是整数类型
+    try:
+        minutes = int(minutes)
+    except (ValueError, TypeError):
+        return "未设置"
+    
+    if minutes <= 0:
+        return "未设置"
+    
+    hours = minutes // 60
+    mins = minutes % 60
+    if hours > 0 and mins > 0:
+        return f"{hours}小时{mins}分钟"
+    elif hours > 0:
+        return f"{hours}小时"
+    else:
+        return f"{mins}分钟"
+
+
+def minutes_to_hours_minutes(minutes):
+    """
+    将分钟数转换为(小时, 分钟)元组
+    例如: 90 -> (1, 30), 120 -> (2, 0)
+    """
+    if minutes is None or minutes == 0:
+        return (0, 0)
+    try:
+        minutes = int(minutes)
+        if minutes <= 0:
+            return (0, 0)
+        return (minutes // 60, minutes % 60)
+    except (ValueError, TypeError):
+        return (0, 0)
+
+
+def hours_minutes_to_minutes(hours, minutes):
+    """
+    将小时和分钟转换为总分钟数
+    例如: (1, 30) -> 90, (2, 0) -> 120
+    """
+    try:
+        hours = int(hours) if hours else 0
+        minutes = int(minutes) if minutes else 0
+        return hours * 60 + minutes
+    except (ValueError, TypeError):
+        return 0
+
+
+def format_total_flight_time(total_minutes):
+    """
+    格式化总飞行时间为可读字符串（用于统计显示）
+    例如: 390 -> "6小时30分钟"
+    """
+    if total_minutes is None or total_minutes == 0:
+        return "0小时"
+    try:
+        total_minutes = int(total_minutes)
+        if total_minutes <= 0:
+            return "0小时"
+        hours = total_minutes // 60
+        mins = total_minutes % 60
+        if hours > 0 and mins > 0:
+            return f"{hours}小时{mins}分钟"
+        elif hours > 0:
+            return f"{hours}小时"
+        else:
+            return f"{mins}分钟"
+    except (ValueError, TypeError):
+        return "0小时"
+
+
+def is_in_china(lat, lon):
+    """
+    判断坐标是否在中国范围内
+    中国大致范围：纬度 18-54，经度 73-135
+    """
+    return 18 <= lat <= 54 and 73 <= lon <= 135
+
+
+def create_flight_map(flights_data):
+    """
+    创建并返回包含所有航班路线的folium地图对象
+    """
+    if not flights_data:
+        # 如果没有航班数据，显示世界地图中心（北京）
+        m = folium.Map(location=[39.9042, 116.4074], zoom_start=2)
+        return m
+    
+    # 计算地图中心（所有坐标的平均值）
+    all_coords = []
+    for flight in flights_data:
+        if flight.get('departure_coords') and flight.get('arrival_coords'):
+            all_coords.append(flight['departure_coords'])
+            all_coords.append(flight['arrival_coords'])
+    
+    if all_coords:
+        center_lat = sum(coord[0] for coord in all_coords) / len(all_coords)
+        center_lon = sum(coord[1] for coord in all_coords) / len(all_coords)
+        m = folium.Map(location=[center_lat, center_lon], zoom_start=3)
+    else:
+        m = folium.Map(location=[39.9042, 116.4074], zoom_start=2)
+    
+    # 绘制每条航线
+    colors = ['#667eea', '#764ba2', '#f093fb', '#4facfe', '#00f2fe', '#43e97b', '#fa709a']
+    for idx, flight in enumerate(flights_data):
+        dep_coords = flight.get('departure_coords')
+        arr_coords = flight.get('arrival_coords')
+        
+        if dep_coords and arr_coords:
+            color = colors[idx % len(colors)]
+            
+            # 添加出发地marker（使用更美观的图标）
+            folium.Marker(
+                location=dep_coords,
+                popup=f"""
+                <div style="font-family: Arial; min-width: 150px;">
+                    <h4 style="margin: 5px 0; color: #667eea;">✈️ 出发地</h4>
+                    <p style="margin: 5px 0;"><strong>{flight['departure_city']}</strong></p>
+                    <p style="margin: 5px 0; font-size: 0.9em; color: #666;">日期: {flight['date']}</p>
+                </div>
+                """,
+                tooltip=f"出发: {flight['departure_city']}",
+                icon=folium.Icon(color='green', icon='plane', prefix='fa', icon_color='white')
+            ).add_to(m)
+            
+            # 添加到达地marker
+            folium.Marker(
+                location=arr_coords,
+                popup=f"""
+                <div style="font-family: Arial; min-width: 150px;">
+                    <h4 style="margin: 5px 0; color: #764ba2;">✈️ 到达地</h4>
+                    <p style="margin: 5px 0;"><strong>{flight['arrival_city']}</strong></p>
+                    <p style="margin: 5px 0; font-size: 0.9em; color: #666;">日期: {flight['date']}</p>
+                </div>
+                """,
+                tooltip=f"到达: {flight['arrival_city']}",
+                icon=folium.Icon(color='red', icon='plane', prefix='fa', icon_color='white')
+            ).add_to(m)
+            
+            # 绘制飞行路线（使用更美观的样式）
+            flight_time_str = format_flight_time(flight.get('flight_time'))
+            folium.PolyLine(
+                locations=[dep_coords, arr_coords],
+                popup=f"""
+                <div style="font-family: Arial; min-width: 200px;">
+                    <h4 style="margin: 5px 0; color: {color};">
+                        {flight['departure_city']} → {flight['arrival_city']}
+                    </h4>
+                    <p style="margin: 5px 0;"><strong>日期:</strong> {flight['date']}</p>
+                    <p style="margin: 5px 0;"><strong>距离:</strong> {flight.get('distance', 'N/A'):.0f} 公里</p>
+                    <p style="margin: 5px 0;"><strong>飞行时间:</strong> {flight_time_str}</p>
+                </div>
+                """,
+                color=color,
+                weight=3,
+                opacity=0.8,
+                dashArray='10, 5'
+            ).add_to(m)
+    
+    return m
+
+
+def render_map_html(flights_data, path):
+    """
+    构建航线地图并保存为独立的HTML文件（不依赖Streamlit，可直接在浏览器中打开）
+    返回: 文件路径
+    """
+    create_flight_map(flights_data).save(path)
+    return path
+
+
+# 批量编辑器中可编辑的字段（id为空表示新增的行）
+EDITOR_FIELDS = ('id', 'departure_city', 'arrival_city', 'date', 'distance', 'flight_time')
+
+
+def _is_blank(value):
+    """判断单元格是否为空（None、NaN/NaT或空白字符串）"""
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return not value.strip()
+    try:
+        return value != value  # NaN/NaT不等于自身
+    except (TypeError, ValueError):
+        return False
+
+
+def normalize_editor_row(row):
+    """
+    把批量编辑器中的一行规范化为可比较的字典
+    城市名去掉首尾空白，日期转为 'YYYY-MM-DD'，距离转为浮点数，飞行时间转为正整数，空值统一为None
+    """
+    def clean(key, convert):
+        value = row.get(key)
+        return None if _is_blank(value) else convert(value)
+
+    flight_time = clean('flight_time', lambda v: int(float(v)))
+    return {
+        'id': clean('id', lambda v: int(float(v))),
+        'departure_city': clean('departure_city', lambda v: str(v).strip()),
+        'arrival_city': clean('arrival_city', lambda v: str(v).strip()),
+        'date': clean('date', lambda v: v.strftime('%Y-%m-%d') if hasattr(v, 'strftime') else str(v)[:10]),
+        'distance': clean('distance', float),
+        'flight_time': flight_time if flight_time and flight_time > 0 else None
+    }
+
+
+def diff_flight_rows(original_rows, edited_rows):
+    """
+    对比批量编辑前后的表格，找出新增、修改和删除的行
+
+    参数:
+        original_rows: 编辑前的行（normalize_editor_row的结果），每行都有id
+        edited_rows: 编辑后的行（normalize_editor_row的结果），新增的行id为None
+    返回: (新增行列表, {航班ID: (编辑前的行, 编辑后的行)}, 删除的航班ID列表)
+    """
+    originals = {row['id']: row for row in original_rows}
+    inserts = []
+    updates = {}
+    seen = set()
+    for row in edited_rows:
+        if row['id'] is None or row['id'] not in originals:
+            # 整行为空的新行视为没有输入
+            if any(row[field] is not None for field in EDITOR_FIELDS if field != 'id'):
+                inserts.append(row)
+            continue
+        seen.add(row['id'])
+        if row != originals[row['id']]:
+            updates[row['id']] = (originals[row['id']], row)
+    deletes = [flight_id for flight_id in originals if flight_id not in seen]
+    return inserts, updates, deletes
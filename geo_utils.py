@@ -0,0 +1,230 @@
+"""
+地理编码工具模块
+城市坐标优先从数据库的cities表中查找，查不到时再调用Nominatim在线解析；
+同时提供城市名前缀补全和输入过程中的预解析（用户点击添加前坐标通常已经解析好）
+在线解析的结果是公开的地名坐标，在进程内所有会话间共享（有上限）；补全候选只来自当前用户配置的数据库
+"""
+
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from geopy.geocoders import Nominatim
+from geopy.distance import great_circle
+
+import database_utils
+
+# Nominatim使用政策要求每秒最多1次请求
+GEOCODE_MIN_INTERVAL = 1.0
+
+# 输入停止变化多久之后才发起预解析（秒）
+PREFETCH_DEBOUNCE_SECONDS = 0.5
+
+# 城市名补全最多返回的候选数
+SUGGESTION_LIMIT = 5
+
+# 进程内最多缓存的在线解析结果数（超过时丢弃最久未使用的）
+GEOCODE_CACHE_SIZE = 1024
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+_request_lock = threading.Lock()
+
+# 预解析状态：规范化城市名 -> 进行中的Future / 已解析的坐标（最近使用的在后），输入框 -> 等待防抖的城市名
+# 完成的Future和防抖结束的输入框会被移除，已解析的坐标最多保留GEOCODE_CACHE_SIZE个
+_prefetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='geocode-prefetch')
+_prefetch_lock = threading.Lock()
+_prefetch_futures = {}
+_resolved_coords = OrderedDict()
+_latest_inputs = {}
+
+# 城市名前缀索引：((数据库文件, 数据版本号), 排好序的(小写名, 名称)列表)
+_city_index = (None, [])
+
+
+def get_geocoder():
+    """返回进程内共享的地理编码器"""
+    global _geocoder
+    with _geocoder_lock:
+        if _geocoder is None:
+            _geocoder = Nominatim(user_agent="flight_tracker_app")
+        return _geocoder
+
+
+def geocode_remote(city_name):
+    """
+    调用Nominatim解析城市坐标（多个线程同时调用时串行执行，并遵守请求频率限制）
+    返回: (latitude, longitude) 或 None（如果未找到）；网络错误时抛出异常
+    """
+    geocoder = get_geocoder()
+    with _request_lock:
+        location = geocoder.geocode(city_name, timeout=10)
+        time.sleep(GEOCODE_MIN_INTERVAL)
+    if location:
+        return (location.latitude, location.longitude)
+    return None
+
+
+def lookup_city(city_name):
+    """
+    查找城市坐标：已知城市直接使用数据库中的规范坐标，否则在线解析
+    返回: (latitude, longitude) 或 None（如果未找到）
+    """
+    city = database_utils.find_city(city_name)
+    if city:
+        return city['coords']
+    return geocode_remote(city_name)
+
+
+def calculate_distance(point1, point2):
+    """
+    计算两点间的大圆距离（公里），保留两位小数
+    """
+    return round(great_circle(point1, point2).kilometers, 2)
+
+
+def _normalize(city_name):
+    """城市名规范化（去掉首尾空白、不区分大小写），用作缓存键"""
+    return city_name.strip().lower()
+
+
+def _city_index_entries():
+    """
+    返回当前数据库cities表中按小写名排序的城市名列表，数据版本变化时重建
+    （不包含在线解析过的城市：它们可能是其他用户配置输入的，不能出现在本配置的补全候选中）
+    """
+    global _city_index
+    # 不同用户配置使用不同的数据库，版本号要连同数据库文件一起比较
+    version = (database_utils.current_db_file(), database_utils.get_data_version())
+    if _city_index[0] != version:
+        names = {_normalize(city['name']): city['name'] for city in database_utils.load_cities()}
+        _city_index = (version, sorted(names.items()))
+    return _city_index[1]
+
+
+def suggest_cities(prefix, limit=SUGGESTION_LIMIT):
+    """
+    按前缀补全城市名（二分查找有序索引，不区分大小写）
+    返回: 最多limit个城市名
+    """
+    key = _normalize(prefix)
+    if not key:
+        return []
+    entries = _city_index_entries()
+    start = bisect.bisect_left(entries, (key, ''))
+    suggestions = []
+    for entry_key, name in entries[start:start + limit]:
+        if not entry_key.startswith(key):
+            break
+        suggestions.append(name)
+    return suggestions
+
+
+def _geocode_and_remember(city_name):
+    """在线解析城市坐标并记入进程内缓存（未找到的结果也会记住，避免重复请求；超过上限时丢弃最久未使用的）"""
+    coords = geocode_remote(city_name)
+    key = _normalize(city_name)
+    with _prefetch_lock:
+        _resolved_coords[key] = (city_name.strip(), coords)
+        _resolved_coords.move_to_end(key)
+        while len(_resolved_coords) > GEOCODE_CACHE_SIZE:
+            _resolved_coords.popitem(last=False)
+    return coords
+
+
+def _prefetch_done(key, future, field_key, city_name):
+    """
+    预解析结束（完成、失败或被防抖跳过）后的清理：从进行中的列表移除（结果已记入_resolved_coords），
+    输入框之后没有新的输入时，它的记录也不再需要
+    """
+    with _prefetch_lock:
+        if _prefetch_futures.get(key) is future:
+            del _prefetch_futures[key]
+        if field_key is not None and _latest_inputs.get(field_key) == city_name:
+            del _latest_inputs[field_key]
+
+
+def _prefetch_worker(city_name, field_key, db_file):
+    """
+    预解析线程：防抖等待后，如果输入框的内容没有再变化，才真正发起解析
+    db_file: 提交预解析的会话所用的数据库（判断是否为已知城市）
+    """
+    if field_key is not None:
+        time.sleep(PREFETCH_DEBOUNCE_SECONDS)
+        with _prefetch_lock:
+            superseded = _latest_inputs.get(field_key) != city_name
+        if superseded:
+            return None
+    with database_utils.use_db_file(db_file):
+        if database_utils.find_city(city_name):
+            return None
+    return _geocode_and_remember(city_name)
+
+
+def prefetch_city(city_name, field_key=None):
+    """
+    在后台预解析城市坐标（输入框内容变化时调用），已知城市不需要预解析
+    field_key: 输入框标识，同一输入框连续输入时只解析最后一次的内容
+    """
+    if not city_name or not city_name.strip():
+        return
+    key = _normalize(city_name)
+    with _prefetch_lock:
+        if field_key is not None:
+            _latest_inputs[field_key] = city_name
+        if key in _resolved_coords:
+            # 已经解析过：记录过这次输入，同一输入框之前等待防抖的预解析就会被跳过
+            if field_key is not None:
+                del _latest_inputs[field_key]
+            return
+        future = _prefetch_futures.get(key)
+        if future is None or future.done():
+            future = _prefetch_executor.submit(
+                _prefetch_worker, city_name, field_key, database_utils.current_db_file()
+            )
+            _prefetch_futures[key] = future
+    future.add_done_callback(lambda done: _prefetch_done(key, done, field_key, city_name))
+
+
+def resolve_city(city_name):
+    """
+    获取城市坐标：已知城市直接读数据库，其次使用预解析结果（正在解析时等待其完成），最后才立即在线解析
+    返回: (latitude, longitude) 或 None（如果未找到）；网络错误时抛出异常
+    """
+    city = database_utils.find_city(city_name)
+    if city:
+        return city['coords']
+    key = _normalize(city_name)
+    with _prefetch_lock:
+        future = _prefetch_futures.get(key)
+    if future is not None:
+        # 预解析被防抖跳过或失败时，下面会重新解析
+        try:
+            future.result()
+        except Exception:
+            pass
+    with _prefetch_lock:
+        resolved = _resolved_coords.get(key)
+        if resolved is not None:
+            _resolved_coords.move_to_end(key)
+    if resolved is not None:
+        return resolved[1]
+    return _geocode_and_remember(city_name)
+
+
+def resolve_cities(*city_names):
+    """
+    同时解析多个城市的坐标（各自的预解析并行进行，然后一起等待结果）
+    返回: 与输入顺序一致的坐标列表，解析失败的位置为异常对象
+    """
+    for city_name in city_names:
+        prefetch_city(city_name)
+    results = []
+    for city_name in city_names:
+        try:
+            results.append(resolve_city(city_name))
+        except Exception as e:
+            results.append(e)
+    return results
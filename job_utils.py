@@ -0,0 +1,373 @@
+"""
+后台任务模块
+把导入、重新解析坐标、重新计算距离、导出和地图预渲染等耗时操作放到线程池中执行，
+任务状态和进度保存在数据库的jobs表中，界面只负责轮询进度，重启后未完成的任务会从断点继续
+"""
+
+import csv
+import math
+import os
+import shutil
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import database_utils
+import export_utils
+import flight_utils
+import geo_utils
+import report_utils
+import snapshot_utils
+
+# 后台线程数
+JOB_WORKERS = 2
+
+# 每处理多少条记录保存一次进度并检查是否被取消
+JOB_CHUNK_SIZE = 200
+
+# 会修改航班数据的任务类型（完成后界面需要重新加载航班记录）
+DATA_CHANGING_KINDS = ('import', 'regeocode', 'recompute_distance')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """任务在检查点发现已被请求取消"""
+
+
+class JobContext:
+    """
+    任务执行上下文，供任务处理函数汇报进度和检查取消请求
+    start是上次中断时已完成的条数，处理函数应从这里继续；
+    partial_result是与进度一起保存的部分结果（例如导入的计数），继续执行时应在它的基础上累计
+    """
+
+    def __init__(self, job):
+        self.job_id = job['id']
+        self.start = job['progress']
+        self.progress = job['progress']
+        self.batch_id = job['batch_id']
+        self.partial_result = job['result'] or {}
+
+    def journal_batch(self, action):
+        """
+        返回任务的日志批次ID：第一次写入前创建并保存在jobs表中，中断后继续执行时沿用
+        任务分块提交的所有修改都写入这个批次，整个任务作为一步撤销
+        """
+        if self.batch_id is None:
+            self.batch_id = database_utils.begin_batch(action)
+            database_utils.update_job(self.job_id, batch_id=self.batch_id)
+        return self.batch_id
+
+    def set_total(self, total):
+        """记录任务的总条数"""
+        database_utils.update_job(self.job_id, total=total)
+
+    def advance(self, count, partial_result=None):
+        """
+        完成count条后保存进度，并在检查点响应取消请求
+        partial_result: 截至目前的部分结果，与进度在同一次更新中保存（中断后继续时不会少算已完成部分）
+        """
+        self.progress += count
+        fields = {'progress': self.progress}
+        if partial_result is not None:
+            self.partial_result = partial_result
+            fields['result'] = partial_result
+        database_utils.update_job(self.job_id, **fields)
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        """任务已被请求取消时抛出JobCancelled"""
+        job = database_utils.get_job(self.job_id)
+        if job is None or job['status'] in (database_utils.JOB_CANCELLING, database_utils.JOB_CANCELLED):
+            raise JobCancelled()
+
+
+def _read_import_rows(path):
+    """
+    读取待导入的CSV文件（与export_utils导出的CSV格式相同，坐标列可省略）
+    返回: 行字典列表
+    """
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def _optional_float(value):
+    """把CSV单元格转换为浮点数，空值返回None；无法解析或不是有限数值（如nan）时抛出ValueError"""
+    if value is None or not value.strip():
+        return None
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"不是有限数值: {value}")
+    return number
+
+
+def _parse_import_row(row):
+    """
+    校验并转换CSV的一行
+    返回: 航班记录字典，坐标和距离为CSV中给出的值（未给出时为None，由调用方补全）；
+          缺少出发城市、到达城市或日期，日期不是YYYY-MM-DD格式，或数值列无法解析时返回None
+    """
+    try:
+        departure_city = (row.get('departure_city') or '').strip()
+        arrival_city = (row.get('arrival_city') or '').strip()
+        if not departure_city or not arrival_city:
+            return None
+        flight_date = datetime.strptime((row.get('date') or '').strip(), '%Y-%m-%d').date()
+        flight_time = _optional_float(row.get('flight_time'))
+        record = {
+            'departure_city': departure_city,
+            'arrival_city': arrival_city,
+            'date': flight_date.isoformat(),
+            'flight_time': int(flight_time) if flight_time else None,
+            'distance': _optional_float(row.get('distance'))
+        }
+        for prefix in ('departure', 'arrival'):
+            lat = _optional_float(row.get(f'{prefix}_lat'))
+            lon = _optional_float(row.get(f'{prefix}_lon'))
+            record[f'{prefix}_coords'] = (lat, lon) if lat is not None and lon is not None else None
+    except ValueError:
+        return None
+    return record
+
+
+def run_import(ctx, params):
+    """
+    导入任务：逐块读取CSV，补全缺失的坐标和距离后批量写入数据库
+    格式不正确或城市坐标无法解析的行计入skipped，与已有记录重复的行计入duplicates，都不会让任务失败；
+    计数与进度一起保存，中断后继续执行时在已保存的计数上累计
+    params: {'path': CSV文件路径}
+    """
+    rows = _read_import_rows(params['path'])
+    ctx.set_total(len(rows))
+    coords_cache = {}
+    counts = {'imported': 0, 'skipped': 0, 'duplicates': 0}
+    counts.update(ctx.partial_result)
+    for offset in range(ctx.start, len(rows), JOB_CHUNK_SIZE):
+        records = []
+        for row in rows[offset:offset + JOB_CHUNK_SIZE]:
+            record = _parse_import_row(row)
+            if record is None:
+                counts['skipped'] += 1
+                continue
+            for prefix in ('departure', 'arrival'):
+                city = record[f'{prefix}_city']
+                if record[f'{prefix}_coords'] is None:
+                    if city not in coords_cache:
+                        coords_cache[city] = geo_utils.lookup_city(city)
+                    record[f'{prefix}_coords'] = coords_cache[city]
+            if not record['departure_coords'] or not record['arrival_coords']:
+                counts['skipped'] += 1
+                continue
+            if not record['distance']:
+                record['distance'] = geo_utils.calculate_distance(
+                    record['departure_coords'], record['arrival_coords']
+                )
+            records.append(record)
+        # 已存在的航班（指纹相同）直接跳过，中断后重跑同一块也不会重复导入
+        flight_ids = database_utils.save_flights_to_db(
+            records, skip_duplicates=True, action="导入航班",
+            batch_id=ctx.journal_batch("导入航班") if records else None
+        )
+        saved = sum(1 for flight_id in flight_ids if flight_id)
+        counts['imported'] += saved
+        counts['duplicates'] += len(records) - saved
+        ctx.advance(len(rows[offset:offset + JOB_CHUNK_SIZE]), partial_result=counts)
+    return counts
+
+
+def run_regeocode(ctx, params):
+    """
+    重新解析城市坐标任务：对每个城市重新调用在线地理编码并更新cities表
+    params: {'city_ids': 要处理的城市ID列表，省略时处理全部城市}
+    """
+    cities = database_utils.load_cities()
+    if params.get('city_ids'):
+        wanted = set(params['city_ids'])
+        cities = [city for city in cities if city['id'] in wanted]
+    ctx.set_total(len(cities))
+    updated = 0
+    failed = []
+    for city in cities[ctx.start:]:
+        coords = geo_utils.geocode_remote(city['name'])
+        if coords:
+            # 坐标没有变化的城市不写数据库（否则引用它的航班都会被标记为已修改，下次同步时全部重新发送）
+            if tuple(coords) != tuple(city['coords']):
+                database_utils.update_city(city['id'], coords=coords)
+                updated += 1
+        else:
+            failed.append(city['name'])
+        ctx.advance(1)
+    return {'updated': updated, 'failed': failed}
+
+
+def run_recompute_distance(ctx, params):
+    """
+    重新计算距离任务：按当前城市坐标重新计算每条航班的大圆距离
+    params: {}
+    """
+    ctx.set_total(database_utils.count_flights())
+    processed = 0
+    for rows in database_utils.iter_flight_chunks(JOB_CHUNK_SIZE):
+        if processed + len(rows) <= ctx.start:
+            processed += len(rows)
+            continue
+        distances = {
+            row[0]: geo_utils.calculate_distance((row[6], row[7]), (row[8], row[9]))
+            for row in rows
+        }
+        database_utils.update_flight_distances(distances, batch_id=ctx.journal_batch("重新计算距离"))
+        processed += len(rows)
+        ctx.advance(len(rows))
+    return {'updated': processed}
+
+
+def run_export(ctx, params):
+    """
+    导出任务
+    params: {'format': 导出格式, 'path': 输出文件路径（可选）}
+    """
+    extension, _ = export_utils.EXPORT_FORMATS[params['format']]
+    path = params.get('path') or job_file_path(f"job_{ctx.job_id}.{extension}")
+    ctx.set_total(1)
+    export_utils.export_to_file(params['format'], path)
+    ctx.advance(1)
+    return {'path': path}
+
+
+def run_render_map(ctx, params):
+    """
+    地图预渲染任务：把全部航线渲染为独立的HTML文件
+    params: {'path': 输出文件路径（可选）}
+    """
+    path = params.get('path') or job_file_path(f"job_{ctx.job_id}.html")
+    ctx.set_total(1)
+    flight_utils.render_map_html(database_utils.load_flights_from_db(), path)
+    ctx.advance(1)
+    return {'path': path}
+
+
+def run_render_reports(ctx, params):
+    """
+    地图报告任务：按年份/国家/航线批量生成独立的地图报告（进程池并行渲染），完成后打包为zip供下载
+    params: {'by': 分组方式列表（默认按年份）, 'svg': 是否同时生成SVG}
+    """
+    # 报告每次都按当前数据完整生成（内容没有变化的报告会直接复用），进度从0开始计
+    ctx.progress = 0
+    output_dir = report_utils.report_dir()
+
+    def progress(done, total):
+        ctx.set_total(total)
+        ctx.advance(done - ctx.progress)
+
+    reports = report_utils.generate_reports(params.get('by', ['year']), output_dir, params.get('svg', False),
+                                            progress=progress)
+    path = shutil.make_archive(job_file_path(f"job_{ctx.job_id}_reports"), 'zip', output_dir)
+    return {'path': path, 'reports': len(reports)}
+
+
+# 任务类型 -> (处理函数, 显示名称)
+JOB_HANDLERS = {
+    'import': (run_import, "导入航班数据"),
+    'regeocode': (run_regeocode, "重新解析城市坐标"),
+    'recompute_distance': (run_recompute_distance, "重新计算距离"),
+    'export': (run_export, "导出航班数据"),
+    'render_map': (run_render_map, "预渲染航线地图"),
+    'render_reports': (run_render_reports, "生成地图报告"),
+}
+
+
+def _get_executor():
+    """返回进程内共享的任务线程池"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='flight-job')
+        return _executor
+
+
+def _run_job(job_id, db_file):
+    """
+    在后台线程中执行一个任务，并把最终状态写回jobs表
+    db_file: 任务所属用户配置的数据库（任务在这个数据库上执行）
+    """
+    with database_utils.use_db_file(db_file):
+        _run_job_in_current_db(job_id)
+
+
+def _run_job_in_current_db(job_id):
+    """执行当前线程数据库中的一个任务"""
+    job = database_utils.get_job(job_id)
+    if job is None or job['status'] not in database_utils.JOB_UNFINISHED_STATUSES:
+        return
+    if job['status'] == database_utils.JOB_CANCELLING:
+        database_utils.update_job(job_id, status=database_utils.JOB_CANCELLED)
+        return
+
+    if not database_utils.claim_job(job_id):
+        return
+    handler, _ = JOB_HANDLERS[job['kind']]
+    ctx = JobContext(job)
+    try:
+        result = handler(ctx, job['params'])
+    except JobCancelled:
+        database_utils.update_job(job_id, status=database_utils.JOB_CANCELLED)
+    except Exception as e:
+        database_utils.update_job(job_id, status=database_utils.JOB_FAILED, error=str(e))
+    else:
+        database_utils.update_job(job_id, status=database_utils.JOB_DONE, result=result)
+    if ctx.batch_id is not None:
+        database_utils.discard_empty_batch(ctx.batch_id)
+    if job['kind'] in DATA_CHANGING_KINDS:
+        # 已提交的部分（包括被取消或失败的任务）都改变了数据，在任务线程中直接重新生成航班快照
+        try:
+            snapshot_utils.refresh_snapshot()
+        except (OSError, sqlite3.Error):
+            pass
+
+
+def submit_job(kind, params=None):
+    """
+    提交后台任务
+    kind: JOB_HANDLERS中的任务类型
+    返回: 任务ID
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"未知的任务类型: {kind}")
+    job_id = database_utils.create_job(kind, params or {})
+    _get_executor().submit(_run_job, job_id, database_utils.current_db_file())
+    return job_id
+
+
+# 本进程已经恢复过任务的数据库文件
+_resumed = set()
+
+
+def resume_jobs():
+    """
+    恢复当前数据库上次进程退出时尚未完成的任务（每个进程对每个用户配置的数据库只执行一次）
+    运行中的任务从保存的进度继续，正在取消的任务直接标记为已取消
+    """
+    db_file = database_utils.current_db_file()
+    with _executor_lock:
+        if os.path.abspath(db_file) in _resumed:
+            return
+        _resumed.add(os.path.abspath(db_file))
+    for job in database_utils.list_jobs(limit=1000, statuses=database_utils.JOB_UNFINISHED_STATUSES):
+        if job['status'] == database_utils.JOB_CANCELLING:
+            database_utils.update_job(job['id'], status=database_utils.JOB_CANCELLED)
+        else:
+            _get_executor().submit(_run_job, job['id'], db_file)
+
+
+def job_file_path(name):
+    """
+    返回任务输入/输出文件的路径（放在数据库旁边、按数据库区分的目录中，重启后仍可找到）
+    例如: flights_zwx.db -> flights_zwx_jobs_files/
+    """
+    base, _ = os.path.splitext(os.path.abspath(database_utils.current_db_file()))
+    directory = f"{base}_jobs_files"
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
@@ -0,0 +1,336 @@
+"""
+并发负载测试模块
+在临时目录中的数据库上，用多个线程模拟同时在线的会话（Streamlit的每个会话也是同一进程中的一个线程），
+按设定的读写比例调用数据层和地图/统计的构建函数，统计各操作的延迟分位数、吞吐量以及遇到数据库锁时的重试次数
+
+命令行用法:
+    python loadtest_utils.py --sessions 8 --ops 50
+    python loadtest_utils.py --sessions 16 --mix save=2,update=1,load=4,map=1,stats=2 --report report.json
+    python loadtest_utils.py --sessions 16 --isolated-profiles
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import analytics_utils
+import database_utils
+import flight_utils
+import snapshot_utils
+import writer_utils
+
+# 默认的操作比例（权重）
+DEFAULT_MIX = {'save': 2, 'update': 1, 'load': 4, 'map': 1, 'stats': 2}
+
+# 会修改数据的操作
+WRITE_OPERATIONS = ('save', 'update')
+
+# 遇到“database is locked”时最多重试的次数，以及第一次重试前等待的秒数（之后每次加倍）
+LOCK_RETRIES = 5
+LOCK_RETRY_DELAY = 0.05
+
+# 报告中的延迟分位数
+LATENCY_PERCENTILES = (50, 90, 99)
+
+# 模拟数据使用的城市（名称和坐标）
+LOADTEST_CITIES = (
+    ('Beijing', (39.9042, 116.4074)),
+    ('Shanghai', (31.2304, 121.4737)),
+    ('Guangzhou', (23.1291, 113.2644)),
+    ('Chengdu', (30.5728, 104.0668)),
+    ('Tokyo', (35.6762, 139.6503)),
+    ('Singapore', (1.3521, 103.8198)),
+    ('London', (51.5074, -0.1278)),
+    ('San Francisco', (37.7749, -122.4194)),
+)
+
+
+def parse_mix(text):
+    """
+    解析操作比例
+    例如: 'save=2,load=5' -> {'save': 2, 'load': 5}
+    """
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"未知的操作: {name}（可选: {', '.join(OPERATIONS)}）")
+        mix[name] = float(weight) if weight else 1.0
+    return mix
+
+
+def _random_flight(rng):
+    """生成一条随机航班记录（日期和飞行时间随机，几乎不会与已有记录重复）"""
+    (dep, dep_coords), (arr, arr_coords) = rng.sample(LOADTEST_CITIES, 2)
+    return {
+        'departure_city': dep,
+        'arrival_city': arr,
+        'departure_coords': dep_coords,
+        'arrival_coords': arr_coords,
+        'date': f"{rng.randint(2000, 2025)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        'distance': round(rng.uniform(300, 12000), 1),
+        'flight_time': rng.randint(30, 900),
+    }
+
+
+class SessionState:
+    """一个模拟会话的状态：随机数发生器和这个会话可以修改的航班ID"""
+
+    def __init__(self, seed, flight_ids):
+        self.rng = random.Random(seed)
+        self.flight_ids = list(flight_ids)
+
+
+def _op_save(session):
+    flight_id = writer_utils.save_flight(_random_flight(session.rng))
+    session.flight_ids.append(flight_id)
+
+
+def _op_update(session):
+    if not session.flight_ids:
+        return _op_save(session)
+    writer_utils.update_flight(session.rng.choice(session.flight_ids), _random_flight(session.rng))
+
+
+def _op_load(session):
+    database_utils.load_flights_from_db()
+
+
+def _op_map(session):
+    flight_utils.create_flight_map(snapshot_utils.load_flights()).get_root().render()
+
+
+def _op_stats(session):
+    analytics_utils.compute_stats()
+    analytics_utils.time_series('month')
+
+
+# 操作名 -> 执行函数（参数为SessionState）
+OPERATIONS = {
+    'save': _op_save,
+    'update': _op_update,
+    'load': _op_load,
+    'map': _op_map,
+    'stats': _op_stats,
+}
+
+
+def _is_lock_error(error):
+    """判断是否为SQLite的锁冲突（database is locked / busy）"""
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+class _Recorder:
+    """线程安全地汇总各操作的耗时、错误数和锁重试次数"""
+
+    def __init__(self):
+        self.latencies = {name: [] for name in OPERATIONS}
+        self.errors = {name: 0 for name in OPERATIONS}
+        self.lock_retries = 0
+        self.error_messages = []
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, retries, error=None):
+        with self._lock:
+            self.lock_retries += retries
+            if error is None:
+                self.latencies[name].append(seconds)
+            else:
+                self.errors[name] += 1
+                if len(self.error_messages) < 20:
+                    self.error_messages.append(f"{name}: {error}")
+
+
+def _run_operation(name, session, recorder):
+    """执行一次操作，锁冲突时按指数退避重试，并记录总耗时（含重试等待）"""
+    retries = 0
+    start = time.perf_counter()
+    while True:
+        try:
+            OPERATIONS[name](session)
+        except sqlite3.OperationalError as e:
+            if _is_lock_error(e) and retries < LOCK_RETRIES:
+                time.sleep(LOCK_RETRY_DELAY * 2 ** retries)
+                retries += 1
+                continue
+            recorder.record(name, time.perf_counter() - start, retries, e)
+            return
+        except Exception as e:
+            recorder.record(name, time.perf_counter() - start, retries, e)
+            return
+        recorder.record(name, time.perf_counter() - start, retries)
+        return
+
+
+def _session_worker(db_file, session, operations, weights, ops, duration, recorder, start_event):
+    """模拟会话线程：等所有会话就绪后同时开始，按权重随机选择操作，直到做完ops次或运行了duration秒"""
+    with database_utils.use_db_file(db_file):
+        start_event.wait()
+        deadline = time.perf_counter() + duration if duration is not None else None
+        done = 0
+        while done < ops and (deadline is None or time.perf_counter() < deadline):
+            _run_operation(session.rng.choices(operations, weights)[0], session, recorder)
+            done += 1
+
+
+def _seed_database(db_file, count, seed):
+    """初始化数据库并写入count条初始航班（一个事务），返回航班ID列表"""
+    with database_utils.use_db_file(db_file):
+        database_utils.init_database()
+        rng = random.Random(seed)
+        records = [_random_flight(rng) for _ in range(count)]
+        return [flight_id for flight_id in database_utils.save_flights_to_db(records, skip_duplicates=True) if flight_id]
+
+
+def _summarize(latencies, elapsed):
+    """计算一种操作的次数、吞吐量和延迟分位数（毫秒）"""
+    if not latencies:
+        return {'count': 0, 'throughput': 0.0}
+    values = np.array(latencies) * 1000
+    summary = {
+        'count': len(latencies),
+        'throughput': round(len(latencies) / elapsed, 2),
+        'mean_ms': round(float(values.mean()), 2),
+        'max_ms': round(float(values.max()), 2),
+    }
+    for percentile in LATENCY_PERCENTILES:
+        summary[f"p{percentile}_ms"] = round(float(np.percentile(values, percentile)), 2)
+    return summary
+
+
+def run_load_test(sessions=8, ops=50, duration=None, mix=None, seed_flights=500,
+                  isolated_profiles=False, seed=0, directory=None, group_commit=True):
+    """
+    运行一次负载测试（所有数据库都建在临时目录中，测试结束后删除）
+
+    参数:
+        sessions: 同时运行的模拟会话数
+        ops: 每个会话执行的操作数
+        duration: 最长运行秒数（None表示不限，做完ops次为止）
+        mix: 操作比例 {操作名: 权重}，默认DEFAULT_MIX
+        seed_flights: 每个数据库预先写入的航班数
+        isolated_profiles: 为True时每个会话使用独立的数据库（模拟多用户配置），否则所有会话共用一个数据库
+        seed: 随机数种子
+        directory: 临时数据库所在的父目录（默认系统临时目录）
+        group_commit: 写操作是否经writer_utils的写入队列合并提交（False时每次写入单独提交，用于对比）
+    返回: 报告字典
+    """
+    mix = mix or DEFAULT_MIX
+    operations = [name for name, weight in mix.items() if weight > 0]
+    weights = [mix[name] for name in operations]
+    recorder = _Recorder()
+    group_commit_enabled = writer_utils.GROUP_COMMIT_ENABLED
+    writer_utils.GROUP_COMMIT_ENABLED = group_commit
+
+    with tempfile.TemporaryDirectory(prefix='flight-loadtest-', dir=directory) as tmp:
+        if isolated_profiles:
+            db_files = [os.path.join(tmp, f"session_{idx}.db") for idx in range(sessions)]
+        else:
+            db_files = [os.path.join(tmp, 'shared.db')] * sessions
+        seeded = {}
+        for idx, db_file in enumerate(db_files):
+            if db_file not in seeded:
+                seeded[db_file] = _seed_database(db_file, seed_flights, f"{seed}-seed-{idx}")
+
+        start_event = threading.Event()
+        threads = []
+        for idx, db_file in enumerate(db_files):
+            session = SessionState(f"{seed}-session-{idx}", seeded[db_file])
+            threads.append(threading.Thread(
+                target=_session_worker,
+                args=(db_file, session, operations, weights, ops, duration, recorder, start_event),
+                name=f"loadtest-session-{idx}"
+            ))
+        for thread in threads:
+            thread.start()
+        start = time.perf_counter()
+        start_event.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        writer_utils.GROUP_COMMIT_ENABLED = group_commit_enabled
+        # 临时目录删除前关闭注册表中这些数据库的连接
+        for db_file in set(db_files):
+            database_utils._registry.close_all(db_file)
+
+    all_latencies = [value for values in recorder.latencies.values() for value in values]
+    write_latencies = [value for name in WRITE_OPERATIONS for value in recorder.latencies[name]]
+    return {
+        'config': {
+            'sessions': sessions, 'ops': ops, 'duration': duration, 'mix': mix,
+            'seed_flights': seed_flights, 'isolated_profiles': isolated_profiles, 'seed': seed,
+            'group_commit': group_commit,
+        },
+        'elapsed_seconds': round(elapsed, 3),
+        'total': _summarize(all_latencies, elapsed),
+        'writes': _summarize(write_latencies, elapsed),
+        'operations': {
+            name: dict(_summarize(recorder.latencies[name], elapsed), errors=recorder.errors[name])
+            for name in operations
+        },
+        'lock_retries': recorder.lock_retries,
+        'errors': sum(recorder.errors.values()),
+        'error_samples': recorder.error_messages,
+    }
+
+
+def format_report(report):
+    """把报告整理为便于阅读的文本表格"""
+    config = report['config']
+    lines = [
+        f"会话数 {config['sessions']}，每个会话 {config['ops']} 次操作，"
+        f"{'每个会话独立数据库' if config['isolated_profiles'] else '共用一个数据库'}，"
+        f"{'组提交' if config['group_commit'] else '逐次提交'}，"
+        f"耗时 {report['elapsed_seconds']} 秒",
+        f"{'操作':<8}{'次数':>8}{'错误':>6}{'吞吐/秒':>10}"
+        + ''.join(f"{f'p{p}(ms)':>11}" for p in LATENCY_PERCENTILES) + f"{'max(ms)':>11}",
+    ]
+    rows = list(report['operations'].items()) + [('写入合计', report['writes']), ('全部', report['total'])]
+    for name, summary in rows:
+        lines.append(
+            f"{name:<8}{summary['count']:>8}{summary.get('errors', ''):>6}{summary['throughput']:>10}"
+            + ''.join(f"{summary.get(f'p{p}_ms', '-'):>11}" for p in LATENCY_PERCENTILES)
+            + f"{summary.get('max_ms', '-'):>11}"
+        )
+    lines.append(f"锁冲突重试 {report['lock_retries']} 次，失败 {report['errors']} 次")
+    lines.extend(f"    {message}" for message in report['error_samples'])
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="模拟多个并发会话对数据层进行负载测试（只使用临时数据库）")
+    parser.add_argument('--sessions', type=int, default=8, help="并发会话数")
+    parser.add_argument('--ops', type=int, default=50, help="每个会话的操作数")
+    parser.add_argument('--duration', type=float, help="最长运行秒数")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help="操作比例，例如 save=2,update=1,load=4,map=1,stats=2")
+    parser.add_argument('--seed-flights', type=int, default=500, help="每个数据库预先写入的航班数")
+    parser.add_argument('--isolated-profiles', action='store_true', help="每个会话使用独立的数据库")
+    parser.add_argument('--seed', type=int, default=0, help="随机数种子")
+    parser.add_argument('--no-group-commit', action='store_true', help="写操作逐次单独提交（不经写入队列）")
+    parser.add_argument('--report', help="把报告保存为JSON文件")
+    args = parser.parse_args(argv)
+
+    report = run_load_test(
+        sessions=args.sessions, ops=args.ops, duration=args.duration, mix=args.mix,
+        seed_flights=args.seed_flights, isolated_profiles=args.isolated_profiles, seed=args.seed,
+        group_commit=not args.no_group_commit
+    )
+    print(format_report(report))
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,12 +6,29 @@
 import streamlit as st
 import folium
 from streamlit_folium import st_folium
-from geopy.geocoders import Nominatim
 from geopy.distance import great_circle
 import pandas as pd
 from datetime import datetime
+import os
+import time
+import uuid
+import analytics_utils
 import database_utils
+import estimate_utils
+import export_utils
+import geo_utils
+import job_utils
+import report_utils
+from flight_utils import (
+    format_flight_time, minutes_to_hours_minutes, hours_minutes_to_minutes,
+    format_total_flight_time, create_flight_map,
+    normalize_editor_row, diff_flight_rows
+)
+import search_utils
+import snapshot_utils
+import table_utils
 import ui
+import writer_utils
 
 # 页面配置
 st.set_page_config(
@@ -24,12 +41,46 @@ st.set_page_config(
 # 加载自定义CSS样式
 ui.load_custom_css()
 
+# 用户配置：通过URL参数 ?profile=名称 或侧边栏切换，每个配置使用独立的数据库文件，互不争用写锁
+requested_profile = st.query_params.get('profile', '')
+try:
+    profile_db = database_utils.profile_db_file(requested_profile)
+except ValueError as e:
+    st.error(f"❌ {e}")
+    requested_profile = ''
+    profile_db = database_utils.profile_db_file()
+if st.session_state.get('profile') != requested_profile:
+    # 切换配置后清空上一个配置的会话数据（航班列表、编辑状态等）
+    for state_key in list(st.session_state.keys()):
+        del st.session_state[state_key]
+    st.session_state.profile = requested_profile
+st.session_state.profile_db = profile_db
+
+
+def activate_profile():
+    """
+    让当前线程使用会话所选用户配置的数据库
+    脚本开头和控件回调中都要调用（回调在新的线程中先于脚本执行）
+    """
+    database_utils.set_current_db_file(st.session_state.get('profile_db'))
+
+
+activate_profile()
+
 # 初始化数据库
 database_utils.init_database()
 
-# 初始化session_state用于存储航班记录（从数据库加载）
+# 恢复上次退出时未完成的后台任务（每个进程只执行一次）
+job_utils.resume_jobs()
+
+# 有归档分区时默认只加载热分区（最近几年）的记录，需要查看全部历史时在侧边栏打开开关
+if 'include_archive' not in st.session_state:
+    st.session_state.include_archive = False
+
+# 初始化session_state用于存储航班记录（优先从快照加载，快照过期时从数据库加载）
 if 'flights' not in st.session_state:
-    st.session_state.flights = database_utils.load_flights_from_db()
+    st.session_state.flights_version = database_utils.get_data_version()
+    st.session_state.flights = snapshot_utils.load_flights(st.session_state.include_archive)
 
 # 初始化编辑状态
 if 'editing_flight_id' not in st.session_state:
@@ -41,30 +92,150 @@ if 'deleting_flight_id' not in st.session_state:
 
 def reload_flights():
     """从数据库重新加载航班记录到session_state"""
-    st.session_state.flights = database_utils.load_flights_from_db()
+    st.session_state.flights_version = database_utils.get_data_version()
+    st.session_state.flights = snapshot_utils.load_flights(st.session_state.include_archive)
+
+def toggle_archive():
+    """显示归档历史记录开关的回调：按新的设置重新加载航班记录"""
+    activate_profile()
+    reload_flights()
+
+def mark_flights_current(marker_before):
+    """
+    本会话的写入提交并就地更新session_state之后调用
+    只有写入前会话已是最新、且期间只有这一次写入（版本号加1、只新增了一个日志批次）时，才把会话标记为最新；
+    期间有其他会话或后台任务的写入（包括与本次写入合并在同一次提交中的）时保持原版本号，
+    由render_jobs_panel重新加载全量记录，不会把它们的修改当作已读取
+    marker_before: 写入前database_utils.get_write_marker()的返回值
+    """
+    version_before = marker_before[0]
+    if st.session_state.flights_version == version_before and \
+            database_utils.writes_since(marker_before) == (1, 1):
+        st.session_state.flights_version = version_before + 1
+
+# 后台任务状态的显示名称
+JOB_STATUS_LABELS = {
+    database_utils.JOB_QUEUED: "⏳ 排队中",
+    database_utils.JOB_RUNNING: "🔄 运行中",
+    database_utils.JOB_CANCELLING: "🛑 正在取消",
+    database_utils.JOB_CANCELLED: "🚫 已取消",
+    database_utils.JOB_DONE: "✅ 已完成",
+    database_utils.JOB_FAILED: "❌ 失败",
+}
+
+def cancel_job(job_id):
+    """取消任务按钮的回调"""
+    activate_profile()
+    database_utils.request_job_cancel(job_id)
+
+
+def render_jobs_panel():
+    """
+    渲染后台任务列表（进度、取消按钮、结果下载）
+    其他会话或后台任务修改了数据时，重新加载航班记录并刷新整个页面
+    作为fragment定时刷新时只执行本函数（在新的线程中），需要先切换到会话所选配置的数据库
+    """
+    activate_profile()
+    if database_utils.get_data_version() != st.session_state.flights_version:
+        reload_flights()
+        st.rerun()
 
-# 初始化地理编码器
-@st.cache_resource
-def get_geocoder():
-    """初始化并缓存地理编码器"""
-    return Nominatim(user_agent="flight_tracker_app")
+    jobs = database_utils.list_jobs(limit=5)
+    if not jobs:
+        st.caption("暂无后台任务")
+        return
+    for job in jobs:
+        _, job_name = job_utils.JOB_HANDLERS[job['kind']]
+        st.caption(f"#{job['id']} {job_name} · {JOB_STATUS_LABELS.get(job['status'], job['status'])}")
+        if job['status'] in database_utils.JOB_UNFINISHED_STATUSES:
+            if job['total']:
+                st.progress(min(job['progress'] / job['total'], 1.0), text=f"{job['progress']}/{job['total']}")
+            st.button(
+                "取消任务",
+                key=f"cancel_job_{job['id']}",
+                on_click=cancel_job,
+                args=(job['id'],),
+                use_container_width=True
+            )
+        elif job['status'] == database_utils.JOB_FAILED:
+            st.caption(f"错误: {job['error']}")
+        elif job['status'] == database_utils.JOB_DONE and job['result']:
+            result_path = job['result'].get('path')
+            if result_path and os.path.exists(result_path):
+                with open(result_path, 'rb') as f:
+                    st.download_button(
+                        "⬇️ 下载结果",
+                        data=f,
+                        file_name=os.path.basename(result_path),
+                        key=f"download_job_{job['id']}",
+                        use_container_width=True
+                    )
+            elif job['kind'] == 'import':
+                st.caption(
+                    f"导入 {job['result']['imported']} 条，跳过 {job['result']['skipped']} 条，"
+                    f"重复 {job['result'].get('duplicates', 0)} 条"
+                )
 
-geolocator = get_geocoder()
+# 会话标识（用于区分不同会话的输入框，预解析防抖按输入框进行）
+if 'session_key' not in st.session_state:
+    st.session_state.session_key = uuid.uuid4().hex
 
 def geocode_city(city_name):
     """
-    根据城市名称获取经纬度坐标
+    根据城市名称获取经纬度坐标（已知城市和预解析过的城市直接返回）
     返回: (latitude, longitude) 或 None（如果未找到）
     """
     try:
-        location = geolocator.geocode(city_name, timeout=10)
-        if location:
-            return (location.latitude, location.longitude)
-        return None
+        return geo_utils.resolve_city(city_name)
     except Exception as e:
         st.error(f"地理编码错误 ({city_name}): {str(e)}")
         return None
 
+def geocode_cities(*city_names):
+    """
+    同时获取多个城市的坐标
+    返回: 与输入顺序一致的坐标列表，失败的位置为None
+    """
+    results = []
+    for city_name, coords in zip(city_names, geo_utils.resolve_cities(*city_names)):
+        if isinstance(coords, Exception):
+            st.error(f"地理编码错误 ({city_name}): {str(coords)}")
+            coords = None
+        results.append(coords)
+    return results
+
+def prefetch_city_input(input_key):
+    """城市输入框内容变化时，在后台预解析坐标"""
+    activate_profile()
+    geo_utils.prefetch_city(
+        st.session_state[input_key],
+        field_key=f"{st.session_state.session_key}:{input_key}"
+    )
+
+def select_city_suggestion(input_key, city_name):
+    """选中补全候选：填入输入框并预解析"""
+    st.session_state[input_key] = city_name
+    prefetch_city_input(input_key)
+
+def render_city_suggestions(input_key):
+    """在城市输入框下方显示前缀补全候选"""
+    value = st.session_state.get(input_key, '')
+    suggestions = [
+        name for name in geo_utils.suggest_cities(value, limit=3)
+        if name.lower() != value.strip().lower()
+    ]
+    if suggestions:
+        suggestion_cols = st.columns(len(suggestions))
+        for col, name in zip(suggestion_cols, suggestions):
+            with col:
+                st.button(
+                    name,
+                    key=f"suggest_{input_key}_{name}",
+                    on_click=select_city_suggestion,
+                    args=(input_key, name),
+                    use_container_width=True
+                )
+
 def calculate_distance(point1, point2):
     """
     计算两点间的大圆距离（公里）
@@ -77,179 +248,162 @@ def calculate_distance(point1, point2):
         st.error(f"距离计算错误: {str(e)}")
         return None
 
-def format_flight_time(minutes):
+def save_grid_changes(original_rows, edited_rows):
     """
-    格式化飞行时间（分钟）为可读字符串
-    例如: 90 -> "1小时30分钟", 120 -> "2小时"
+    保存批量编辑器中的修改：只对新增行和改了城市名的行重新解析坐标（同名城市只解析一次），
+    所有新增、修改和删除在一个事务中提交，然后就地更新session_state中的航班记录
+    返回: 是否保存成功
     """
-    if minutes is None or minutes == 0:
-        return "未设置"
-    # 确保minutes是整数类型
-    try:
-        minutes = int(minutes)
-    except (ValueError, TypeError):
-        return "未设置"
-    
-    if minutes <= 0:
-        return "未设置"
-    
-    hours = minutes // 60
-    mins = minutes % 60
-    if hours > 0 and mins > 0:
-        return f"{hours}小时{mins}分钟"
-    elif hours > 0:
-        return f"{hours}小时"
-    else:
-        return f"{mins}分钟"
+    inserts, updates, deletes = diff_flight_rows(original_rows, edited_rows)
+    if not inserts and not updates and not deletes:
+        st.info("💡 没有需要保存的更改")
+        return False
 
-def minutes_to_hours_minutes(minutes):
-    """
-    将分钟数转换为(小时, 分钟)元组
-    例如: 90 -> (1, 30), 120 -> (2, 0)
-    """
-    if minutes is None or minutes == 0:
-        return (0, 0)
-    try:
-        minutes = int(minutes)
-        if minutes <= 0:
-            return (0, 0)
-        return (minutes // 60, minutes % 60)
-    except (ValueError, TypeError):
-        return (0, 0)
-
-def hours_minutes_to_minutes(hours, minutes):
-    """
-    将小时和分钟转换为总分钟数
-    例如: (1, 30) -> 90, (2, 0) -> 120
-    """
-    try:
-        hours = int(hours) if hours else 0
-        minutes = int(minutes) if minutes else 0
-        return hours * 60 + minutes
-    except (ValueError, TypeError):
-        return 0
+    changed_rows = inserts + [new for _, new in updates.values()]
+    if any(not row['departure_city'] or not row['arrival_city'] or not row['date'] for row in changed_rows):
+        st.error("⚠️ 每条航班都需要填写出发城市、到达城市和日期")
+        return False
 
-def format_total_flight_time(total_minutes):
-    """
-    格式化总飞行时间为可读字符串（用于统计显示）
-    例如: 390 -> "6小时30分钟"
-    """
-    if total_minutes is None or total_minutes == 0:
-        return "0小时"
+    flights_by_id = {flight['id']: flight for flight in st.session_state.flights}
+
+    # 需要重新解析坐标的城市（按规范化名称去重）
+    pending_cities = {}
+    for row in inserts:
+        for key in ('departure_city', 'arrival_city'):
+            pending_cities.setdefault(row[key].lower(), row[key])
+    for old, new in updates.values():
+        for key in ('departure_city', 'arrival_city'):
+            if new[key] != old[key]:
+                pending_cities.setdefault(new[key].lower(), new[key])
+    with st.spinner(f"正在解析 {len(pending_cities)} 个城市的坐标..."):
+        resolved = dict(zip(pending_cities, geocode_cities(*pending_cities.values())))
+    failed = [name for key, name in pending_cities.items() if not resolved[key]]
+    if failed:
+        st.error(f"无法解析城市坐标: {', '.join(failed)}")
+        return False
+
+    def build_record(row, old=None):
+        flight = flights_by_id.get(row['id'], {})
+        record = dict(row)
+        cities_changed = old is None
+        for prefix in ('departure', 'arrival'):
+            key = f'{prefix}_city'
+            if old is not None and row[key] == old[key]:
+                record[f'{prefix}_coords'] = flight[f'{prefix}_coords']
+            else:
+                record[f'{prefix}_coords'] = resolved[row[key].lower()]
+                cities_changed = True
+        # 城市变了但距离没有手动修改（或未填写）时重新计算距离
+        if not row['distance'] or (cities_changed and old is not None and row['distance'] == old['distance']):
+            record['distance'] = calculate_distance(record['departure_coords'], record['arrival_coords'])
+        return record
+
+    insert_records = [build_record(row) for row in inserts]
+    update_records = {flight_id: build_record(new, old) for flight_id, (old, new) in updates.items()}
+    marker_before = database_utils.get_write_marker()
     try:
-        total_minutes = int(total_minutes)
-        if total_minutes <= 0:
-            return "0小时"
-        hours = total_minutes // 60
-        mins = total_minutes % 60
-        if hours > 0 and mins > 0:
-            return f"{hours}小时{mins}分钟"
-        elif hours > 0:
-            return f"{hours}小时"
-        else:
-            return f"{mins}分钟"
-    except (ValueError, TypeError):
-        return "0小时"
+        new_ids = database_utils.apply_flight_changes(insert_records, update_records, deletes)
+    except database_utils.DuplicateFlightError as e:
+        st.error(f"⚠️ 保存失败，有航班与已有记录重复: {e}")
+        return False
+
+    # 就地更新session_state，不需要重新加载全量记录；受影响的记录从数据库重新读取
+    # （输入的城市名可能被解析为已有城市，例如"beijing"对应已有的"Beijing"，以数据库中的为准）
+    for flight_id in deletes:
+        flights_by_id.pop(flight_id, None)
+    for flight in database_utils.load_flights_by_ids(list(update_records) + new_ids):
+        flights_by_id[flight['id']] = flight
+    st.session_state.flights = list(flights_by_id.values())
+    mark_flights_current(marker_before)
+    st.success(f"✅ 已保存: 新增 {len(inserts)} 条，修改 {len(updates)} 条，删除 {len(deletes)} 条")
+    return True
 
-def is_in_china(lat, lon):
-    """
-    判断坐标是否在中国范围内
-    中国大致范围：纬度 18-54，经度 73-135
-    """
-    return 18 <= lat <= 54 and 73 <= lon <= 135
 
-def create_flight_map(flights_data):
+def render_ranking_pager(key, total):
     """
-    创建并返回包含所有航班路线的folium地图对象
+    排行卡片下方的翻页按钮（“显示更多”进入下一页）
+    key: 排行的标识，当前页码保存在session_state的 {key}_page 中
+    total: 排行的总条数
+    返回: 当前页第一条的位置（用于从数据库读取这一页）
     """
-    if not flights_data:
-        # 如果没有航班数据，显示世界地图中心（北京）
-        m = folium.Map(location=[39.9042, 116.4074], zoom_start=2)
-        return m
-    
-    # 计算地图中心（所有坐标的平均值）
-    all_coords = []
-    for flight in flights_data:
-        if flight.get('departure_coords') and flight.get('arrival_coords'):
-            all_coords.append(flight['departure_coords'])
-            all_coords.append(flight['arrival_coords'])
-    
-    if all_coords:
-        center_lat = sum(coord[0] for coord in all_coords) / len(all_coords)
-        center_lon = sum(coord[1] for coord in all_coords) / len(all_coords)
-        m = folium.Map(location=[center_lat, center_lon], zoom_start=3)
-    else:
-        m = folium.Map(location=[39.9042, 116.4074], zoom_start=2)
-    
-    # 绘制每条航线
-    colors = ['#667eea', '#764ba2', '#f093fb', '#4facfe', '#00f2fe', '#43e97b', '#fa709a']
-    for idx, flight in enumerate(flights_data):
-        dep_coords = flight.get('departure_coords')
-        arr_coords = flight.get('arrival_coords')
-        
-        if dep_coords and arr_coords:
-            color = colors[idx % len(colors)]
-            
-            # 添加出发地marker（使用更美观的图标）
-            folium.Marker(
-                location=dep_coords,
-                popup=f"""
-                <div style="font-family: Arial; min-width: 150px;">
-                    <h4 style="margin: 5px 0; color: #667eea;">✈️ 出发地</h4>
-                    <p style="margin: 5px 0;"><strong>{flight['departure_city']}</strong></p>
-                    <p style="margin: 5px 0; font-size: 0.9em; color: #666;">日期: {flight['date']}</p>
-                </div>
-                """,
-                tooltip=f"出发: {flight['departure_city']}",
-                icon=folium.Icon(color='green', icon='plane', prefix='fa', icon_color='white')
-            ).add_to(m)
-            
-            # 添加到达地marker
-            folium.Marker(
-                location=arr_coords,
-                popup=f"""
-                <div style="font-family: Arial; min-width: 150px;">
-                    <h4 style="margin: 5px 0; color: #764ba2;">✈️ 到达地</h4>
-                    <p style="margin: 5px 0;"><strong>{flight['arrival_city']}</strong></p>
-                    <p style="margin: 5px 0; font-size: 0.9em; color: #666;">日期: {flight['date']}</p>
-                </div>
-                """,
-                tooltip=f"到达: {flight['arrival_city']}",
-                icon=folium.Icon(color='red', icon='plane', prefix='fa', icon_color='white')
-            ).add_to(m)
-            
-            # 绘制飞行路线（使用更美观的样式）
-            flight_time_str = format_flight_time(flight.get('flight_time'))
-            folium.PolyLine(
-                locations=[dep_coords, arr_coords],
-                popup=f"""
-                <div style="font-family: Arial; min-width: 200px;">
-                    <h4 style="margin: 5px 0; color: {color};">
-                        {flight['departure_city']} → {flight['arrival_city']}
-                    </h4>
-                    <p style="margin: 5px 0;"><strong>日期:</strong> {flight['date']}</p>
-                    <p style="margin: 5px 0;"><strong>距离:</strong> {flight.get('distance', 'N/A'):.0f} 公里</p>
-                    <p style="margin: 5px 0;"><strong>飞行时间:</strong> {flight_time_str}</p>
-                </div>
-                """,
-                color=color,
-                weight=3,
-                opacity=0.8,
-                dashArray='10, 5'
-            ).add_to(m)
-    
-    return m
+    page_key = f"{key}_page"
+    page_count = max(1, -(-total // ui.RANKING_PAGE_SIZE))
+    page = min(st.session_state.get(page_key, 0), page_count - 1)
+    if page_count > 1:
+        prev_col, info_col, next_col = st.columns([1, 2, 1])
+        with prev_col:
+            if st.button("⬅️ 前一页", key=f"{key}_prev", disabled=page == 0, use_container_width=True):
+                st.session_state[page_key] = page - 1
+                st.rerun()
+        with info_col:
+            first = page * ui.RANKING_PAGE_SIZE + 1
+            last = min(total, (page + 1) * ui.RANKING_PAGE_SIZE)
+            st.caption(f"第 {first}–{last} 名，共 {total} 条")
+        with next_col:
+            if st.button("显示更多 ➡️", key=f"{key}_next", disabled=page + 1 >= page_count, use_container_width=True):
+                st.session_state[page_key] = page + 1
+                st.rerun()
+    return page * ui.RANKING_PAGE_SIZE
+
 
 # 主界面
 ui.render_main_title()
 
 # 侧边栏：输入表单
 with st.sidebar:
+    # 用户配置切换（切换后URL中会带上 ?profile=名称，可以直接收藏或分享给对应的用户）
+    with st.expander(f"👤 当前配置: {requested_profile or '默认'}"):
+        profile_options = [''] + database_utils.list_profiles()
+        if requested_profile not in profile_options:
+            profile_options.append(requested_profile)
+        selected_profile = st.selectbox(
+            "切换到已有配置",
+            profile_options,
+            index=profile_options.index(requested_profile),
+            format_func=lambda name: name or "默认"
+        )
+        new_profile = st.text_input("或新建配置", placeholder="字母、数字、下划线或减号")
+        if st.button("切换", use_container_width=True):
+            target_profile = new_profile.strip() or selected_profile
+            try:
+                database_utils.profile_db_file(target_profile)
+            except ValueError as e:
+                st.error(f"❌ {e}")
+            else:
+                if target_profile:
+                    st.query_params['profile'] = target_profile
+                else:
+                    st.query_params.pop('profile', None)
+                st.rerun()
+
+    # 有归档分区时，地图和航班列表默认只显示热分区的记录（概览统计、排行和趋势始终包含全部历史）
+    if database_utils.list_archive_files():
+        st.toggle(
+            "🗄️ 显示归档的历史记录",
+            key="include_archive",
+            on_change=toggle_archive,
+            help="打开后地图和航班列表包含归档分区中的全部历史记录（加载较慢）"
+        )
+
     st.markdown("### ✈️ 添加航班记录")
     st.markdown("")
     
-    departure_city = st.text_input("出发城市", placeholder="例如: Beijing")
-    arrival_city = st.text_input("到达城市", placeholder="例如: San Francisco")
+    departure_city = st.text_input(
+        "出发城市",
+        placeholder="例如: Beijing",
+        key="departure_city_input",
+        on_change=prefetch_city_input,
+        args=("departure_city_input",)
+    )
+    render_city_suggestions("departure_city_input")
+    arrival_city = st.text_input(
+        "到达城市",
+        placeholder="例如: San Francisco",
+        key="arrival_city_input",
+        on_change=prefetch_city_input,
+        args=("arrival_city_input",)
+    )
+    render_city_suggestions("arrival_city_input")
     flight_date = st.date_input("出行日期", value=datetime.now().date())
     flight_distance = st.number_input(
         "飞行距离（公里，可选）", 
@@ -284,10 +438,12 @@ with st.sidebar:
     if st.session_state.get('show_add_confirm', False):
         pending_data = st.session_state.get('pending_flight_data', {})
         
-        # 地理编码
+        # 地理编码（输入时已在后台预解析，通常可以直接拿到结果）
         with st.spinner("正在解析城市坐标..."):
-            dep_coords = geocode_city(pending_data['departure_city'])
-            arr_coords = geocode_city(pending_data['arrival_city'])
+            dep_coords, arr_coords = geocode_cities(
+                pending_data['departure_city'],
+                pending_data['arrival_city']
+            )
         
         if dep_coords and arr_coords:
             # 计算距离（如果未提供）
@@ -326,16 +482,21 @@ with st.sidebar:
                             'arrival_coords': arr_coords,
                             'flight_time': total_flight_time if total_flight_time > 0 else None
                         }
-                        # 保存到数据库
-                        flight_id = database_utils.save_flight_to_db(flight_record)
-                        flight_record['id'] = flight_id
-                        # 更新session_state
-                        st.session_state.flights.append(flight_record)
-                        # 清除确认对话框状态
-                        st.session_state.show_add_confirm = False
-                        st.session_state.pending_flight_data = {}
-                        st.success(f"已添加航班: {pending_data['departure_city']} → {pending_data['arrival_city']}")
-                        st.rerun()
+                        # 保存到数据库（同一航线、同一天、同样飞行时间的记录已存在时不再重复添加）
+                        marker_before = database_utils.get_write_marker()
+                        try:
+                            flight_id = writer_utils.save_flight(flight_record)
+                        except database_utils.DuplicateFlightError as e:
+                            st.warning(f"⚠️ 该航班已经记录过了（{e}）")
+                        else:
+                            # 更新session_state（新记录从数据库读取，城市名以解析后的已有城市为准）
+                            st.session_state.flights.extend(database_utils.load_flights_by_ids([flight_id]))
+                            mark_flights_current(marker_before)
+                            # 清除确认对话框状态
+                            st.session_state.show_add_confirm = False
+                            st.session_state.pending_flight_data = {}
+                            st.success(f"已添加航班: {pending_data['departure_city']} → {pending_data['arrival_city']}")
+                            st.rerun()
                 
                 with col_confirm2:
                     if st.button("❌ 取消", use_container_width=True):
@@ -354,10 +515,119 @@ with st.sidebar:
     st.markdown("### 📝 航班数据管理")
     st.markdown("")
     
+    # 撤销/重做（按修改日志逐步回退，删除和清空也可以撤销）
+    undo_redo_state = database_utils.get_undo_redo_state()
+    undo_col, redo_col = st.columns(2)
+    with undo_col:
+        if st.button(
+            f"↩️ 撤销{undo_redo_state['undo'] or ''}",
+            disabled=undo_redo_state['undo'] is None,
+            use_container_width=True
+        ):
+            try:
+                database_utils.undo_last_change()
+            except database_utils.DuplicateFlightError as e:
+                # 要恢复的航班与之后添加的记录重复，整步撤销已回滚
+                st.error(f"⚠️ 撤销失败，恢复的航班与已有记录重复: {e}")
+            except ValueError as e:
+                # 例如撤销城市合并时已有同名城市，整步撤销已回滚
+                st.error(f"⚠️ 撤销失败: {e}")
+            else:
+                reload_flights()
+                st.rerun()
+    with redo_col:
+        if st.button(
+            f"↪️ 重做{undo_redo_state['redo'] or ''}",
+            disabled=undo_redo_state['redo'] is None,
+            use_container_width=True
+        ):
+            try:
+                database_utils.redo_last_change()
+            except database_utils.DuplicateFlightError as e:
+                # 要恢复的航班与之后添加的记录重复，整步重做已回滚
+                st.error(f"⚠️ 重做失败，恢复的航班与已有记录重复: {e}")
+            except ValueError as e:
+                # 例如重做城市改名时已有同名城市，整步重做已回滚
+                st.error(f"⚠️ 重做失败: {e}")
+            else:
+                reload_flights()
+                st.rerun()
+    
     # 一键导入外部软件数据按钮
     if st.button("📥 一键导入外部软件数据（如航旅纵横）", use_container_width=True, type="secondary"):
         st.info("功能开发中，敬请期待（可能调API难度较大🧐）...")
     
+    # 从CSV文件导入（在后台任务中执行，不阻塞页面）
+    uploaded_file = st.file_uploader(
+        "📄 从CSV文件导入",
+        type=['csv'],
+        help="格式与导出的CSV相同，坐标和距离列可省略（将自动解析）"
+    )
+    if uploaded_file is not None and st.button("📥 开始导入", use_container_width=True):
+        import_path = job_utils.job_file_path(f"import_{int(time.time())}_{uploaded_file.name}")
+        with open(import_path, 'wb') as f:
+            f.write(uploaded_file.getbuffer())
+        job_utils.submit_job('import', {'path': import_path})
+        st.success("已提交导入任务")
+    
+    # 导出航班数据（后台任务从数据库游标分块流式写出，完成后在任务列表中下载）
+    export_format = st.selectbox(
+        "导出格式",
+        options=list(export_utils.EXPORT_FORMATS),
+        format_func=str.upper,
+        key="export_format"
+    )
+    if st.button("📤 导出航班数据", use_container_width=True):
+        job_utils.submit_job('export', {'format': export_format})
+    
+    # 疑似重复航班报告（同一航线上日期相近、飞行时间相近的记录）
+    if st.button("🔍 查找疑似重复航班", use_container_width=True):
+        st.session_state.duplicate_report = database_utils.find_duplicate_flights()
+    if st.session_state.get('duplicate_report') is not None:
+        duplicate_groups = st.session_state.duplicate_report
+        with st.expander(f"🔍 疑似重复航班（{len(duplicate_groups)} 组）", expanded=True):
+            if not duplicate_groups:
+                st.caption("没有发现疑似重复的航班")
+            for group in duplicate_groups:
+                st.markdown(f"**{group[0]['departure_city']} → {group[0]['arrival_city']}**")
+                for flight in group:
+                    st.caption(f"ID {flight['id']} · {flight['date']} · {format_flight_time(flight['flight_time'])}")
+            if st.button("关闭报告", key="close_duplicate_report", use_container_width=True):
+                st.session_state.duplicate_report = None
+                st.rerun()
+    
+    # 后台维护任务
+    with st.expander("⚙️ 后台任务"):
+        maintenance_col1, maintenance_col2 = st.columns(2)
+        with maintenance_col1:
+            if st.button("🧭 重新解析坐标", use_container_width=True):
+                job_utils.submit_job('regeocode')
+            if st.button("🗺️ 预渲染地图", use_container_width=True):
+                job_utils.submit_job('render_map')
+        with maintenance_col2:
+            if st.button("📏 重新计算距离", use_container_width=True):
+                job_utils.submit_job('recompute_distance')
+
+        # 批量生成地图报告（每个年份/国家/航线一份独立的HTML，完成后打包下载）
+        report_groupings = st.multiselect(
+            "地图报告分组",
+            options=list(report_utils.REPORT_GROUPINGS),
+            default=['year'],
+            format_func=report_utils.REPORT_GROUPINGS.get,
+            key="report_groupings"
+        )
+        report_svg = st.checkbox("同时生成静态SVG", key="report_svg")
+        if st.button("🗂️ 生成地图报告", use_container_width=True, disabled=not report_groupings):
+            job_utils.submit_job('render_reports', {'by': report_groupings, 'svg': report_svg})
+
+        # 有未完成的任务时每2秒只刷新任务列表，页面其余部分保持可用
+        has_unfinished_jobs = bool(database_utils.list_jobs(limit=1, statuses=database_utils.JOB_UNFINISHED_STATUSES))
+        if hasattr(st, 'fragment'):
+            st.fragment(run_every=2 if has_unfinished_jobs else None)(render_jobs_panel)()
+        else:
+            render_jobs_panel()
+            st.button("🔄 刷新任务进度", use_container_width=True)
+    
     st.markdown("")
     
     # 显示航班记录列表（按日期排序）
@@ -394,12 +664,12 @@ with st.sidebar:
                 # 删除确认对话框
                 if st.session_state.deleting_flight_id == flight['id']:
                     st.markdown("")
-                    st.warning(f"⚠️ **确定要删除航班记录吗？**\n\n**{flight['departure_city']} → {flight['arrival_city']}**\n\n此操作不可恢复！")
+                    st.warning(f"⚠️ **确定要删除航班记录吗？**\n\n**{flight['departure_city']} → {flight['arrival_city']}**\n\n可以通过“撤销”恢复")
                     st.markdown("")
                     confirm_col1, confirm_col2 = st.columns(2)
                     with confirm_col1:
                         if st.button("✅ 确认删除", key=f"confirm_delete_{flight['id']}", type="primary", use_container_width=True):
-                            database_utils.delete_flight_from_db(flight['id'])
+                            writer_utils.delete_flight(flight['id'])
                             reload_flights()
                             st.session_state.deleting_flight_id = None
                             st.success(f"✅ 已删除航班: {flight['departure_city']} → {flight['arrival_city']}")
@@ -487,11 +757,15 @@ with st.sidebar:
                                                 'arrival_coords': arr_coords,
                                                 'flight_time': total_edit_flight_time if total_edit_flight_time > 0 else None
                                             }
-                                            database_utils.update_flight_in_db(flight['id'], updated_record)
-                                            st.session_state.editing_flight_id = None
-                                            reload_flights()
-                                            st.success("航班记录已更新")
-                                            st.rerun()
+                                            try:
+                                                writer_utils.update_flight(flight['id'], updated_record)
+                                            except database_utils.DuplicateFlightError as e:
+                                                st.error(f"⚠️ 修改后与已有航班重复（{e}）")
+                                            else:
+                                                st.session_state.editing_flight_id = None
+                                                reload_flights()
+                                                st.success("航班记录已更新")
+                                                st.rerun()
                                     else:
                                         # 城市名称未改变，只需更新日期、距离和飞行时间
                                         updated_record = {
@@ -503,11 +777,15 @@ with st.sidebar:
                                             'arrival_coords': flight['arrival_coords'],
                                             'flight_time': total_edit_flight_time if total_edit_flight_time > 0 else None
                                         }
-                                        database_utils.update_flight_in_db(flight['id'], updated_record)
-                                        st.session_state.editing_flight_id = None
-                                        reload_flights()
-                                        st.success("航班记录已更新")
-                                        st.rerun()
+                                        try:
+                                            writer_utils.update_flight(flight['id'], updated_record)
+                                        except database_utils.DuplicateFlightError as e:
+                                            st.error(f"⚠️ 修改后与已有航班重复（{e}）")
+                                        else:
+                                            st.session_state.editing_flight_id = None
+                                            reload_flights()
+                                            st.success("航班记录已更新")
+                                            st.rerun()
                     
                     with edit_col8:
                         if st.button("❌ 取消", key=f"cancel_{flight['id']}", use_container_width=True):
@@ -530,36 +808,23 @@ with st.sidebar:
 # 主内容区：统计信息和地图
 st.markdown("### 📊 飞行统计概览")
 
+# 概览统计在数据库中聚合（安装了DuckDB时由DuckDB扫描数据库文件），不在Python中逐条累加；
+# 这里只需要总数，结果按数据版本缓存，数据没有变化时页面重新执行不再查询
+overview_stats = analytics_utils.overview_totals()
+
 col1, col2, col3 = st.columns(3)
 
 with col1:
-    total_flights = len(st.session_state.flights)
-    # 统计国内和国外航班数
-    domestic_count = 0
-    international_count = 0
-    for flight in st.session_state.flights:
-        dep_coords = flight.get('departure_coords')
-        arr_coords = flight.get('arrival_coords')
-        if dep_coords and arr_coords:
-            if is_in_china(dep_coords[0], dep_coords[1]) and is_in_china(arr_coords[0], arr_coords[1]):
-                domestic_count += 1
-            else:
-                international_count += 1
-        else:
-            # 如果没有坐标信息，无法判断，暂时计入国际
-            international_count += 1
-    
-    # 使用自定义样式显示总航班次数
+    # 使用自定义样式显示总航班次数（国内：出发和到达城市都在中国范围内）
     ui.render_metric_card(
         "✈️ 总航班次数",
-        str(total_flights),
-        f"国内 {domestic_count} | 国际 {international_count}",
+        str(overview_stats['flight_count']),
+        f"国内 {overview_stats['domestic_count']} | 国际 {overview_stats['international_count']}",
         card_type="blue"
     )
 
 with col2:
-    total_distance = sum(flight.get('distance', 0) for flight in st.session_state.flights)
-    distance_km = f"{total_distance:,.0f}"
+    distance_km = f"{overview_stats['total_distance']:,.0f}"
     ui.render_metric_card(
         "🌍 累计飞行里程",
         distance_km,
@@ -568,32 +833,125 @@ with col2:
     )
 
 with col3:
-    total_flight_time_minutes = sum(
-        flight.get('flight_time', 0) or 0 
-        for flight in st.session_state.flights
+    # 没有填写飞行时间的记录按距离估算后计入（估算值在数据变化后批量补全并保存，这里只读取合计）
+    flight_time_totals = estimate_utils.flight_time_totals()
+    total_flight_time_str = format_total_flight_time(
+        overview_stats['total_flight_time'] + flight_time_totals['estimated_minutes']
     )
-    total_flight_time_str = format_total_flight_time(total_flight_time_minutes)
+    if flight_time_totals['estimated_count']:
+        flight_time_subtitle = (
+            f"实测 {format_total_flight_time(overview_stats['total_flight_time'])} · "
+            f"估算 {format_total_flight_time(flight_time_totals['estimated_minutes'])}"
+            f"（{flight_time_totals['estimated_count']} 条）"
+        )
+    else:
+        flight_time_subtitle = "总时长"
     ui.render_metric_card(
         "⏱️ 累计飞行时间",
         total_flight_time_str,
-        "总时长",
+        flight_time_subtitle,
         card_type="orange"
     )
 
-# 第二排：去过的城市（长条框）
+# 第二排：去过的城市和飞过的航线（长条框）
+# 计数表在每次写入时增量维护，每次只按索引读取并渲染一页排行，开销与去过的城市总数无关
 st.markdown("")
-# 统计每个城市出现的次数（包括作为出发城市和到达城市）
-city_counts = {}
-for flight in st.session_state.flights:
-    # 统计出发城市
-    dep_city = flight['departure_city']
-    city_counts[dep_city] = city_counts.get(dep_city, 0) + 1
-    # 统计到达城市
-    arr_city = flight['arrival_city']
-    city_counts[arr_city] = city_counts.get(arr_city, 0) + 1
-
-# 渲染横向长条城市列表卡片（按次数降序排列）
-ui.render_cities_card_horizontal(city_counts, card_type="purple")
+ranked_city_count, ranked_route_count = database_utils.get_ranking_sizes()
+city_rank_card = st.container()
+city_rank_offset = render_ranking_pager('city_rank', ranked_city_count)
+with city_rank_card:
+    ui.render_cities_card_horizontal(
+        database_utils.get_top_cities(ui.RANKING_PAGE_SIZE, city_rank_offset),
+        card_type="purple",
+        total_count=ranked_city_count
+    )
+
+st.markdown("")
+route_rank_card = st.container()
+route_rank_offset = render_ranking_pager('route_rank', ranked_route_count)
+with route_rank_card:
+    ui.render_cities_card_horizontal(
+        [
+            (f"{departure} → {arrival}", count)
+            for departure, arrival, count in database_utils.get_top_routes(ui.RANKING_PAGE_SIZE, route_rank_offset)
+        ],
+        card_type="blue",
+        total_count=ranked_route_count,
+        title="🛫 常飞航线",
+        unit="条航线"
+    )
+
+# 第三排：行程统计（按日期把衔接的航段拼接成行程，结果保存在trips表中）
+st.markdown("")
+trip_stats = database_utils.get_trip_stats()
+trip_col1, trip_col2, trip_col3 = st.columns(3)
+
+with trip_col1:
+    ui.render_metric_card(
+        "🧳 行程次数",
+        str(trip_stats['trip_count']),
+        f"其中多段行程 {trip_stats['multi_leg_count']} 次",
+        card_type="blue"
+    )
+
+with trip_col2:
+    longest_trip = trip_stats['longest_trip']
+    if longest_trip:
+        ui.render_metric_card(
+            "🛫 最长行程",
+            f"{longest_trip['distance']:,.0f}",
+            f"公里 | {longest_trip['origin']} → {longest_trip['destination']}（{longest_trip['leg_count']} 段）",
+            card_type="green"
+        )
+    else:
+        ui.render_metric_card("🛫 最长行程", "0", "公里", card_type="green")
+
+with trip_col3:
+    layover_counts = trip_stats['layover_counts']
+    if layover_counts:
+        top_layover, top_layover_count = max(layover_counts.items(), key=lambda x: (x[1], x[0]))
+        layover_subtitle = f"最常中转: {top_layover}（{top_layover_count} 次）"
+    else:
+        layover_subtitle = "暂无中转记录"
+    ui.render_metric_card(
+        "🔁 中转城市",
+        str(len(layover_counts)),
+        layover_subtitle,
+        card_type="orange"
+    )
+
+# 第四排：时间趋势（按年/按月聚合，结果按数据版本缓存，切换视图不会重新计算）
+st.markdown("")
+st.markdown("### 📈 时间趋势")
+trend_col1, trend_col2 = st.columns([1, 2])
+with trend_col1:
+    trend_period = st.radio(
+        "时间粒度",
+        list(analytics_utils.TIME_SERIES_PERIODS),
+        format_func=analytics_utils.TIME_SERIES_PERIODS.get,
+        horizontal=True,
+        key="trend_period"
+    )
+with trend_col2:
+    trend_metric = st.selectbox(
+        "指标",
+        list(analytics_utils.TIME_SERIES_METRICS),
+        format_func=analytics_utils.TIME_SERIES_METRICS.get,
+        key="trend_metric"
+    )
+trend_series = analytics_utils.time_series(trend_period)
+if trend_series.empty:
+    st.info("💡 添加航班后这里会显示每年/每月的飞行趋势")
+else:
+    st.bar_chart(
+        trend_series[[trend_metric]].rename(columns=analytics_utils.TIME_SERIES_METRICS),
+        use_container_width=True
+    )
+    with st.expander("📄 查看明细"):
+        st.dataframe(
+            trend_series.rename(columns={**analytics_utils.TIME_SERIES_METRICS, 'longest_route': "最长航段航线"}),
+            use_container_width=True
+        )
 
 # 显示地图
 st.markdown("")
@@ -607,24 +965,90 @@ if st.session_state.flights:
     ui.close_map_container()
     
     st.markdown("")
+    # 搜索航班：按城市名/别名（支持拼写错误）和日期筛选，分页在数据库中完成
+    with st.expander("🔎 搜索航班"):
+        search_query = st.text_input(
+            "搜索",
+            placeholder="城市名或别名，可加日期，例如：北京 东京 2024",
+            key="search_query"
+        )
+        if st.session_state.get('search_last_query') != search_query:
+            st.session_state.search_last_query = search_query
+            st.session_state.search_page = 0
+        if search_query.strip():
+            search_page = st.session_state.get('search_page', 0)
+            search_result = database_utils.search_flights(search_query, page=search_page)
+            page_count = max(1, -(-search_result['total'] // search_utils.SEARCH_PAGE_SIZE))
+            st.caption(f"共找到 {search_result['total']} 条记录，第 {search_page + 1}/{page_count} 页")
+            if search_result['flights']:
+                st.dataframe(
+                    pd.DataFrame([
+                        {
+                            '出发城市': flight['departure_city'],
+                            '到达城市': flight['arrival_city'],
+                            '日期': flight['date'],
+                            '距离（公里）': f"{flight['distance'] or 0:,.0f}",
+                            '飞行时间': format_flight_time(flight['flight_time'])
+                        }
+                        for flight in search_result['flights']
+                    ]),
+                    use_container_width=True,
+                    hide_index=True
+                )
+            prev_col, next_col = st.columns(2)
+            with prev_col:
+                if st.button("⬅️ 上一页", disabled=search_page == 0, use_container_width=True):
+                    st.session_state.search_page = search_page - 1
+                    st.rerun()
+            with next_col:
+                if st.button("下一页 ➡️", disabled=search_page + 1 >= page_count, use_container_width=True):
+                    st.session_state.search_page = search_page + 1
+                    st.rerun()
+
     # 显示航班列表（可选）
     with st.expander("📋 查看所有航班记录", expanded=True):
-        df = pd.DataFrame([
-            {
-                '出发城市': flight['departure_city'],
-                '到达城市': flight['arrival_city'],
-                '日期': flight['date'],
-                '距离（公里）': f"{flight.get('distance', 0):,.0f}",
-                '飞行时间': format_flight_time(flight.get('flight_time'))
-            }
-            for flight in sorted(st.session_state.flights, key=lambda x: x['date'], reverse=True)
-        ])
+        # 表格直接由SQL查询构建，并按数据版本缓存（与航班列表一样，默认只包含热分区）
+        df = table_utils.flights_table(st.session_state.include_archive)
         # 使用样式化的表格
         st.dataframe(
             df, 
             use_container_width=True,
-            hide_index=True
+            hide_index=True,
+            column_config={'距离（公里）': st.column_config.NumberColumn(format="localized")}
         )
+    
+    # 批量编辑：像表格一样修改、添加或删除多行，点击保存时一次性提交
+    with st.expander("🧮 批量编辑航班记录"):
+        if 'grid_editor_version' not in st.session_state:
+            st.session_state.grid_editor_version = 0
+        original_rows = [
+            normalize_editor_row(flight)
+            for flight in sorted(st.session_state.flights, key=lambda x: (x['date'], x['id']), reverse=True)
+        ]
+        editor_df = pd.DataFrame(original_rows, columns=['id', 'departure_city', 'arrival_city', 'date', 'distance', 'flight_time'])
+        editor_df['date'] = pd.to_datetime(editor_df['date']).dt.date
+        editor_df['flight_time'] = editor_df['flight_time'].astype('Int64')
+        edited_df = st.data_editor(
+            editor_df,
+            num_rows="dynamic",
+            use_container_width=True,
+            hide_index=True,
+            key=f"grid_editor_{st.session_state.grid_editor_version}",
+            column_config={
+                'id': st.column_config.NumberColumn("ID", disabled=True),
+                'departure_city': st.column_config.TextColumn("出发城市", required=True),
+                'arrival_city': st.column_config.TextColumn("到达城市", required=True),
+                'date': st.column_config.DateColumn("日期", format="YYYY-MM-DD", required=True),
+                'distance': st.column_config.NumberColumn("距离（公里）", min_value=0.0, format="%.0f", help="留空时自动计算"),
+                'flight_time': st.column_config.NumberColumn("飞行时间（分钟）", min_value=0, step=1),
+            }
+        )
+        if st.button("💾 保存更改", type="primary", key="save_grid_changes"):
+            edited_rows = [normalize_editor_row(row) for row in edited_df.to_dict('records')]
+            if save_grid_changes(original_rows, edited_rows):
+                # 重置编辑器，让表格显示保存后的数据
+                st.session_state.grid_editor_version += 1
+                st.rerun()
 else:
     st.info("💡 暂无航班记录，请在左侧添加第一条航班记录")
     # 显示空白地图
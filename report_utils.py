@@ -0,0 +1,416 @@
+"""
+地图报告模块
+按年份、国家/地区或航线把航班分组，为每组生成独立的folium地图HTML（可选再生成不依赖瓦片服务器的静态SVG），
+各组在进程池中并行渲染；航线的大圆弧几何按城市坐标缓存，所有报告共用，内容没有变化的报告不会重新生成
+
+命令行用法:
+    python report_utils.py --by year
+    python report_utils.py --by year country route --svg --workers 8
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+import database_utils
+import flight_utils
+
+# 报告的分组方式: 键 -> 显示名称
+REPORT_GROUPINGS = OrderedDict([
+    ('year', "按年份"),
+    ('country', "按国家/地区"),
+    ('route', "按航线"),
+])
+
+# 按航线分组时只为航班次数最多的N条航线生成报告
+REPORT_ROUTE_LIMIT = 20
+
+# 并行渲染的进程数（None表示CPU核数）
+REPORT_WORKERS = None
+
+# 每条大圆弧的分段数（SVG中航线画成折线）
+ARC_SEGMENTS = 48
+
+# 静态SVG的宽度（像素，高度按坐标范围的比例计算）以及四周留白
+SVG_WIDTH = 1200
+SVG_PADDING = 40
+
+# 没有记录国家的城市按坐标归入的地区名称
+UNKNOWN_COUNTRY = "其他"
+CHINA_COUNTRY = "中国"
+
+# 报告目录中的清单文件：记录各报告的内容摘要（摘要不变时跳过重新生成）和标题等信息（索引页据此列出目录中的所有报告）
+MANIFEST_FILE = 'manifest.json'
+
+# SVG中航线的颜色（与flight_utils.create_flight_map一致）
+ROUTE_COLORS = ('#667eea', '#764ba2', '#f093fb', '#4facfe', '#00f2fe', '#43e97b', '#fa709a')
+
+
+def report_dir(db_file=None):
+    """
+    返回数据库对应的报告目录
+    例如: flights_zwx.db -> flights_zwx_reports
+    """
+    base, _ = os.path.splitext(db_file or database_utils.current_db_file())
+    return f"{base}_reports"
+
+
+@lru_cache(maxsize=4096)
+def great_circle_arc(start, end, segments=ARC_SEGMENTS):
+    """
+    计算两点之间大圆弧上的点（球面线性插值），经度连续展开（跨越180°经线时不会折回）
+    start/end: (纬度, 经度)
+    返回: ((纬度, 经度), ...) 元组，共segments+1个点
+    """
+    lat1, lon1 = map(math.radians, start)
+    lat2, lon2 = map(math.radians, end)
+    p1 = (math.cos(lat1) * math.cos(lon1), math.cos(lat1) * math.sin(lon1), math.sin(lat1))
+    p2 = (math.cos(lat2) * math.cos(lon2), math.cos(lat2) * math.sin(lon2), math.sin(lat2))
+    omega = math.acos(max(-1.0, min(1.0, sum(a * b for a, b in zip(p1, p2)))))
+    if omega < 1e-9:
+        return (tuple(start), tuple(end))
+
+    points = []
+    previous_lon = None
+    for step in range(segments + 1):
+        t = step / segments
+        w1 = math.sin((1 - t) * omega) / math.sin(omega)
+        w2 = math.sin(t * omega) / math.sin(omega)
+        x, y, z = (w1 * a + w2 * b for a, b in zip(p1, p2))
+        lat = math.degrees(math.atan2(z, math.hypot(x, y)))
+        lon = math.degrees(math.atan2(y, x))
+        if previous_lon is not None:
+            lon += 360 * round((previous_lon - lon) / 360)
+        previous_lon = lon
+        points.append((lat, lon))
+    return tuple(points)
+
+
+def _flight_countries(flight, city_countries):
+    """返回航班出发地和到达地所在的国家/地区（未记录国家时按坐标判断是否在中国）"""
+    countries = []
+    for side in ('departure', 'arrival'):
+        country = city_countries.get(flight[f'{side}_city_id'])
+        if not country:
+            lat, lon = flight[f'{side}_coords']
+            country = CHINA_COUNTRY if flight_utils.is_in_china(lat, lon) else UNKNOWN_COUNTRY
+        if country not in countries:
+            countries.append(country)
+    return countries
+
+
+def group_flights(flights, by, city_countries=None, route_limit=REPORT_ROUTE_LIMIT):
+    """
+    把航班按指定方式分组
+    by: REPORT_GROUPINGS中的分组方式
+    city_countries: {城市ID: 国家}，按国家分组时使用
+    返回: OrderedDict {分组键: (标题, 航班列表)}
+    """
+    groups = {}
+    if by == 'year':
+        for flight in flights:
+            groups.setdefault(flight['date'][:4], []).append(flight)
+        return OrderedDict(
+            (key, (f"{key}年的航班", groups[key])) for key in sorted(groups, reverse=True)
+        )
+    if by == 'country':
+        for flight in flights:
+            for country in _flight_countries(flight, city_countries or {}):
+                groups.setdefault(country, []).append(flight)
+        return OrderedDict(
+            (key, (f"{key}的航班", groups[key])) for key in sorted(groups, key=lambda k: (-len(groups[k]), k))
+        )
+    if by == 'route':
+        for flight in flights:
+            groups.setdefault((flight['departure_city'], flight['arrival_city']), []).append(flight)
+        top = sorted(groups, key=lambda k: (-len(groups[k]), k))[:route_limit]
+        return OrderedDict(
+            (f"{dep}-{arr}", (f"{dep} → {arr}", groups[(dep, arr)])) for dep, arr in top
+        )
+    raise ValueError(f"未知的分组方式: {by}")
+
+
+def _safe_name(text):
+    """把分组键转换为可用作文件名的字符串（保留中文等文字字符）"""
+    return re.sub(r'[^\w-]+', '_', text).strip('_') or 'report'
+
+
+def _digest(title, flights, svg):
+    """报告内容的摘要（航班内容、标题或是否生成SVG有变化时摘要随之变化）"""
+    rows = sorted(
+        (f['id'], f['departure_city'], f['arrival_city'], f['date'], f['distance'], f['flight_time'],
+         tuple(f['departure_coords']), tuple(f['arrival_coords']))
+        for f in flights
+    )
+    payload = json.dumps([title, svg, rows], ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _projection(points):
+    """
+    根据一组(纬度, 经度)点计算等距圆柱投影到SVG坐标的函数（经度按中纬度的余弦缩放，保持局部比例）
+    返回: (投影函数, SVG高度)
+    """
+    lats = [p[0] for p in points]
+    lons = [p[1] for p in points]
+    min_lat, max_lat = min(lats), max(lats)
+    min_lon = min(lons)
+    x_scale = max(math.cos(math.radians((min_lat + max_lat) / 2)), 0.2)
+    span_x = (max(lons) - min_lon) * x_scale
+    span_y = max_lat - min_lat
+    plot_width = SVG_WIDTH - 2 * SVG_PADDING
+    # 高宽比最多2:3，只有一条很短的航线时也不会无限放大
+    scale = plot_width / max(span_x, span_y * 1.5, 1.0)
+    offset_x = SVG_PADDING + (plot_width - span_x * scale) / 2
+    height = int(span_y * scale + 2 * SVG_PADDING + 30)
+
+    def project(lat, lon):
+        return round(offset_x + (lon - min_lon) * x_scale * scale, 1), round(SVG_PADDING + (max_lat - lat) * scale, 1)
+
+    return project, height
+
+
+def render_svg(title, flights, arcs):
+    """
+    渲染静态SVG航线图（经纬网、大圆弧航线和城市点，不需要瓦片服务器）
+    arcs: {(出发坐标, 到达坐标): 大圆弧点}，由great_circle_arc预先计算
+    返回: SVG文本
+    """
+    routes = OrderedDict()
+    cities = {}
+    for flight in flights:
+        key = (tuple(flight['departure_coords']), tuple(flight['arrival_coords']))
+        routes[key] = routes.get(key, 0) + 1
+        cities[flight['departure_city']] = key[0]
+        cities[flight['arrival_city']] = key[1]
+    if not routes:
+        return f'<svg xmlns="http://www.w3.org/2000/svg" width="{SVG_WIDTH}" height="80"></svg>\n'
+    all_points = [point for key in routes for point in arcs[key]]
+    project, height = _projection(all_points)
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{SVG_WIDTH}" height="{height}" '
+        f'viewBox="0 0 {SVG_WIDTH} {height}" font-family="Arial, sans-serif">',
+        f'<rect width="{SVG_WIDTH}" height="{height}" fill="#f8f9fc"/>',
+    ]
+    # 经纬网（每10度一条）
+    min_lat = math.floor(min(p[0] for p in all_points) / 10) * 10
+    max_lat = math.ceil(max(p[0] for p in all_points) / 10) * 10
+    min_lon = math.floor(min(p[1] for p in all_points) / 10) * 10
+    max_lon = math.ceil(max(p[1] for p in all_points) / 10) * 10
+    for lat in range(min_lat, max_lat + 1, 10):
+        (x1, y1), (x2, y2) = project(lat, min_lon), project(lat, max_lon)
+        parts.append(f'<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}" stroke="#e1e4ec" stroke-width="1"/>')
+    for lon in range(min_lon, max_lon + 1, 10):
+        (x1, y1), (x2, y2) = project(min_lat, lon), project(max_lat, lon)
+        parts.append(f'<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}" stroke="#e1e4ec" stroke-width="1"/>')
+
+    for idx, (key, count) in enumerate(routes.items()):
+        path = ' '.join(f"{x},{y}" for x, y in (project(lat, lon) for lat, lon in arcs[key]))
+        width = min(1.5 + count, 6)
+        parts.append(
+            f'<polyline points="{path}" fill="none" stroke="{ROUTE_COLORS[idx % len(ROUTE_COLORS)]}" '
+            f'stroke-width="{width}" stroke-opacity="0.8" stroke-linecap="round"/>'
+        )
+    for name, (lat, lon) in cities.items():
+        x, y = project(lat, lon)
+        parts.append(f'<circle cx="{x}" cy="{y}" r="4" fill="#333"/>')
+        parts.append(f'<text x="{x + 6}" y="{y - 6}" font-size="12" fill="#333">{escape(name)}</text>')
+
+    total_distance = sum(f['distance'] or 0 for f in flights)
+    parts.append(
+        f'<text x="{SVG_PADDING}" y="{SVG_PADDING - 12}" font-size="20" font-weight="bold" fill="#333">'
+        f'{escape(title)}</text>'
+    )
+    parts.append(
+        f'<text x="{SVG_PADDING}" y="{height - 12}" font-size="13" fill="#666">'
+        f'{len(flights)} 次航班 · {len(cities)} 个城市 · {total_distance:,.0f} 公里</text>'
+    )
+    parts.append('</svg>\n')
+    return '\n'.join(parts)
+
+
+def render_report(task):
+    """
+    渲染一份报告（在进程池的工作进程中执行）
+    task: {'title', 'flights', 'html', 'svg'（SVG路径或None）, 'arcs'}
+    返回: 生成的文件路径列表
+    """
+    flight_utils.render_map_html(task['flights'], task['html'])
+    paths = [task['html']]
+    if task['svg']:
+        with open(task['svg'], 'w', encoding='utf-8') as f:
+            f.write(render_svg(task['title'], task['flights'], task['arcs']))
+        paths.append(task['svg'])
+    return paths
+
+
+def _manifest_digest(entry):
+    """清单条目中的内容摘要（旧版清单的条目直接是摘要字符串）"""
+    return entry['digest'] if isinstance(entry, dict) else entry
+
+
+def _write_index(output_dir, manifest):
+    """
+    根据清单生成报告目录的索引页（按分组方式列出目录中所有报告的链接）
+    只生成了部分分组时，之前生成的其他分组的报告仍然列在索引中
+    """
+    entries = [
+        entry for entry in manifest.values()
+        if isinstance(entry, dict) and os.path.exists(os.path.join(output_dir, entry['html']))
+    ]
+    sections = []
+    for by, label in REPORT_GROUPINGS.items():
+        items = sorted((entry for entry in entries if entry['by'] == by), key=lambda entry: entry['rank'])
+        if not items:
+            continue
+        links = ''.join(
+            f'<li><a href="{escape(e["html"])}">{escape(e["title"])}</a> ({e["count"]} 次航班)'
+            + (f' · <a href="{escape(e["svg"])}">SVG</a>' if e['svg'] else '')
+            + '</li>'
+            for e in items
+        )
+        sections.append(f'<h2>{escape(label)}</h2><ul>{links}</ul>')
+    with open(os.path.join(output_dir, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write(
+            '<!DOCTYPE html><html><head><meta charset="utf-8"><title>航班地图报告</title></head>'
+            f'<body style="font-family: Arial, sans-serif;"><h1>航班地图报告</h1>{"".join(sections)}</body></html>\n'
+        )
+
+
+def generate_reports(by=('year',), output_dir=None, svg=False, workers=REPORT_WORKERS,
+                     route_limit=REPORT_ROUTE_LIMIT, progress=None):
+    """
+    批量生成地图报告（进程池并行渲染，内容没有变化的报告直接复用已有文件）
+
+    参数:
+        by: 分组方式列表（REPORT_GROUPINGS中的键）
+        output_dir: 输出目录（默认为数据库旁边的报告目录）
+        svg: 是否同时生成静态SVG
+        workers: 进程数（None表示CPU核数，1表示在当前进程中依次渲染）
+        route_limit: 按航线分组时的报告数上限
+        progress: 每完成（或复用）一份报告时调用的回调函数，参数为(已完成数, 总数)
+    返回: 报告字典列表（by, key, title, count, html, svg, reused），index.html写在输出目录中
+    """
+    output_dir = output_dir or report_dir()
+    os.makedirs(output_dir, exist_ok=True)
+    flights = database_utils.load_flights_from_db()
+    city_countries = {city['id']: city['country'] for city in database_utils.load_cities()}
+
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    reports = []
+    tasks = []
+    for grouping in by:
+        for key, (title, group) in group_flights(flights, grouping, city_countries, route_limit).items():
+            name = _safe_name(f"{grouping}_{key}")
+            report = {
+                'name': name, 'by': grouping, 'key': key, 'title': title, 'count': len(group),
+                'html': os.path.join(output_dir, f"{name}.html"),
+                'svg': os.path.join(output_dir, f"{name}.svg") if svg else None,
+                'digest': _digest(title, group, svg),
+            }
+            paths = [path for path in (report['html'], report['svg']) if path]
+            report['reused'] = (
+                name in manifest and _manifest_digest(manifest[name]) == report['digest']
+                and all(os.path.exists(path) for path in paths)
+            )
+            reports.append(report)
+            if not report['reused']:
+                arcs = {}
+                if svg:
+                    # 大圆弧按坐标缓存，同一航线在各年份、各国家的报告中只计算一次
+                    for flight in group:
+                        key_coords = (tuple(flight['departure_coords']), tuple(flight['arrival_coords']))
+                        if key_coords not in arcs:
+                            arcs[key_coords] = great_circle_arc(*key_coords)
+                tasks.append({
+                    'title': title, 'flights': group,
+                    'html': report['html'], 'svg': report['svg'], 'arcs': arcs,
+                })
+
+    done = len(reports) - len(tasks)
+    if progress:
+        progress(done, len(reports))
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers > 1:
+        # 使用spawn启动工作进程：界面进程中有很多线程，fork可能复制到被其他线程持有的锁
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = [executor.submit(render_report, task) for task in tasks]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+                    done += 1
+                    if progress:
+                        progress(done, len(reports))
+            except BaseException:
+                # 出错或被取消时不再启动尚未开始的报告
+                for future in futures:
+                    future.cancel()
+                raise
+    else:
+        for task in tasks:
+            render_report(task)
+            done += 1
+            if progress:
+                progress(done, len(reports))
+
+    produced = {report['name'] for report in reports}
+    for name, entry in list(manifest.items()):
+        if name in produced or (isinstance(entry, dict) and entry['by'] not in by):
+            continue
+        # 本次生成的分组中已经不存在的报告（例如记录都被删除了的年份）连同文件一起移除
+        if isinstance(entry, dict):
+            for filename in (entry['html'], entry['svg']):
+                if filename:
+                    try:
+                        os.remove(os.path.join(output_dir, filename))
+                    except OSError:
+                        pass
+        del manifest[name]
+    for rank, report in enumerate(reports):
+        manifest[report.pop('name')] = {
+            'digest': report.pop('digest'), 'by': report['by'], 'title': report['title'], 'count': report['count'],
+            'html': os.path.basename(report['html']),
+            'svg': os.path.basename(report['svg']) if report['svg'] else None,
+            'rank': rank,
+        }
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    _write_index(output_dir, manifest)
+    return reports
+
+
+def main(argv=None):
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="批量生成航班地图报告")
+    parser.add_argument('--db', default=database_utils.DB_FILE, help="数据库文件路径")
+    parser.add_argument('--by', nargs='+', choices=list(REPORT_GROUPINGS), default=['year'], help="分组方式")
+    parser.add_argument('--output', help="输出目录（默认为数据库旁边的报告目录）")
+    parser.add_argument('--svg', action='store_true', help="同时生成静态SVG")
+    parser.add_argument('--workers', type=int, default=REPORT_WORKERS, help="并行进程数（默认CPU核数）")
+    parser.add_argument('--route-limit', type=int, default=REPORT_ROUTE_LIMIT, help="按航线分组时的报告数上限")
+    args = parser.parse_args(argv)
+
+    with database_utils.use_db_file(args.db):
+        reports = generate_reports(args.by, args.output, args.svg, args.workers, args.route_limit)
+    reused = sum(report['reused'] for report in reports)
+    print(f"生成 {len(reports) - reused} 份报告，复用 {reused} 份: {os.path.dirname(reports[0]['html']) if reports else ''}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+搜索工具模块
+解析搜索框输入、计算模糊匹配的相似度，并提供常见城市的中英文/拼音别名
+（搜索本身在database_utils中通过SQLite FTS5完成）
+"""
+
+import re
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError:  # 拼音别名是可选功能，未安装pypinyin时只使用内置别名
+    lazy_pinyin = None
+
+# 搜索结果每页的条数
+SEARCH_PAGE_SIZE = 20
+
+# 每个搜索词最多匹配的城市数
+SEARCH_CITY_LIMIT = 50
+
+# 模糊匹配时三元组相似度的下限（0~1）
+FUZZY_THRESHOLD = 0.3
+
+# 日期搜索词：年份、年月或完整日期，例如 2024、2024-05、2024-05-01
+DATE_TERM_PATTERN = re.compile(r'^\d{4}(-\d{2}(-\d{2})?)?$')
+
+# 内置的城市别名组（同一组内的名称互为别名）
+BUILTIN_CITY_ALIASES = (
+    ('Beijing', '北京', 'Peking'),
+    ('Shanghai', '上海'),
+    ('Guangzhou', '广州', 'Canton'),
+    ('Shenzhen', '深圳'),
+    ('Chengdu', '成都'),
+    ('Chongqing', '重庆'),
+    ('Hangzhou', '杭州'),
+    ('Nanjing', '南京'),
+    ('Wuhan', '武汉'),
+    ("Xi'an", '西安', 'Xian'),
+    ('Tianjin', '天津'),
+    ('Xiamen', '厦门', 'Amoy'),
+    ('Kunming', '昆明'),
+    ('Qingdao', '青岛'),
+    ('Changsha', '长沙'),
+    ('Harbin', '哈尔滨'),
+    ('Sanya', '三亚'),
+    ('Urumqi', '乌鲁木齐'),
+    ('Lhasa', '拉萨'),
+    ('Hong Kong', '香港'),
+    ('Macau', '澳门', 'Macao'),
+    ('Taipei', '台北'),
+    ('Tokyo', '东京'),
+    ('Osaka', '大阪'),
+    ('Seoul', '首尔'),
+    ('Singapore', '新加坡'),
+    ('Bangkok', '曼谷'),
+    ('London', '伦敦'),
+    ('Paris', '巴黎'),
+    ('Frankfurt', '法兰克福'),
+    ('Moscow', '莫斯科'),
+    ('New York', '纽约'),
+    ('Los Angeles', '洛杉矶'),
+    ('San Francisco', '旧金山'),
+    ('Sydney', '悉尼'),
+    ('Dubai', '迪拜'),
+)
+
+# 规范化名称 -> 别名组
+_ALIAS_GROUPS = {name.lower(): group for group in BUILTIN_CITY_ALIASES for name in group}
+
+_CJK_PATTERN = re.compile(r'[一-鿿]')
+
+
+def city_aliases(name):
+    """
+    返回城市的别名列表（内置别名组中的其他名称，安装了pypinyin时中文名再加上拼音）
+    例如: '北京' -> ['Beijing', 'Peking']
+    """
+    name = name.strip()
+    aliases = [alias for alias in _ALIAS_GROUPS.get(name.lower(), ()) if alias.lower() != name.lower()]
+    if lazy_pinyin is not None and _CJK_PATTERN.search(name):
+        pinyin = ''.join(lazy_pinyin(name))
+        if pinyin.lower() not in {alias.lower() for alias in aliases}:
+            aliases.append(pinyin)
+    return aliases
+
+
+def parse_query(query):
+    """
+    把搜索框输入拆成日期词和城市词（按空白分隔）
+    返回: (日期词列表, 城市词列表)
+    """
+    date_terms = []
+    city_terms = []
+    for term in query.split():
+        (date_terms if DATE_TERM_PATTERN.match(term) else city_terms).append(term)
+    return date_terms, city_terms
+
+
+def trigrams(text):
+    """返回文本（小写）的三元组集合，例如 'Paris' -> {'par', 'ari', 'ris'}"""
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def similarity(term, names):
+    """
+    计算搜索词与一组名称（城市名及其别名）的最大三元组相似度（Jaccard系数）
+    返回: 0~1之间的浮点数
+    """
+    term_grams = trigrams(term)
+    best = 0.0
+    for name in names:
+        name_grams = trigrams(name)
+        if term_grams and name_grams:
+            best = max(best, len(term_grams & name_grams) / len(term_grams | name_grams))
+    return best
@@ -0,0 +1,262 @@
+"""
+航班快照模块
+把全量航班记录保存为一组NumPy .npy文件，新会话启动时直接从快照加载，不必查询数据库和连接城市表；
+快照与数据库的数据版本号不一致时自动重新生成，写入队列和后台任务在修改提交后也会在后台重新生成快照。
+列数组以内存映射方式读取（load_arrays，向量化统计直接使用，不复制数据）；
+需要航班字典列表时（load_flights）仍要逐条构建字典，开销与记录数成正比，约为从数据库加载的三分之一
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import threading
+
+import numpy as np
+
+import database_utils
+
+# 是否启用快照缓存
+SNAPSHOT_ENABLED = True
+
+# 修改提交后延迟多少秒在后台重新生成快照（这段时间内的连续修改只重新生成一次）
+SNAPSHOT_REFRESH_DELAY = 0.5
+
+# 快照中保存的数组（每个数组一个.npy文件，flight_time用-1表示未设置）
+SNAPSHOT_ARRAYS = (
+    'id', 'departure_city_id', 'arrival_city_id', 'date', 'distance', 'flight_time',
+    'city_id', 'city_name', 'city_lat', 'city_lon'
+)
+
+
+def snapshot_dir(db_file=None):
+    """
+    返回数据库对应的快照目录
+    例如: flights_zwx.db -> flights_zwx_snapshot
+    """
+    base, _ = os.path.splitext(db_file or database_utils.current_db_file())
+    return f"{base}_snapshot"
+
+
+def write_snapshot(flights, version, db_file=None):
+    """
+    把航班记录写入快照目录
+    先写到临时目录再整体替换，读取方不会看到写了一半的快照
+
+    参数:
+        flights: load_flights_from_db返回的航班记录列表
+        version: 这些记录对应的数据版本号
+    """
+    target = snapshot_dir(db_file)
+    # 多个会话线程可能同时重新生成快照，临时目录按进程和线程区分
+    suffix = f"{os.getpid()}-{threading.get_ident()}"
+    staging = f"{target}.tmp-{suffix}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    for name, array in build_arrays(flights).items():
+        np.save(os.path.join(staging, f"{name}.npy"), array)
+    with open(os.path.join(staging, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'version': version, 'count': len(flights)}, f)
+
+    retired = f"{target}.old-{suffix}"
+    try:
+        if os.path.isdir(target):
+            os.rename(target, retired)
+        os.rename(staging, target)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+        shutil.rmtree(retired, ignore_errors=True)
+
+
+def build_arrays(flights):
+    """
+    把航班记录转换为快照的列数组
+    返回: {数组名: NumPy数组}，数组名见SNAPSHOT_ARRAYS
+    """
+    cities = {}
+    for flight in flights:
+        cities[flight['departure_city_id']] = (flight['departure_city'], flight['departure_coords'])
+        cities[flight['arrival_city_id']] = (flight['arrival_city'], flight['arrival_coords'])
+
+    return {
+        'id': np.array([f['id'] for f in flights], dtype=np.int64),
+        'departure_city_id': np.array([f['departure_city_id'] for f in flights], dtype=np.int64),
+        'arrival_city_id': np.array([f['arrival_city_id'] for f in flights], dtype=np.int64),
+        'date': np.array([f['date'] for f in flights], dtype='U10'),
+        'distance': np.array([f['distance'] for f in flights], dtype=np.float64),
+        'flight_time': np.array(
+            [f['flight_time'] if f['flight_time'] is not None else -1 for f in flights],
+            dtype=np.int64
+        ),
+        'city_id': np.array(list(cities), dtype=np.int64),
+        'city_name': np.array([name for name, _ in cities.values()], dtype=str),
+        'city_lat': np.array([coords[0] for _, coords in cities.values()], dtype=np.float64),
+        'city_lon': np.array([coords[1] for _, coords in cities.values()], dtype=np.float64),
+    }
+
+
+def _snapshot_version(db_file=None):
+    """返回快照对应的数据版本号，快照不存在或损坏时返回None"""
+    try:
+        with open(os.path.join(snapshot_dir(db_file), 'meta.json'), encoding='utf-8') as f:
+            return json.load(f)['version']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def read_snapshot_arrays(version, db_file=None):
+    """
+    读取快照的列数组（以内存映射方式打开，不逐条转换为字典）
+    version: 当前数据版本号，快照版本不一致时视为过期
+    返回: {数组名: NumPy数组}；快照不存在、已过期或损坏时返回None
+    """
+    directory = snapshot_dir(db_file)
+    try:
+        with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta['version'] != version:
+            return None
+        return {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')
+            for name in SNAPSHOT_ARRAYS
+        }
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def read_snapshot(version, db_file=None):
+    """
+    读取快照并构建航班字典列表（数组以内存映射方式打开，但每条记录都要转换为Python对象并构建字典）
+    version: 当前数据版本号，快照版本不一致时视为过期
+    返回: 航班记录列表；快照不存在、已过期或损坏时返回None
+    """
+    arrays = read_snapshot_arrays(version, db_file)
+    if arrays is None:
+        return None
+
+    # 同一城市的名称和坐标对象在所有记录间共享
+    cities = {
+        city_id: (name, (lat, lon))
+        for city_id, name, lat, lon in zip(
+            arrays['city_id'].tolist(), arrays['city_name'].tolist(),
+            arrays['city_lat'].tolist(), arrays['city_lon'].tolist()
+        )
+    }
+    flights = []
+    for flight_id, dep_id, arr_id, date, distance, flight_time in zip(
+            arrays['id'].tolist(), arrays['departure_city_id'].tolist(),
+            arrays['arrival_city_id'].tolist(), arrays['date'].tolist(),
+            arrays['distance'].tolist(), arrays['flight_time'].tolist()):
+        departure_city, departure_coords = cities[dep_id]
+        arrival_city, arrival_coords = cities[arr_id]
+        flights.append({
+            'id': flight_id,
+            'departure_city_id': dep_id,
+            'arrival_city_id': arr_id,
+            'departure_city': departure_city,
+            'arrival_city': arrival_city,
+            'date': date,
+            'distance': distance,
+            'departure_coords': departure_coords,
+            'arrival_coords': arrival_coords,
+            'flight_time': flight_time if flight_time >= 0 else None
+        })
+    return flights
+
+
+def load_flights(include_archive=True):
+    """
+    加载全量航班记录：快照有效时直接读取快照，否则从数据库加载并重新生成快照
+    include_archive: 为False时只加载热分区的记录（有归档分区时直接查询热分区，不挂载归档数据库也不读取全量快照）
+    返回: 航班记录列表（与database_utils.load_flights_from_db相同）
+    """
+    if not include_archive and database_utils.list_archive_files():
+        return database_utils.load_flights_from_db(include_archive=False)
+    if not SNAPSHOT_ENABLED:
+        return database_utils.load_flights_from_db()
+
+    # 先取版本号再读数据：读数据期间如果有新的写入，快照会被标记为旧版本，下次加载时再重新生成
+    version = database_utils.get_data_version()
+    flights = read_snapshot(version)
+    if flights is not None:
+        return flights
+
+    flights = database_utils.load_flights_from_db()
+    try:
+        write_snapshot(flights, version)
+    except OSError:
+        # 快照只是加速手段，写入失败时不影响正常使用
+        pass
+    return flights
+
+
+def load_arrays(version=None):
+    """
+    加载航班数据的列数组（供向量化统计使用）：快照有效时直接内存映射读取，否则从数据库加载并重新生成快照
+    version: 调用方已经取得的数据版本号，省略时重新读取
+    返回: {数组名: NumPy数组}
+    """
+    if version is None:
+        version = database_utils.get_data_version()
+    if SNAPSHOT_ENABLED:
+        arrays = read_snapshot_arrays(version)
+        if arrays is not None:
+            return arrays
+
+    flights = database_utils.load_flights_from_db()
+    if SNAPSHOT_ENABLED:
+        try:
+            write_snapshot(flights, version)
+        except OSError:
+            pass
+    return build_arrays(flights)
+
+
+def refresh_snapshot(db_file=None):
+    """
+    快照已过期时从数据库重新生成
+    返回: 是否重新生成了快照
+    """
+    if not SNAPSHOT_ENABLED:
+        return False
+    db_file = db_file or database_utils.current_db_file()
+    with database_utils.use_db_file(db_file):
+        version = database_utils.get_data_version()
+        if _snapshot_version(db_file) == version:
+            return False
+        write_snapshot(database_utils.load_flights_from_db(), version, db_file)
+    return True
+
+
+# 数据库文件 -> 等待执行的后台重新生成定时器
+_refresh_timers = {}
+_refresh_lock = threading.Lock()
+
+
+def _run_refresh(db_file):
+    """定时器线程：重新生成快照（失败时忽略，下次加载时会从数据库加载并重新生成）"""
+    with _refresh_lock:
+        # 先移除定时器，重新生成期间提交的修改会安排新的一次
+        _refresh_timers.pop(db_file, None)
+    try:
+        refresh_snapshot(db_file)
+    except (OSError, sqlite3.Error):
+        pass
+
+
+def schedule_refresh(db_file=None):
+    """
+    修改提交后调用：SNAPSHOT_REFRESH_DELAY秒后在后台线程中重新生成快照，
+    修改之后第一个打开的会话就能直接读取快照，而不是从数据库全量加载
+    """
+    if not SNAPSHOT_ENABLED:
+        return
+    db_file = db_file or database_utils.current_db_file()
+    with _refresh_lock:
+        if db_file in _refresh_timers:
+            return
+        timer = threading.Timer(SNAPSHOT_REFRESH_DELAY, _run_refresh, (db_file,))
+        timer.daemon = True
+        _refresh_timers[db_file] = timer
+        timer.start()
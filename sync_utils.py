@@ -0,0 +1,149 @@
+"""
+设备间增量同步模块
+每台设备只导出自上次同步以来修改过的记录和删除（变更集，JSON文件），对端按版本合并，
+同步的开销与修改条数成正比，不需要复制整个数据库文件
+
+命令行用法:
+    python sync_utils.py device-id
+    python sync_utils.py reset-device-id
+    python sync_utils.py export changes.json --peer <对端设备ID>
+    python sync_utils.py import changes.json
+    python sync_utils.py sync laptop.db server.db
+"""
+
+import argparse
+import json
+from contextlib import contextmanager
+
+import database_utils
+
+# 变更集文件的格式标识和版本
+CHANGESET_FORMAT = 'skylink-changeset'
+CHANGESET_VERSION = 1
+
+
+@contextmanager
+def use_database(db_file):
+    """
+    临时切换database_utils使用的数据库文件（命令行和同一进程内同步两个数据库时使用）
+    切换后会初始化数据库，确保同步所需的表和列存在
+    """
+    with database_utils.use_db_file(db_file):
+        database_utils.init_database()
+        yield
+
+
+def create_changeset(peer_id=None, since=None):
+    """
+    生成发给对端的变更集
+    peer_id: 对端设备ID，用来确定水位线并跳过对端自己的修改
+    since: 从哪个本机修改序号之后开始导出；省略时使用对端的水位线（从未同步过的对端为0，即全量）
+    返回: 变更集字典
+    """
+    if since is None:
+        since = database_utils.get_sync_peer(peer_id)['sent_seq'] if peer_id else 0
+    changeset = database_utils.export_changes(since, exclude_device=peer_id)
+    changeset['format'] = CHANGESET_FORMAT
+    changeset['version'] = CHANGESET_VERSION
+    return changeset
+
+
+def mark_sent(peer_id, changeset):
+    """变更集已交给对端后推进水位线，下次只导出之后的修改"""
+    database_utils.update_sync_peer(peer_id, sent_seq=changeset['until'])
+
+
+def apply_changeset(changeset):
+    """
+    应用对端的变更集
+    返回: database_utils.apply_changes的统计字典
+    """
+    if changeset.get('format') != CHANGESET_FORMAT or changeset.get('version') != CHANGESET_VERSION:
+        raise ValueError("不是有效的变更集文件")
+    if changeset['device_id'] == database_utils.get_device_id():
+        raise ValueError("不能应用本机导出的变更集")
+    return database_utils.apply_changes(changeset)
+
+
+def write_changeset(path, peer_id=None, since=None):
+    """
+    把变更集写入文件（指定对端时同时推进该对端的水位线）
+    返回: 变更集字典
+    """
+    changeset = create_changeset(peer_id, since)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(changeset, f, ensure_ascii=False)
+    if peer_id:
+        mark_sent(peer_id, changeset)
+    return changeset
+
+
+def read_changeset(path):
+    """读取变更集文件"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def sync_databases(db_a, db_b):
+    """
+    在两个数据库文件之间双向同步（例如笔记本和服务器上的两份副本，也用于验证同步协议）
+    返回: (a应用b的变更后的统计, b应用a的变更后的统计)
+    """
+    with use_database(db_a):
+        device_a = database_utils.get_device_id()
+    with use_database(db_b):
+        device_b = database_utils.get_device_id()
+    if device_a == device_b:
+        raise ValueError("两个数据库的设备ID相同（可能是直接复制的文件），请先在其中一个上运行 reset-device-id")
+
+    with use_database(db_a):
+        to_b = create_changeset(device_b)
+    with use_database(db_b):
+        stats_b = apply_changeset(to_b)
+        to_a = create_changeset(device_a)
+    with use_database(db_a):
+        mark_sent(device_b, to_b)
+        stats_a = apply_changeset(to_a)
+    with use_database(db_b):
+        mark_sent(device_a, to_a)
+    return stats_a, stats_b
+
+
+def main(argv=None):
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="在设备之间增量同步航班记录")
+    parser.add_argument('--db', default=database_utils.DB_FILE, help="数据库文件路径")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('device-id', help="显示本机设备ID")
+    subparsers.add_parser('reset-device-id', help="重新生成本机设备ID（复制数据库文件后使用）")
+    export_parser = subparsers.add_parser('export', help="导出变更集")
+    export_parser.add_argument('output', help="变更集文件路径")
+    export_parser.add_argument('--peer', help="对端设备ID（只导出该对端上次同步之后的修改）")
+    export_parser.add_argument('--since', type=int, help="从指定的本机修改序号之后导出（0表示全量）")
+    import_parser = subparsers.add_parser('import', help="应用对端的变更集")
+    import_parser.add_argument('input', help="变更集文件路径")
+    sync_parser = subparsers.add_parser('sync', help="双向同步两个数据库文件")
+    sync_parser.add_argument('db_a')
+    sync_parser.add_argument('db_b')
+    args = parser.parse_args(argv)
+
+    if args.command == 'sync':
+        stats_a, stats_b = sync_databases(args.db_a, args.db_b)
+        print(f"{args.db_a}: {stats_a}")
+        print(f"{args.db_b}: {stats_b}")
+        return
+
+    with use_database(args.db):
+        if args.command == 'device-id':
+            print(database_utils.get_device_id())
+        elif args.command == 'reset-device-id':
+            print(database_utils.reset_device_id())
+        elif args.command == 'export':
+            changeset = write_changeset(args.output, args.peer, args.since)
+            print(f"导出 {len(changeset['flights'])} 条记录、{len(changeset['tombstones'])} 条删除")
+        else:
+            print(apply_changeset(read_changeset(args.input)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+航班记录表模块
+"查看所有航班记录"表格直接由一条SQL查询读出所需的列构建DataFrame，距离和飞行时间按列整体格式化，
+结果按数据版本缓存：数据没有变化时重新运行脚本不会再查询或格式化
+"""
+
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+import database_utils
+import flight_utils
+
+# 表格的列: 查询结果列 -> 显示名称
+FLIGHT_TABLE_COLUMNS = OrderedDict([
+    ('departure_city', '出发城市'),
+    ('arrival_city', '到达城市'),
+    ('date', '日期'),
+    ('distance', '距离（公里）'),
+    ('flight_time', '飞行时间'),
+])
+
+# 读取表格数据的查询（基于database_utils.run_flight_queries的flight_rows视图，按日期从晚到早）
+FLIGHT_TABLE_QUERY = f'''
+    SELECT {', '.join(FLIGHT_TABLE_COLUMNS)}
+    FROM flight_rows
+    ORDER BY date DESC, id DESC
+'''
+
+# 表格缓存最多保留的数据库（用户配置）数
+TABLE_CACHE_SIZE = 8
+
+# 各数据库最近一次构建的表格: {(数据库文件, 是否包含归档): (数据版本号, DataFrame)}，最近使用的在后
+_table_cache = OrderedDict()
+_table_lock = threading.Lock()
+
+
+def format_flight_times(minutes):
+    """
+    按列格式化飞行时间（结果与flight_utils.format_flight_time逐个格式化相同）
+    不同的飞行时间只有几百种，只对去重后的值调用format_flight_time，再按编码整体取值
+    minutes: 分钟数Series（可含空值）
+    返回: 字符串Series
+    """
+    codes, uniques = pd.factorize(minutes)
+    labels = pd.Series([flight_utils.format_flight_time(value) for value in uniques] + ["未设置"])
+    # 空值的编码是-1，对应追加在最后的"未设置"
+    return pd.Series(labels.to_numpy()[codes], index=minutes.index)
+
+
+def build_flights_table(rows):
+    """
+    把查询结果行构建为表格DataFrame（列名为显示名称）
+    距离取整后保持数值类型（由表格的列配置加千位分隔符，按数值排序），飞行时间转换为可读字符串
+    """
+    frame = pd.DataFrame.from_records(rows, columns=list(FLIGHT_TABLE_COLUMNS))
+    frame['distance'] = pd.to_numeric(frame['distance'], errors='coerce').round(0).astype('Int64')
+    frame['flight_time'] = format_flight_times(pd.to_numeric(frame['flight_time'], errors='coerce'))
+    return frame.rename(columns=FLIGHT_TABLE_COLUMNS)
+
+
+def flights_table(include_archive=True):
+    """
+    返回当前数据库的航班记录表（按数据版本缓存，调用方不要修改返回的DataFrame）
+    include_archive: 是否包含归档分区的历史记录；为False时只查询热分区
+    """
+    key = (database_utils.current_db_file(), include_archive)
+    version = database_utils.get_data_version()
+    with _table_lock:
+        cached = _table_cache.get(key)
+        if cached and cached[0] == version:
+            _table_cache.move_to_end(key)
+            return cached[1]
+    frame = build_flights_table(
+        database_utils.run_flight_queries({'table': FLIGHT_TABLE_QUERY}, include_archive)['table']
+    )
+    with _table_lock:
+        _table_cache[key] = (version, frame)
+        _table_cache.move_to_end(key)
+        while len(_table_cache) > TABLE_CACHE_SIZE:
+            _table_cache.popitem(last=False)
+    return frame
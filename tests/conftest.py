@@ -0,0 +1,69 @@
+"""
+测试公共配置：让测试直接导入仓库根目录下的模块，并提供在临时目录中初始化的数据库
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database_utils  # noqa: E402
+
+# 测试数据用到的城市: 名称 -> (坐标, 国家)
+CITIES = {
+    '北京': ((39.9042, 116.4074), '中国'),
+    '上海': ((31.2304, 121.4737), '中国'),
+    '成都': ((30.5728, 104.0668), '中国'),
+    '东京': ((35.6762, 139.6503), '日本'),
+    '伦敦': ((51.5074, -0.1278), '英国'),
+}
+
+
+def make_flight(departure, arrival, date, distance, flight_time=None):
+    """生成一条航班记录字典（城市坐标取自CITIES）"""
+    (departure_coords, departure_country), (arrival_coords, arrival_country) = CITIES[departure], CITIES[arrival]
+    return {
+        'departure_city': departure,
+        'arrival_city': arrival,
+        'departure_coords': departure_coords,
+        'arrival_coords': arrival_coords,
+        'departure_country': departure_country,
+        'arrival_country': arrival_country,
+        'date': date,
+        'distance': distance,
+        'flight_time': flight_time,
+    }
+
+
+# 覆盖国内/国际、往返、缺失飞行时间、跨多个年份（含可以归档的旧年份）的航班
+SAMPLE_FLIGHTS = [
+    make_flight('北京', '上海', '2003-05-01', 1067.3, 135),
+    make_flight('上海', '北京', '2003-05-09', 1067.3, 140),
+    make_flight('北京', '东京', '2008-11-20', 2098.55, None),
+    make_flight('成都', '北京', '2015-02-14', 1517.9, 160),
+    make_flight('北京', '伦敦', '2019-07-03', 8146.12, 650),
+    make_flight('伦敦', '北京', '2019-07-21', 8146.12, 600),
+    make_flight('上海', '东京', '2024-01-08', 1765.4, None),
+    make_flight('上海', '成都', '2024-01-30', 1659.75, 185),
+    make_flight('北京', '上海', '2025-03-12', 1067.3, 130),
+    make_flight('东京', '上海', '2025-03-15', 1765.4, 190),
+]
+
+
+def open_database(path):
+    """初始化path处的数据库并让当前线程使用它"""
+    database_utils.set_current_db_file(str(path))
+    database_utils.init_database()
+    return str(path)
+
+
+@pytest.fixture
+def flight_db(tmp_path):
+    """已写入SAMPLE_FLIGHTS的临时数据库，返回数据库文件路径"""
+    db_file = open_database(tmp_path / 'flights.db')
+    database_utils.save_flights_to_db(SAMPLE_FLIGHTS)
+    yield db_file
+    database_utils.set_current_db_file(None)
+    database_utils._registry.close_all()
@@ -0,0 +1,61 @@
+"""
+统计后端的一致性测试：SQLite、DuckDB（扫描数据库文件）和DuckDB（扫描Parquet快照）的结果都应与Python逐条累加的基准相同
+"""
+
+import pytest
+
+import analytics_utils
+import database_utils
+
+
+def _expected_stats():
+    return analytics_utils._build_stats(
+        analytics_utils._reference_results(database_utils.load_flights_from_db()), analytics_utils.TOP_ROUTES_LIMIT
+    )
+
+
+@pytest.fixture(params=[False, True], ids=['hot-only', 'with-archives'])
+def stats_db(request, flight_db):
+    """示例数据库；with-archives时把较早的记录移入归档数据库，验证各后端都包含归档分区"""
+    if request.param:
+        assert database_utils.archive_old_flights(hot_years=3) > 0
+        assert database_utils.list_archive_files()
+    return flight_db
+
+
+def test_sqlite_matches_reference(stats_db):
+    assert analytics_utils._diff_values(_expected_stats(), analytics_utils.compute_stats('sqlite'), 'stats') == []
+
+
+def test_duckdb_matches_reference(stats_db):
+    pytest.importorskip('duckdb')
+    if not analytics_utils.duckdb_usable():
+        pytest.skip("DuckDB无法加载sqlite扩展")
+    assert analytics_utils._diff_values(_expected_stats(), analytics_utils.compute_stats('duckdb'), 'stats') == []
+
+
+def test_duckdb_parquet_matches_reference(stats_db):
+    pytest.importorskip('duckdb')
+    pytest.importorskip('pyarrow')
+    stats = analytics_utils.compute_stats('duckdb', use_parquet=True)
+    assert analytics_utils._diff_values(_expected_stats(), stats, 'stats') == []
+
+
+def test_auto_uses_sqlite_when_duckdb_unusable(flight_db, monkeypatch):
+    monkeypatch.setattr(analytics_utils, '_duckdb_usable', False)
+    assert analytics_utils.resolve_backend('auto') == 'sqlite'
+    assert analytics_utils.compute_stats('auto')['flight_count'] == len(database_utils.load_flights_from_db())
+
+
+def test_overview_totals_cached_per_data_version(flight_db, monkeypatch):
+    calls = []
+    compute_totals = analytics_utils.compute_totals
+    monkeypatch.setattr(analytics_utils, 'compute_totals', lambda: calls.append(1) or compute_totals('sqlite'))
+    first = analytics_utils.overview_totals()
+    assert analytics_utils.overview_totals() is first
+    assert len(calls) == 1
+    assert first['flight_count'] == len(database_utils.load_flights_from_db())
+
+    database_utils.delete_flight_from_db(database_utils.load_flights_from_db()[0]['id'])
+    assert analytics_utils.overview_totals()['flight_count'] == first['flight_count'] - 1
+    assert len(calls) == 2
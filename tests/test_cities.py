@@ -0,0 +1,114 @@
+"""
+城市修正测试：没有变化的修改不写数据库也不把航班标记为已修改；修改和合并都可以撤销和重做
+"""
+
+import sqlite3
+
+import database_utils
+import job_utils
+
+
+def _city(name):
+    return next(city for city in database_utils.load_cities() if city['name'] == name)
+
+
+def _alias_owners(alias):
+    """返回拥有别名alias的城市ID集合"""
+    conn = sqlite3.connect(database_utils.current_db_file())
+    rows = conn.execute('SELECT city_id FROM city_aliases WHERE alias = ?', (alias,)).fetchall()
+    conn.close()
+    return {row[0] for row in rows}
+
+
+def _changed_since(seq):
+    """本机修改序号大于seq的航班数（下次同步时要发送的记录）"""
+    return len(database_utils.export_changes(since=seq)['flights'])
+
+
+def test_unchanged_city_update_is_a_no_op(flight_db):
+    beijing = _city('北京')
+    seq = database_utils.export_changes()['until']
+    version = database_utils.get_data_version()
+    assert database_utils.update_city(
+        beijing['id'], name='北京', coords=beijing['coords'], country=beijing['country']
+    ) == beijing['id']
+    assert database_utils.get_data_version() == version
+    assert _changed_since(seq) == 0
+
+    database_utils.update_city(beijing['id'], coords=(39.9, 116.4))
+    assert database_utils.get_data_version() == version + 1
+    referencing = [
+        flight for flight in database_utils.load_flights_from_db()
+        if '北京' in (flight['departure_city'], flight['arrival_city'])
+    ]
+    assert _changed_since(seq) == len(referencing)
+
+
+class _FakeContext:
+    """只提供run_regeocode用到的接口的任务上下文"""
+    start = 0
+
+    def set_total(self, total):
+        pass
+
+    def advance(self, count):
+        pass
+
+
+def test_regeocode_skips_unchanged_coordinates(flight_db, monkeypatch):
+    cities = {city['name']: city['coords'] for city in database_utils.load_cities()}
+    moved = dict(cities, 成都=(30.6, 104.1))
+    monkeypatch.setattr(job_utils.geo_utils, 'geocode_remote', moved.get)
+    seq = database_utils.export_changes()['until']
+
+    result = job_utils.run_regeocode(_FakeContext(), {})
+    assert result == {'updated': 1, 'failed': []}
+    assert _city('成都')['coords'] == (30.6, 104.1)
+    chengdu_flights = [
+        flight for flight in database_utils.load_flights_from_db()
+        if '成都' in (flight['departure_city'], flight['arrival_city'])
+    ]
+    assert _changed_since(seq) == len(chengdu_flights)
+
+
+def _state():
+    """航班（按ID，带城市名和坐标）、城市、城市与航线计数和行程，用于比较撤销前后的数据库"""
+    flights = {
+        flight['id']: (flight['departure_city'], flight['arrival_city'], tuple(flight['departure_coords']),
+                       tuple(flight['arrival_coords']), flight['date'])
+        for flight in database_utils.load_flights_from_db()
+    }
+    cities = {city['id']: (city['name'], city['coords'], city['country']) for city in database_utils.load_cities()}
+    return flights, cities, database_utils.get_top_cities(), database_utils.get_top_routes(), \
+        database_utils.get_trip_stats()
+
+
+def test_city_edit_undo_redo(flight_db):
+    before = _state()
+    beijing = _city('北京')
+    database_utils.update_city(beijing['id'], name='北京市', coords=(39.9, 116.4))
+    edited = _state()
+    assert _city('北京市')['coords'] == (39.9, 116.4)
+    assert database_utils.get_undo_redo_state()['undo'] == "修改城市"
+
+    assert database_utils.undo_last_change() == "修改城市"
+    assert _state() == before
+    assert database_utils.redo_last_change() == "修改城市"
+    assert _state() == edited
+
+
+def test_city_merge_undo_redo(flight_db):
+    before = _state()
+    chengdu, shanghai = _city('成都'), _city('上海')
+    assert database_utils.update_city(chengdu['id'], name='上海') == shanghai['id']
+    merged = _state()
+    assert '成都' not in {city[0] for city in merged[1].values()}
+    assert _alias_owners('成都') == {shanghai['id']}
+
+    database_utils.undo_last_change()
+    assert _state() == before
+    assert database_utils.find_city('成都')['id'] == chengdu['id']
+    assert _alias_owners('成都') == set()
+
+    database_utils.redo_last_change()
+    assert _state() == merged
@@ -0,0 +1,48 @@
+"""
+命令行入口测试：--db指定的数据库只在命令执行期间生效，不修改进程的默认数据库DB_FILE
+"""
+
+import csv
+import io
+import json
+import threading
+import urllib.request
+
+import analytics_utils
+import api_utils
+import database_utils
+import export_utils
+from conftest import SAMPLE_FLIGHTS
+
+
+def test_export_and_analytics_use_db_argument(flight_db, tmp_path, capsys):
+    database_utils.set_current_db_file(None)
+    default_db = database_utils.DB_FILE
+
+    output = tmp_path / 'flights.csv'
+    export_utils.main(['csv', str(output), '--db', flight_db])
+    with open(output, encoding='utf-8-sig', newline='') as f:
+        assert len(list(csv.DictReader(f))) == len(SAMPLE_FLIGHTS)
+
+    analytics_utils.main(['--db', flight_db, '--backend', 'sqlite'])
+    stats = json.load(io.StringIO(capsys.readouterr().out))
+    assert stats['flight_count'] == len(SAMPLE_FLIGHTS)
+
+    assert database_utils.DB_FILE == default_db
+    assert database_utils.current_db_file() == default_db
+
+
+def test_api_server_default_db(flight_db):
+    database_utils.set_current_db_file(None)
+    with database_utils.use_db_file(flight_db):
+        server = api_utils.make_server('127.0.0.1', 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        # 请求由服务器的连接线程处理，不带profile时使用创建服务器时的数据库
+        url = f"http://127.0.0.1:{server.server_address[1]}/api/totals"
+        with urllib.request.urlopen(url) as response:
+            assert json.load(response)['flight_count'] == len(SAMPLE_FLIGHTS)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert database_utils.current_db_file() == database_utils.DB_FILE
@@ -0,0 +1,94 @@
+"""
+重复航班测试：完全相同的航班被跳过或拒绝，城市合并后重新计算指纹，热分区和归档分区之间的重复同样能检测到
+"""
+
+import sqlite3
+
+import pytest
+
+import database_utils
+import dedup_utils
+from conftest import SAMPLE_FLIGHTS, make_flight
+
+
+def _city_id(name):
+    return database_utils.find_city(name)['id']
+
+
+def _fingerprint(flight_id):
+    """返回航班记录的指纹（记录可能位于任一分区）"""
+    for path in [database_utils.current_db_file()] + database_utils.list_archive_files():
+        conn = sqlite3.connect(path)
+        row = conn.execute('SELECT fingerprint FROM flights WHERE id = ?', (flight_id,)).fetchone()
+        conn.close()
+        if row:
+            return row[0]
+    raise KeyError(flight_id)
+
+
+def test_exact_duplicate_is_skipped(flight_db):
+    new_flight = make_flight('伦敦', '东京', '2025-08-01', 9560.0, 700)
+    flight_ids = database_utils.save_flights_to_db([SAMPLE_FLIGHTS[0], new_flight], skip_duplicates=True)
+    assert not flight_ids[0]
+    assert flight_ids[1]
+    assert database_utils.count_flights() == len(SAMPLE_FLIGHTS) + 1
+
+    # 不跳过重复时整批回滚
+    with pytest.raises(database_utils.DuplicateFlightError):
+        database_utils.save_flights_to_db([make_flight('伦敦', '东京', '2025-09-01', 9560.0), SAMPLE_FLIGHTS[1]])
+    assert database_utils.count_flights() == len(SAMPLE_FLIGHTS) + 1
+
+    # 只有飞行时间不同的不是完全重复
+    assert database_utils.save_flight_to_db(dict(SAMPLE_FLIGHTS[0], flight_time=200))
+
+
+def test_city_merge_recomputes_fingerprints(flight_db):
+    beijing = database_utils.save_flight_to_db(make_flight('北京', '东京', '2024-06-01', 2098.55, 200))
+    chengdu = database_utils.save_flight_to_db(make_flight('成都', '东京', '2024-06-01', 3360.0, 200))
+    fingerprint = dedup_utils.flight_fingerprint(_city_id('北京'), _city_id('东京'), '2024-06-01', 200)
+    assert _fingerprint(beijing) == fingerprint
+
+    # 成都合并到北京：两条航班变为同一航线同一天，后一条与已有记录指纹冲突，指纹保持为空并出现在重复报告中
+    database_utils.update_city(_city_id('成都'), name='北京')
+    assert _fingerprint(beijing) == fingerprint
+    assert _fingerprint(chengdu) is None
+    assert any(
+        {beijing, chengdu} <= {flight['id'] for flight in group}
+        for group in database_utils.find_duplicate_flights()
+    )
+    # 没有冲突的航班按新的城市ID重新计算指纹，此后再添加同样的航班会被拒绝
+    merged = next(
+        flight for flight in database_utils.load_flights_from_db()
+        if flight['date'] == '2015-02-14'
+    )
+    assert _fingerprint(merged['id']) == dedup_utils.flight_fingerprint(
+        _city_id('北京'), _city_id('北京'), '2015-02-14', 160
+    )
+    with pytest.raises(database_utils.DuplicateFlightError):
+        database_utils.save_flight_to_db(make_flight('北京', '北京', '2015-02-14', 0.0, 160))
+
+    # 撤销合并后恢复原来的指纹
+    database_utils.undo_last_change()
+    assert _fingerprint(chengdu) == dedup_utils.flight_fingerprint(
+        _city_id('成都'), _city_id('东京'), '2024-06-01', 200
+    )
+    assert _fingerprint(merged['id']) == dedup_utils.flight_fingerprint(
+        _city_id('成都'), _city_id('北京'), '2015-02-14', 160
+    )
+
+
+def test_duplicate_across_partitions_is_detected(flight_db):
+    database_utils.archive_old_flights(hot_years=3)
+    archived = SAMPLE_FLIGHTS[0]
+    assert archived['date'][:4] == '2003' and database_utils.list_archive_files()
+
+    # 新记录写入热分区，与归档分区中的记录重复时同样被拒绝或跳过
+    with pytest.raises(database_utils.DuplicateFlightError):
+        database_utils.save_flight_to_db(archived)
+    assert database_utils.save_flights_to_db([archived], skip_duplicates=True) == [None]
+
+    # 把热分区的记录改成与归档记录相同也会被拒绝
+    hot = next(flight for flight in database_utils.load_flights_from_db() if flight['date'] == '2025-03-12')
+    with pytest.raises(database_utils.DuplicateFlightError):
+        database_utils.update_flight_in_db(hot['id'], dict(hot, date=archived['date'], flight_time=135))
+    assert database_utils.count_flights() == len(SAMPLE_FLIGHTS)
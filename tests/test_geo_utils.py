@@ -0,0 +1,76 @@
+"""
+城市补全和预解析测试：补全候选只来自当前用户配置的数据库，预解析的状态在完成后清理，解析结果的缓存有上限
+"""
+
+import time
+
+import pytest
+
+import database_utils
+import geo_utils
+from conftest import open_database
+
+
+@pytest.fixture
+def geocoder(monkeypatch):
+    """用固定结果代替在线解析，返回解析过的城市名列表"""
+    requested = []
+
+    def geocode_remote(city_name):
+        requested.append(city_name)
+        return (64.1466, -21.9426) if city_name.lower().startswith('reykjav') else None
+
+    monkeypatch.setattr(geo_utils, 'geocode_remote', geocode_remote)
+    monkeypatch.setattr(geo_utils, 'PREFETCH_DEBOUNCE_SECONDS', 0.01)
+    monkeypatch.setattr(geo_utils, '_resolved_coords', geo_utils.OrderedDict())
+    monkeypatch.setattr(geo_utils, '_prefetch_futures', {})
+    monkeypatch.setattr(geo_utils, '_latest_inputs', {})
+    return requested
+
+
+def _wait_for_prefetch(timeout=5):
+    """等待所有预解析结束（包括完成后的清理回调）"""
+    deadline = time.monotonic() + timeout
+    while geo_utils._prefetch_futures and time.monotonic() < deadline:
+        for future in list(geo_utils._prefetch_futures.values()):
+            future.result()
+        time.sleep(0.01)
+
+
+def test_suggestions_stay_within_profile(flight_db, tmp_path, geocoder):
+    geo_utils.prefetch_city('Reykjavik', field_key='alice:departure')
+    _wait_for_prefetch()
+    assert geo_utils.resolve_city('Reykjavik') == (64.1466, -21.9426)
+    assert geocoder == ['Reykjavik']
+    # 在线解析过但还没有保存到数据库的城市不出现在补全候选中
+    assert geo_utils.suggest_cities('Rey') == []
+    assert geo_utils.suggest_cities('北') == ['北京']
+
+    open_database(tmp_path / 'bob.db')
+    assert geo_utils.suggest_cities('北') == []
+    # 解析结果（公开的地名坐标）在配置间共享，不会再次请求
+    assert geo_utils.resolve_city('reykjavik ') == (64.1466, -21.9426)
+    assert geocoder == ['Reykjavik']
+
+
+def test_prefetch_state_is_cleaned_up(flight_db, geocoder):
+    for typed in ('Rey', 'Reykja', 'Reykjavik'):
+        geo_utils.prefetch_city(typed, field_key='session:departure')
+    _wait_for_prefetch()
+    # 只有停止输入后的最后一次内容被解析
+    assert geocoder == ['Reykjavik']
+    assert geo_utils._prefetch_futures == {}
+    assert geo_utils._latest_inputs == {}
+
+    # 已解析过的城市不再提交预解析，也不留下输入框的记录
+    geo_utils.prefetch_city('Reykjavik', field_key='session:arrival')
+    assert geo_utils._prefetch_futures == {}
+    assert geo_utils._latest_inputs == {}
+
+
+def test_resolved_coords_are_bounded(flight_db, geocoder, monkeypatch):
+    monkeypatch.setattr(geo_utils, 'GEOCODE_CACHE_SIZE', 3)
+    for index in range(5):
+        geo_utils.resolve_city(f'Reykjavik {index}')
+    assert list(geo_utils._resolved_coords) == ['reykjavik 2', 'reykjavik 3', 'reykjavik 4']
+    assert database_utils.find_city('Reykjavik 4') is None
@@ -0,0 +1,93 @@
+"""
+导入任务测试：格式不正确的行计入跳过数而不让任务失败，中断后继续执行时计数不会少算
+"""
+
+import csv
+
+import pytest
+
+import database_utils
+import job_utils
+from conftest import CITIES
+
+# CSV的列（与export_utils导出的格式相同）
+IMPORT_COLUMNS = ['departure_city', 'arrival_city', 'date', 'distance', 'flight_time',
+                  'departure_lat', 'departure_lon', 'arrival_lat', 'arrival_lon']
+
+
+def _row(departure, arrival, flight_date, flight_time='100'):
+    (departure_lat, departure_lon), _ = CITIES[departure]
+    (arrival_lat, arrival_lon), _ = CITIES[arrival]
+    return [departure, arrival, flight_date, '1000', flight_time,
+            departure_lat, departure_lon, arrival_lat, arrival_lon]
+
+
+def _write_csv(path, rows):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(IMPORT_COLUMNS)
+        writer.writerows(rows)
+    return str(path)
+
+
+class _Crash(Exception):
+    """模拟任务执行到一半时进程退出"""
+
+
+def test_malformed_rows_are_skipped(flight_db, tmp_path):
+    path = _write_csv(tmp_path / 'import.csv', [
+        _row('北京', '东京', '2026-02-01'),
+        _row('北京', '东京', '2026-13-40'),
+        _row('北京', '东京', '02/03/2026'),
+        _row('北京', '东京', ''),
+        _row('北京', '东京', '2026-02-04', flight_time='abc'),
+        _row('北京', '东京', '2026-02-05', flight_time='nan'),
+        ['北京', '', '2026-02-06'],
+        ['北京'],
+        _row('北京', '上海', '2003-05-01', flight_time='135'),
+        _row('东京', '北京', '2026-2-7'),
+    ])
+    job_id = database_utils.create_job('import', {'path': path})
+    job_utils._run_job_in_current_db(job_id)
+
+    job = database_utils.get_job(job_id)
+    assert job['status'] == database_utils.JOB_DONE
+    assert job['result'] == {'imported': 2, 'skipped': 7, 'duplicates': 1}
+    assert '2026-02-07' in {flight['date'] for flight in database_utils.load_flights_from_db()}
+
+
+def test_resumed_import_keeps_counts(flight_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(job_utils, 'JOB_CHUNK_SIZE', 3)
+    path = _write_csv(tmp_path / 'import.csv', [
+        # 第一块：导入1条、跳过1条、重复1条
+        _row('北京', '东京', '2026-03-01'),
+        _row('北京', '东京', 'bad date'),
+        _row('北京', '上海', '2003-05-01', flight_time='135'),
+        # 第二块：导入2条、跳过1条
+        _row('东京', '北京', '2026-03-02'),
+        ['东京'],
+        _row('北京', '伦敦', '2026-03-03'),
+    ])
+    job_id = database_utils.create_job('import', {'path': path})
+
+    # 第一块提交并保存进度后"进程退出"，任务停在运行中
+    check_cancelled = job_utils.JobContext.check_cancelled
+
+    def crash(ctx):
+        raise _Crash()
+
+    monkeypatch.setattr(job_utils.JobContext, 'check_cancelled', crash)
+    assert database_utils.claim_job(job_id)
+    with pytest.raises(_Crash):
+        job_utils.run_import(job_utils.JobContext(database_utils.get_job(job_id)), {'path': path})
+    job = database_utils.get_job(job_id)
+    assert job['status'] == database_utils.JOB_RUNNING
+    assert job['progress'] == 3
+    assert job['result'] == {'imported': 1, 'skipped': 1, 'duplicates': 1}
+
+    # 重启后从断点继续，最终结果包括中断前完成的部分
+    monkeypatch.setattr(job_utils.JobContext, 'check_cancelled', check_cancelled)
+    job_utils._run_job_in_current_db(job_id)
+    job = database_utils.get_job(job_id)
+    assert job['status'] == database_utils.JOB_DONE
+    assert job['result'] == {'imported': 3, 'skipped': 2, 'duplicates': 1}
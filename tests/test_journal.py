@@ -0,0 +1,148 @@
+"""
+修改日志测试：撤销/重做往返、分块提交并中断后继续的后台任务作为一步撤销、重做时遇到重复航班、
+压缩日志后保留的批次仍然可以撤销
+"""
+
+import csv
+from datetime import date, timedelta
+
+import pytest
+
+import database_utils
+import job_utils
+from conftest import CITIES, SAMPLE_FLIGHTS, make_flight
+
+
+def _state():
+    """航班（按ID）、行程统计和航线计数，用于比较撤销/重做前后的数据库"""
+    flights = {
+        flight['id']: (flight['departure_city'], flight['arrival_city'], flight['date'],
+                       flight['distance'], flight['flight_time'])
+        for flight in database_utils.load_flights_from_db()
+    }
+    trip_stats = database_utils.get_trip_stats()
+    # 合计里程的求和顺序会随行程的增删变化，末位可能不同
+    trip_stats['total_distance'] = round(trip_stats['total_distance'], 6)
+    return flights, trip_stats, database_utils.get_top_routes(100)
+
+
+def _tombstones():
+    return {tombstone['uid'] for tombstone in database_utils.export_changes()['tombstones']}
+
+
+def test_undo_redo_round_trip(flight_db):
+    states = [_state()]
+    new_ids = database_utils.save_flights_to_db([
+        make_flight('成都', '东京', '2025-04-01', 3300.0, 280),
+        make_flight('东京', '成都', '2025-04-09', 3300.0, 300),
+    ])
+    states.append(_state())
+    flights = database_utils.load_flights_from_db()
+    first = next(flight for flight in flights if flight['id'] == new_ids[0])
+    database_utils.update_flight_in_db(first['id'], dict(first, flight_time=290))
+    states.append(_state())
+    database_utils.delete_flight_from_db(flights[-1]['id'])
+    states.append(_state())
+    assert len(_tombstones()) == 1
+
+    for expected, action in zip(reversed(states[:-1]), ("删除航班", "修改航班", "添加航班")):
+        assert database_utils.undo_last_change() == action
+        assert _state() == expected
+    assert database_utils.get_undo_redo_state() == {'undo': "添加航班", 'redo': "添加航班"}
+    # 撤销删除时恢复原记录并去掉墓碑，撤销添加时留下墓碑（同步时对端也会删除）
+    assert len(_tombstones()) == 2
+
+    for expected in states[1:]:
+        assert database_utils.redo_last_change()
+        assert _state() == expected
+    assert database_utils.get_undo_redo_state()['redo'] is None
+    assert len(_tombstones()) == 1
+
+
+def _write_import_csv(path, count):
+    """生成count条不重复的待导入航班（带坐标，不需要在线解析）"""
+    names = list(CITIES)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['departure_city', 'arrival_city', 'date', 'distance', 'flight_time',
+                         'departure_lat', 'departure_lon', 'arrival_lat', 'arrival_lon'])
+        for index in range(count):
+            departure, arrival = names[index % len(names)], names[(index + 1) % len(names)]
+            (departure_lat, departure_lon), _ = CITIES[departure]
+            (arrival_lat, arrival_lon), _ = CITIES[arrival]
+            writer.writerow([departure, arrival, (date(2020, 1, 1) + timedelta(days=index)).isoformat(),
+                             1000 + index, 100, departure_lat, departure_lon, arrival_lat, arrival_lon])
+
+
+class _Crash(Exception):
+    """模拟任务执行到一半时进程退出"""
+
+
+def _crash(ctx):
+    raise _Crash()
+
+
+def test_resumed_import_job_is_one_undo_step(flight_db, tmp_path, monkeypatch):
+    before = _state()
+    path = tmp_path / 'import.csv'
+    _write_import_csv(path, 2 * job_utils.JOB_CHUNK_SIZE + 50)
+    job_id = database_utils.create_job('import', {'path': str(path)})
+
+    # 第一块提交并保存进度后"进程退出"，任务停在运行中
+    check_cancelled = job_utils.JobContext.check_cancelled
+    monkeypatch.setattr(job_utils.JobContext, 'check_cancelled', _crash)
+    assert database_utils.claim_job(job_id)
+    with pytest.raises(_Crash):
+        job_utils.run_import(job_utils.JobContext(database_utils.get_job(job_id)), {'path': str(path)})
+    job = database_utils.get_job(job_id)
+    assert job['status'] == database_utils.JOB_RUNNING
+    assert job['progress'] == job_utils.JOB_CHUNK_SIZE
+    assert job['batch_id'] is not None
+
+    # 重启后从断点继续，剩下的块写入同一个日志批次
+    monkeypatch.setattr(job_utils.JobContext, 'check_cancelled', check_cancelled)
+    job_utils._run_job_in_current_db(job_id)
+    assert database_utils.get_job(job_id)['status'] == database_utils.JOB_DONE
+    imported = _state()
+    assert len(imported[0]) == len(before[0]) + 2 * job_utils.JOB_CHUNK_SIZE + 50
+
+    assert database_utils.undo_last_change() == "导入航班"
+    assert _state() == before
+    assert database_utils.get_undo_redo_state()['undo'] == "添加航班"
+    assert database_utils.redo_last_change() == "导入航班"
+    assert _state() == imported
+
+
+def test_redo_fails_on_duplicate_flight(flight_db):
+    flight = make_flight('成都', '东京', '2025-04-01', 3300.0, 280)
+    # 在用户操作之前开始、之后仍在写入的后台任务批次（不会清空重做栈）
+    job_batch = database_utils.begin_batch("导入航班")
+    database_utils.save_flight_to_db(flight)
+    assert database_utils.undo_last_change() == "添加航班"
+
+    database_utils.save_flights_to_db([flight], batch_id=job_batch)
+    state = _state()
+    with pytest.raises(database_utils.DuplicateFlightError):
+        database_utils.redo_last_change()
+    # 整步重做已回滚，仍然可以重做（删除重复的记录之后）
+    assert _state() == state
+    assert database_utils.get_undo_redo_state()['redo'] == "添加航班"
+
+
+def test_compaction_keeps_recent_batches_undoable(flight_db):
+    states = [_state()]
+    for index in range(4):
+        database_utils.save_flight_to_db(make_flight('成都', '伦敦', f'2025-05-0{index + 1}', 8300.0, 600))
+        states.append(_state())
+    assert database_utils.compact_journal(keep_batches=2) > 0
+
+    assert database_utils.undo_last_change() == "添加航班"
+    assert _state() == states[3]
+    assert database_utils.undo_last_change() == "添加航班"
+    assert _state() == states[2]
+    # 更早的批次已折叠进检查点，不能再撤销
+    assert database_utils.undo_last_change() is None
+    assert _state() == states[2]
+    assert database_utils.redo_last_change() == "添加航班"
+    assert _state() == states[3]
+    assert len(states[0][0]) == len(SAMPLE_FLIGHTS)
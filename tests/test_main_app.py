@@ -0,0 +1,65 @@
+"""
+应用页面测试：用Streamlit的AppTest执行main.py，检查按用户配置切换数据库
+"""
+
+import functools
+import os
+
+import pytest
+
+pytest.importorskip('streamlit')
+pytest.importorskip('folium')
+pytest.importorskip('streamlit_folium')
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+from streamlit.testing.v1 import local_script_runner  # noqa: E402
+
+import database_utils  # noqa: E402
+from conftest import SAMPLE_FLIGHTS  # noqa: E402
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+
+
+@pytest.fixture
+def app_dir(tmp_path, monkeypatch):
+    """在临时目录中运行应用（默认数据库和profiles目录都是相对路径）"""
+    monkeypatch.chdir(tmp_path)
+    yield tmp_path
+    database_utils.set_current_db_file(None)
+    database_utils._registry.close_all()
+
+
+def test_jobs_panel_fragment_uses_profile_database(app_dir, monkeypatch):
+    # 默认数据库有其他数据（数据版本号与配置的数据库不同）
+    with database_utils.use_db_file(database_utils.DB_FILE):
+        database_utils.init_database()
+        database_utils.save_flights_to_db(SAMPLE_FLIGHTS)
+
+    at = AppTest.from_file(MAIN_SCRIPT, default_timeout=60)
+    at.query_params['profile'] = 'alice'
+    at.run()
+    assert not at.exception
+    profile_db = database_utils.profile_db_file('alice')
+    assert at.session_state.profile_db == profile_db
+    assert at.session_state.flights == []
+
+    # 记录任务面板读取数据版本号时使用的数据库
+    versions_read_from = []
+    get_data_version = database_utils.get_data_version
+
+    def recording_get_data_version():
+        versions_read_from.append(database_utils.current_db_file())
+        return get_data_version()
+
+    monkeypatch.setattr(database_utils, 'get_data_version', recording_get_data_version)
+
+    # 只重新执行任务面板的fragment（与run_every定时刷新一样，在新的线程中执行）
+    fragment_ids = list(at._fragment_storage._fragments)
+    assert len(fragment_ids) == 1
+    monkeypatch.setattr(local_script_runner, 'RerunData', functools.partial(
+        local_script_runner.RerunData, fragment_id_queue=fragment_ids, is_auto_rerun=True
+    ))
+    at.run()
+    assert not at.exception
+    assert versions_read_from and set(versions_read_from) == {profile_db}
+    assert at.session_state.flights == []
@@ -0,0 +1,95 @@
+"""
+分区测试：热分区和归档分区之间的移动（两个方向）在中途中断后重新执行，不会丢失或重复记录；
+默认的航班列表和表格只读取热分区
+"""
+
+import sqlite3
+
+import database_utils
+import snapshot_utils
+import table_utils
+
+
+def _partition_counts():
+    """返回 (热分区记录数, 各归档分区记录数之和)"""
+    conn = sqlite3.connect(database_utils.current_db_file())
+    hot = conn.execute('SELECT COUNT(*) FROM flights').fetchone()[0]
+    conn.close()
+    archived = 0
+    for path in database_utils.list_archive_files():
+        conn = sqlite3.connect(path)
+        archived += conn.execute('SELECT COUNT(*) FROM flights').fetchone()[0]
+        conn.close()
+    return hot, archived
+
+
+def test_archive_and_restore(flight_db):
+    total = len(database_utils.load_flights_from_db())
+    moved = database_utils.archive_old_flights(hot_years=3)
+    hot, archived = _partition_counts()
+    assert moved == archived > 0
+    assert hot + archived == total
+
+    # 归档分区中的记录改到热分区的年份后原地更新，分区维护时移回热分区
+    old = min(database_utils.load_flights_from_db(), key=lambda flight: flight['date'])
+    database_utils.update_flight_in_db(old['id'], dict(old, date='2025-06-01'))
+    assert database_utils.archive_old_flights(hot_years=3) == 1
+    hot_after, archived_after = _partition_counts()
+    assert (hot_after, archived_after) == (hot + 1, archived - 1)
+    assert len(database_utils.load_flights_from_db()) == total
+
+
+def test_interrupted_move_is_completed(flight_db):
+    total = len(database_utils.load_flights_from_db())
+    database_utils.archive_old_flights(hot_years=3)
+    hot, archived = _partition_counts()
+
+    # 模拟移动时只完成了第一步提交：记录已复制回热分区，但还留在归档分区中
+    conn = sqlite3.connect(database_utils.current_db_file())
+    for path in database_utils.list_archive_files():
+        conn.execute('ATTACH DATABASE ? AS archive', (path,))
+        columns = ', '.join(database_utils.FLIGHT_COLUMNS)
+        conn.execute(f'INSERT INTO main.flights ({columns}) SELECT {columns} FROM archive.flights')
+        conn.commit()
+        conn.execute('DETACH DATABASE archive')
+    conn.close()
+    assert sum(_partition_counts()) == total + archived
+
+    database_utils.archive_old_flights(hot_years=3)
+    assert _partition_counts() == (hot, archived)
+    assert len(database_utils.load_flights_from_db()) == total
+
+
+def test_interrupted_move_back_to_hot_is_completed(flight_db):
+    total = len(database_utils.load_flights_from_db())
+    database_utils.archive_old_flights(hot_years=3)
+    old = min(database_utils.load_flights_from_db(), key=lambda flight: flight['date'])
+    database_utils.update_flight_in_db(old['id'], dict(old, date='2025-06-01'))
+    hot, archived = _partition_counts()
+
+    # 模拟移回热分区时只完成了第一步提交：记录已复制到热分区，但还留在归档分区中
+    conn = sqlite3.connect(database_utils.current_db_file())
+    for path in database_utils.list_archive_files():
+        conn.execute('ATTACH DATABASE ? AS archive', (path,))
+        columns = ', '.join(database_utils.FLIGHT_COLUMNS)
+        conn.execute(f"INSERT INTO main.flights ({columns}) SELECT {columns} FROM archive.flights "
+                     "WHERE date >= '2025-01-01'")
+        conn.commit()
+        conn.execute('DETACH DATABASE archive')
+    conn.close()
+    assert _partition_counts() == (hot + 1, archived)
+
+    database_utils.archive_old_flights(hot_years=3)
+    assert _partition_counts() == (hot + 1, archived - 1)
+    assert len(database_utils.load_flights_from_db()) == total
+    assert database_utils.load_flights_by_ids([old['id']])[0]['date'] == '2025-06-01'
+
+
+def test_default_views_read_hot_partition_only(flight_db):
+    total = len(database_utils.load_flights_from_db())
+    database_utils.archive_old_flights(hot_years=3)
+    hot, _ = _partition_counts()
+    assert len(snapshot_utils.load_flights(include_archive=False)) == hot
+    assert len(table_utils.flights_table(include_archive=False)) == hot
+    assert len(snapshot_utils.load_flights()) == total
+    assert len(table_utils.flights_table()) == total
@@ -0,0 +1,89 @@
+"""
+两个数据库文件之间的双向同步测试：各自修改（包括一边删除、另一边修改同一航班）之后同步，两边结果一致，
+再次同步时没有需要应用的修改
+"""
+
+import sqlite3
+
+import pytest
+
+import database_utils
+import sync_utils
+from conftest import SAMPLE_FLIGHTS, make_flight, open_database
+
+
+def _contents(db_file):
+    """数据库中的航班（按uid排序，带城市名），用于比较两个副本"""
+    conn = sqlite3.connect(db_file)
+    rows = conn.execute('''
+        SELECT f.uid, dc.name, ac.name, f.date, f.distance, f.flight_time
+        FROM flights AS f
+        JOIN cities AS dc ON dc.id = f.departure_city_id
+        JOIN cities AS ac ON ac.id = f.arrival_city_id
+        ORDER BY f.uid
+    ''').fetchall()
+    conn.close()
+    return rows
+
+
+def _flight_id(db_file, uid):
+    """按uid查找航班在某个副本中的本地ID"""
+    conn = sqlite3.connect(db_file)
+    row = conn.execute('SELECT id FROM flights WHERE uid = ?', (uid,)).fetchone()
+    conn.close()
+    return row[0]
+
+
+def _record(flight, **changes):
+    """把load_flights_from_db的航班字典转换为可写回的航班信息字典"""
+    return dict({key: flight[key] for key in (
+        'departure_city', 'arrival_city', 'departure_coords', 'arrival_coords', 'date', 'distance', 'flight_time'
+    )}, **changes)
+
+
+@pytest.fixture
+def replicas(tmp_path):
+    """两个已经完成首次同步的副本 (a, b)"""
+    db_a = open_database(tmp_path / 'laptop.db')
+    database_utils.save_flights_to_db(SAMPLE_FLIGHTS)
+    db_b = open_database(tmp_path / 'server.db')
+    database_utils.set_current_db_file(None)
+    sync_utils.sync_databases(db_a, db_b)
+    assert _contents(db_a) == _contents(db_b)
+    yield db_a, db_b
+    database_utils._registry.close_all()
+
+
+def _total_changes(stats):
+    return stats['applied'] + stats['deleted'] + stats['conflicts']
+
+
+def test_sync_converges(replicas):
+    db_a, db_b = replicas
+    uids = [row[0] for row in _contents(db_a)]
+    contested, edited_on_a = uids[0], uids[1]
+
+    with database_utils.use_db_file(db_a):
+        # a删除一条航班、修改另一条、新增一条
+        database_utils.delete_flight_from_db(_flight_id(db_a, contested))
+        flight = database_utils.load_flights_by_ids([_flight_id(db_a, edited_on_a)])[0]
+        database_utils.update_flight_in_db(flight['id'], _record(flight, flight_time=999))
+        database_utils.save_flight_to_db(make_flight('成都', '东京', '2025-08-01', 3360.2, 290))
+    with database_utils.use_db_file(db_b):
+        # b修改a删除的那一条，并新增一条
+        flight = database_utils.load_flights_by_ids([_flight_id(db_b, contested)])[0]
+        database_utils.update_flight_in_db(flight['id'], _record(flight, distance=1234.5))
+        database_utils.save_flight_to_db(make_flight('伦敦', '上海', '2025-09-09', 9217.0, 700))
+
+    sync_utils.sync_databases(db_a, db_b)
+    assert _contents(db_a) == _contents(db_b)
+    # 冲突按版本较新者胜出：b的修改晚于a的删除，这条航班以b修改后的内容保留下来
+    contents = {row[0]: row for row in _contents(db_a)}
+    assert len(contents) == len(SAMPLE_FLIGHTS) + 2
+    assert contents[contested][4] == 1234.5
+    assert contents[edited_on_a][5] == 999
+
+    stats_a, stats_b = sync_utils.sync_databases(db_a, db_b)
+    assert _total_changes(stats_a) == 0
+    assert _total_changes(stats_b) == 0
+    assert _contents(db_a) == _contents(db_b)
@@ -0,0 +1,95 @@
+"""
+行程拼接测试：随机增删改之后，增量更新得到的行程与rebuild_trips全量重建的结果一致，
+包括修改跨越热分区和归档分区边界、以及记录在分区之间移动的情况
+"""
+
+import datetime
+import random
+import sqlite3
+
+import database_utils
+from conftest import make_flight
+
+# 随机修改的步数
+EDIT_STEPS = 80
+
+# 随机航班使用的城市（城市越少越容易连成多段行程）
+TRIP_CITIES = ('北京', '上海', '东京')
+
+# 随机日期落在分区边界前后多少天内（大于行程中转间隔，断点两侧都会出现）
+DATE_SPREAD_DAYS = 6
+
+
+def _trips():
+    """读取trips表（不含自增ID，距离保留两位小数避免浮点累加误差）"""
+    conn = sqlite3.connect(database_utils.current_db_file())
+    rows = conn.execute('''
+        SELECT start_date, start_flight_id, end_date, end_flight_id, origin_city_id, destination_city_id,
+               leg_count, ROUND(total_distance, 2), total_flight_time, layover_city_ids
+        FROM trips ORDER BY start_date, start_flight_id
+    ''').fetchall()
+    conn.close()
+    return rows
+
+
+def _random_flight(rng, boundary):
+    """分区边界附近的随机航班"""
+    departure, arrival = rng.sample(TRIP_CITIES, 2)
+    day = boundary + datetime.timedelta(days=rng.randint(-DATE_SPREAD_DAYS, DATE_SPREAD_DAYS))
+    return make_flight(departure, arrival, day.isoformat(), rng.choice((1067.3, 1765.4, 2098.55)),
+                       rng.choice((None, 120, 180)))
+
+
+def _random_edit(rng, boundary):
+    """随机执行一次新增、修改、删除或批量修改，重复的记录直接忽略"""
+    flights = database_utils.load_flights_from_db()
+    op = rng.choice(('save', 'update', 'delete', 'batch', 'group'))
+    try:
+        if op == 'save' or not flights:
+            database_utils.save_flight_to_db(_random_flight(rng, boundary))
+        elif op == 'update':
+            flight = rng.choice(flights)
+            database_utils.update_flight_in_db(flight['id'], _random_flight(rng, boundary))
+        elif op == 'delete':
+            database_utils.delete_flight_from_db(rng.choice(flights)['id'])
+        elif op == 'batch':
+            # 批量编辑器：同一事务中的新增、修改和删除，日期可能分布在边界两侧
+            picked = rng.sample(flights, min(2, len(flights)))
+            database_utils.apply_flight_changes(
+                inserts=[_random_flight(rng, boundary)],
+                updates={picked[0]['id']: _random_flight(rng, boundary)},
+                deletes=[flight['id'] for flight in picked[1:]]
+            )
+        else:
+            # 写入队列的合并提交
+            database_utils.apply_mutations([
+                ('save', (_random_flight(rng, boundary),)),
+                ('update', (rng.choice(flights)['id'], _random_flight(rng, boundary))),
+                ('delete', (rng.choice(flights)['id'],)),
+            ])
+    except database_utils.DuplicateFlightError:
+        pass
+
+
+def test_incremental_trips_match_full_rebuild(flight_db):
+    rng = random.Random(28)
+    boundary = datetime.date.fromisoformat(database_utils._hot_partition_cutoff(3))
+    for _ in range(20):
+        try:
+            database_utils.save_flight_to_db(_random_flight(rng, boundary))
+        except database_utils.DuplicateFlightError:
+            pass
+    database_utils.archive_old_flights(hot_years=3)
+    assert database_utils.list_archive_files()
+
+    for step in range(EDIT_STEPS):
+        _random_edit(rng, boundary)
+        if step % 10 == 9:
+            # 分区维护把改到另一侧年份的记录移到对应分区，行程不应受影响
+            database_utils.archive_old_flights(hot_years=3)
+        incremental = _trips()
+        database_utils.rebuild_trips()
+        assert incremental == _trips(), f"第{step}步修改后增量更新的行程与全量重建不一致"
+
+    # 至少有一个行程跨越了分区边界
+    assert any(start < boundary.isoformat() <= end for start, _, end, *_ in _trips())
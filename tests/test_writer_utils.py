@@ -0,0 +1,147 @@
+"""
+写入队列测试：多个线程同时写入时每个修改恰好提交一次，失败的修改只把异常交给它自己的调用者，
+每次合并提交只递增一次数据版本号，不同数据库的修改交给各自的写线程
+"""
+
+import datetime
+import sqlite3
+import threading
+
+import pytest
+
+import database_utils
+import writer_utils
+from conftest import SAMPLE_FLIGHTS, make_flight, open_database
+
+# 并发写入的线程数和每个线程保存的航班数
+THREADS = 8
+FLIGHTS_PER_THREAD = 20
+
+
+def _new_flight(index):
+    """第index条新航班（日期各不相同，不会与其他记录重复）"""
+    date = datetime.date(2026, 1, 1) + datetime.timedelta(days=index)
+    return make_flight('北京', '上海', date.isoformat(), 1067.3, 120)
+
+
+def _count_rows(db_file, table):
+    conn = sqlite3.connect(db_file)
+    count = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    conn.close()
+    return count
+
+
+@pytest.fixture
+def commits(monkeypatch):
+    """记录写线程每次调用apply_mutations的 (修改数, 结果列表)"""
+    calls = []
+    apply_mutations = database_utils.apply_mutations
+
+    def recording_apply_mutations(mutations):
+        results = apply_mutations(mutations)
+        calls.append((len(mutations), results))
+        return results
+
+    monkeypatch.setattr(database_utils, 'apply_mutations', recording_apply_mutations)
+    return calls
+
+
+def test_concurrent_saves_commit_exactly_once(flight_db, commits):
+    version = database_utils.get_data_version()
+    batches = _count_rows(flight_db, 'journal_batches')
+    outcomes = {}
+
+    def worker(thread_index):
+        with database_utils.use_db_file(flight_db):
+            for i in range(FLIGHTS_PER_THREAD):
+                index = thread_index * FLIGHTS_PER_THREAD + i
+                # 每个线程中间夹一条与已有记录完全相同的航班
+                if i == FLIGHTS_PER_THREAD // 2:
+                    try:
+                        writer_utils.save_flight(SAMPLE_FLIGHTS[thread_index % len(SAMPLE_FLIGHTS)])
+                    except database_utils.DuplicateFlightError as e:
+                        outcomes[('duplicate', thread_index)] = e
+                    else:
+                        outcomes[('duplicate', thread_index)] = None
+                outcomes[index] = writer_utils.save_flight(_new_flight(index))
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    total = THREADS * FLIGHTS_PER_THREAD
+    new_ids = [outcomes[index] for index in range(total)]
+    assert all(isinstance(flight_id, int) for flight_id in new_ids)
+    assert len(set(new_ids)) == total
+    for thread_index in range(THREADS):
+        assert isinstance(outcomes[('duplicate', thread_index)], database_utils.DuplicateFlightError)
+
+    stored = {flight['id']: flight for flight in database_utils.load_flights_from_db()}
+    assert len(stored) == len(SAMPLE_FLIGHTS) + total
+    for index, flight_id in enumerate(new_ids):
+        assert stored[flight_id]['date'] == _new_flight(index)['date']
+
+    # 每个修改都只经过写线程一次；成功的修改各留下一个日志批次，失败的不留
+    assert sum(size for size, _ in commits) == total + THREADS
+    assert _count_rows(flight_db, 'journal_batches') == batches + total
+    # 每次提交只递增一次版本号（全部失败的一批不提交）
+    committed = sum(1 for _, results in commits if not all(isinstance(r, Exception) for r in results))
+    assert database_utils.get_data_version() == version + committed
+
+
+def test_failed_mutation_only_reaches_its_caller(flight_db, commits, monkeypatch):
+    # 放宽合并窗口，保证三个修改进入同一批
+    monkeypatch.setattr(writer_utils, 'GROUP_COMMIT_WINDOW', 0.5)
+    marker = database_utils.get_write_marker()
+    futures = [
+        writer_utils.submit('save', _new_flight(0)),
+        writer_utils.submit('save', SAMPLE_FLIGHTS[0]),
+        writer_utils.submit('save', _new_flight(1)),
+    ]
+
+    assert isinstance(futures[0].result(), int)
+    with pytest.raises(database_utils.DuplicateFlightError):
+        futures[1].result()
+    assert isinstance(futures[2].result(), int)
+    assert [size for size, _ in commits] == [3]
+
+    # 一次提交、两个成功的操作：会话不能把这次版本变化当作只来自自己的写入
+    assert database_utils.writes_since(marker) == (1, 2)
+    assert database_utils.count_flights() == len(SAMPLE_FLIGHTS) + 2
+
+
+def test_each_database_has_its_own_writer(tmp_path):
+    db_files = [open_database(tmp_path / f'{name}.db') for name in ('alice', 'bob')]
+    errors = []
+
+    def worker(db_index, thread_index):
+        try:
+            with database_utils.use_db_file(db_files[db_index]):
+                for i in range(FLIGHTS_PER_THREAD):
+                    writer_utils.save_flight(_new_flight(db_index * 1000 + thread_index * FLIGHTS_PER_THREAD + i))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=worker, args=(db_index, t))
+        for db_index in range(len(db_files)) for t in range(THREADS // 2)
+    ]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        for db_index, db_file in enumerate(db_files):
+            with database_utils.use_db_file(db_file):
+                dates = {flight['date'] for flight in database_utils.load_flights_from_db()}
+            assert len(dates) == THREADS // 2 * FLIGHTS_PER_THREAD
+            assert dates == {
+                _new_flight(db_index * 1000 + i)['date'] for i in range(THREADS // 2 * FLIGHTS_PER_THREAD)
+            }
+    finally:
+        database_utils.set_current_db_file(None)
+        database_utils._registry.close_all()
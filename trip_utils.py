@@ -0,0 +1,64 @@
+"""
+行程拼接模块
+把按日期排序的航班串成多段行程（例如 北京→法兰克福→纽约）
+"""
+
+from datetime import date
+
+# 两段航班之间允许的最长中转间隔（天），超过该间隔视为两次独立的行程
+MAX_LAYOVER_DAYS = 2
+
+
+def _days_between(earlier, later):
+    """计算两个 'YYYY-MM-DD' 日期字符串之间相差的天数"""
+    return (date.fromisoformat(later) - date.fromisoformat(earlier)).days
+
+
+def stitch_trips(flights, max_layover_days=MAX_LAYOVER_DAYS):
+    """
+    将航班拼接成行程（一次线性扫描）
+    当前航班的出发城市等于上一段的到达城市、且间隔不超过max_layover_days时，并入同一行程
+
+    参数:
+        flights: 已按 (date, id) 升序排列的航班列表，每项包含
+                 id, date, departure_city_id, arrival_city_id, distance, flight_time
+        max_layover_days: 允许的最长中转间隔（天）
+    返回: 行程列表，每个行程是按顺序排列的航班列表
+    """
+    trips = []
+    current = []
+    for flight in flights:
+        if current:
+            previous = current[-1]
+            if previous['arrival_city_id'] == flight['departure_city_id'] and \
+                    _days_between(previous['date'], flight['date']) <= max_layover_days:
+                current.append(flight)
+                continue
+            trips.append(current)
+        current = [flight]
+    if current:
+        trips.append(current)
+    return trips
+
+
+def summarize_trip(legs):
+    """
+    汇总一个行程的各段航班
+
+    参数:
+        legs: 按顺序排列的航班列表（stitch_trips返回的单个行程）
+    返回: 行程字典（起止日期和航班ID、起点终点城市、航段数、总距离、总飞行时间、中转城市ID列表）
+    """
+    flight_times = [leg['flight_time'] for leg in legs if leg['flight_time']]
+    return {
+        'start_date': legs[0]['date'],
+        'start_flight_id': legs[0]['id'],
+        'end_date': legs[-1]['date'],
+        'end_flight_id': legs[-1]['id'],
+        'origin_city_id': legs[0]['departure_city_id'],
+        'destination_city_id': legs[-1]['arrival_city_id'],
+        'leg_count': len(legs),
+        'total_distance': sum(leg['distance'] or 0 for leg in legs),
+        'total_flight_time': sum(flight_times) if flight_times else None,
+        'layover_city_ids': [leg['arrival_city_id'] for leg in legs[:-1]]
+    }
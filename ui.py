@@ -3,12 +3,36 @@ UI样式和组件模块
 包含所有前端样式定义和UI组件函数
 """
 
+import re
+from functools import lru_cache
+
 import streamlit as st
 
+# 城市和航线排行卡片每页显示的条数（渲染开销固定，与去过的城市总数无关）
+RANKING_PAGE_SIZE = 20
 
-def load_custom_css():
-    """加载自定义CSS样式"""
-    st.markdown("""
+# 每种组件最多缓存的HTML片段数（按输入参数缓存，参数不变时重新运行脚本不再拼接HTML）
+FRAGMENT_CACHE_SIZE = 4096
+
+# 卡片类型 -> 标题颜色
+CARD_COLORS = {
+    "blue": "#667eea",
+    "green": "#10b981",
+    "orange": "#f59e0b",
+    "purple": "#764ba2"
+}
+
+
+def _minify_css(css):
+    """去掉CSS中的注释和多余空白"""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    # 冒号两侧的空白不去掉：选择器中 "a :hover" 与 "a:hover" 含义不同
+    return re.sub(r'\s*([{};,>])\s*', r'\1', css).strip()
+
+
+# 自定义CSS样式表（导入模块时压缩一次）
+CUSTOM_CSS = _minify_css("""
     <style>
         /* 主标题样式 - 炫酷渐变色 */
         .main-title {
@@ -239,7 +263,16 @@ def load_custom_css():
             margin-top: 0.5rem;
         }
     </style>
-    """, unsafe_allow_html=True)
+""")
+
+
+def load_custom_css():
+    """
+    加载自定义CSS样式
+    Streamlit每次重新运行脚本时会移除没有再次输出的元素，所以样式表每次都要输出；
+    这里输出的是导入时压缩好的同一个字符串，前端收到的元素与上次相同，不会重新渲染
+    """
+    st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
 
 
 def render_main_title():
@@ -257,21 +290,20 @@ def render_metric_card(title, value, subtitle="", card_type="blue"):
         subtitle: 副标题/说明文字
         card_type: 卡片类型 ("blue", "green", "orange")
     """
-    # 根据类型选择颜色
-    color_map = {
-        "blue": "#667eea",
-        "green": "#10b981",
-        "orange": "#f59e0b"
-    }
-    card_color = color_map.get(card_type, "#667eea")
-    
-    st.markdown(f"""
+    st.markdown(_metric_card_html(title, value, subtitle, card_type), unsafe_allow_html=True)
+
+
+@lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def _metric_card_html(title, value, subtitle, card_type):
+    """生成统计卡片的HTML"""
+    card_color = CARD_COLORS.get(card_type, "#667eea")
+    return f"""
     <div class="metric-card card-{card_type}">
         <h3 style="color: {card_color}; margin: 0 0 0.2rem 0; font-size: 1.0rem; font-weight: 600; letter-spacing: 0.3px;">{title}</h3>
         <h2 style="color: #1a202c; margin: 0.1rem 0; font-size: 2.0rem; font-weight: 700; line-height: 1.1;">{value}</h2>
         <p style="color: #64748b; margin: 0.2rem 0 0 0; font-size: 0.8rem; font-weight: 500;">{subtitle}</p>
     </div>
-    """, unsafe_allow_html=True)
+    """
 
 
 def render_flight_card(departure_city, arrival_city, date, distance, flight_time_str):
@@ -285,7 +317,16 @@ def render_flight_card(departure_city, arrival_city, date, distance, flight_time
         distance: 距离
         flight_time_str: 飞行时间字符串
     """
-    st.markdown(f"""
+    st.markdown(
+        _flight_card_html(departure_city, arrival_city, date, distance, flight_time_str),
+        unsafe_allow_html=True
+    )
+
+
+@lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def _flight_card_html(departure_city, arrival_city, date, distance, flight_time_str):
+    """生成航班记录卡片的HTML"""
+    return f"""
     <div class="flight-card">
         <div style="margin-bottom: 0.8rem;">
             <h4 style="color: #1a202c; margin: 0; font-size: 1.1rem; font-weight: 600;">
@@ -309,7 +350,7 @@ def render_flight_card(departure_city, arrival_city, date, distance, flight_time
             </div>
         </div>
     </div>
-    """, unsafe_allow_html=True)
+    """
 
 
 def render_confirmation_info(pending_data, distance, flight_time_str, dep_coords, arr_coords):
@@ -360,73 +401,82 @@ def render_cities_card(cities, card_type="purple"):
         cities: 城市列表（已去重）
         card_type: 卡片类型，用于设置边框颜色
     """
-    # 根据类型选择颜色
-    color_map = {
-        "blue": "#667eea",
-        "green": "#10b981",
-        "orange": "#f59e0b",
-        "purple": "#764ba2"
-    }
-    card_color = color_map.get(card_type, "#764ba2")
+    st.markdown(_cities_card_html(tuple(cities), card_type), unsafe_allow_html=True)
+
+
+@lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def _cities_card_html(cities, card_type):
+    """生成城市列表卡片的HTML（cities为元组）"""
+    card_color = CARD_COLORS.get(card_type, "#764ba2")
     
-    # 生成城市标签HTML
+    # 生成城市标签HTML（按字母顺序排序，一次拼接）
     if cities:
-        city_tags_html = '<div class="cities-container">'
-        for city in sorted(cities):  # 按字母顺序排序
-            city_tags_html += f'<span class="city-tag">{city}</span>'
-        city_tags_html += '</div>'
-        cities_count = len(cities)
+        city_tags_html = ''.join(
+            ['<div class="cities-container">']
+            + [f'<span class="city-tag">{city}</span>' for city in sorted(cities)]
+            + ['</div>']
+        )
     else:
         city_tags_html = '<p style="color: #94a3b8; margin: 0.5rem 0; font-size: 0.9rem;">暂无城市记录</p>'
-        cities_count = 0
+    cities_count = len(cities)
     
-    st.markdown(f"""
+    return f"""
     <div class="metric-card card-{card_type}">
         <h3 style="color: {card_color}; margin: 0 0 0.4rem 0; font-size: 0.85rem; font-weight: 600; letter-spacing: 0.3px;">🌆 去过的城市</h3>
         <h2 style="color: #1a202c; margin: 0.3rem 0; font-size: 2rem; font-weight: 700; line-height: 1.2;">{cities_count}</h2>
         <p style="color: #64748b; margin: 0.4rem 0 0 0; font-size: 0.8rem; font-weight: 500;">共 {cities_count} 个城市</p>
         {city_tags_html}
     </div>
-    """, unsafe_allow_html=True)
+    """
 
 
-def render_cities_card_horizontal(city_counts, card_type="purple"):
+def render_cities_card_horizontal(city_counts, card_type="purple", total_count=None, title="🌆 去过的城市", unit="个城市"):
     """
     渲染横向长条城市列表卡片
     
     参数:
-        city_counts: 城市和次数的字典，格式为 {城市名: 次数}
+        city_counts: 城市和次数，格式为 {城市名: 次数}，或已按排名排好的 [(名称, 次数)] 列表（例如排行的一页）
         card_type: 卡片类型，用于设置边框颜色
+        total_count: 总数（只传入一页排行时使用），省略时为city_counts的条数
+        title: 卡片标题
+        unit: 总数的单位
     """
-    # 根据类型选择颜色
-    color_map = {
-        "blue": "#667eea",
-        "green": "#10b981",
-        "orange": "#f59e0b",
-        "purple": "#764ba2"
-    }
-    card_color = color_map.get(card_type, "#764ba2")
+    # 字典在缓存的函数中排序（只把条目转换为元组作为缓存键），已排好的列表保持原顺序
+    ranked = not isinstance(city_counts, dict)
+    items = tuple(tuple(item) for item in city_counts) if ranked else tuple(city_counts.items())
+    cities_count = total_count if total_count is not None else len(items)
+    st.markdown(
+        _cities_card_horizontal_html(items, ranked, card_type, cities_count, title, unit),
+        unsafe_allow_html=True
+    )
+
+
+@lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def _cities_card_horizontal_html(items, ranked, card_type, cities_count, title, unit):
+    """生成横向城市列表卡片的HTML（items为 ((名称, 次数), ...) 元组，ranked为False时按次数降序排序）"""
+    card_color = CARD_COLORS.get(card_type, "#764ba2")
+    # 按次数降序排序，如果次数相同则按城市名排序
+    sorted_cities = items if ranked else sorted(items, key=lambda x: (-x[1], x[0]))
     
-    # 生成城市标签HTML，按次数降序排列
-    if city_counts:
-        # 按次数降序排序，如果次数相同则按城市名排序
-        sorted_cities = sorted(city_counts.items(), key=lambda x: (-x[1], x[0]))
-        city_tags_html = '<div class="cities-container">'
-        for city, count in sorted_cities:
-            city_tags_html += f'<span class="city-tag">{city} <span style="opacity: 0.8; font-weight: 600;">({count})</span></span>'
-        city_tags_html += '</div>'
-        cities_count = len(city_counts)
+    # 生成城市标签HTML（一次拼接）
+    if sorted_cities:
+        city_tags_html = ''.join(
+            ['<div class="cities-container">']
+            + [
+                f'<span class="city-tag">{city} <span style="opacity: 0.8; font-weight: 600;">({count})</span></span>'
+                for city, count in sorted_cities
+            ]
+            + ['</div>']
+        )
     else:
-        city_tags_html = '<p style="color: #94a3b8; margin: 0.5rem 0; font-size: 0.9rem;">暂无城市记录</p>'
-        cities_count = 0
+        city_tags_html = '<p style="color: #94a3b8; margin: 0.5rem 0; font-size: 0.9rem;">暂无记录</p>'
     
-    st.markdown(f"""
+    return f"""
     <div class="metric-card card-{card_type}" style="padding: 1rem 1.4rem;">
         <div style="display: flex; align-items: center; gap: 1rem; margin-bottom: 0.5rem;">
-            <h3 style="color: {card_color}; margin: 0; font-size: 1.0rem; font-weight: 600; letter-spacing: 0.3px; white-space: nowrap;">🌆 去过的城市</h3>
-            <span style="color: #64748b; font-size: 0.85rem; font-weight: 500;">共 {cities_count} 个城市</span>
+            <h3 style="color: {card_color}; margin: 0; font-size: 1.0rem; font-weight: 600; letter-spacing: 0.3px; white-space: nowrap;">{title}</h3>
+            <span style="color: #64748b; font-size: 0.85rem; font-weight: 500;">共 {cities_count} {unit}</span>
         </div>
         {city_tags_html}
     </div>
-    """, unsafe_allow_html=True)
-
+    """
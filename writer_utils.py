@@ -0,0 +1,142 @@
+"""
+写入队列模块
+所有会话的添加、修改和删除都交给每个数据库文件唯一的写线程，写线程把一个短时间窗口内到达的修改
+合并成一个事务提交（组提交）：多人同时写入时只需一次加锁和一次fsync，也不会再有会话之间争抢写锁
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import database_utils
+import snapshot_utils
+
+# 是否启用组提交；关闭时每个修改直接在调用者的线程中单独提交
+GROUP_COMMIT_ENABLED = True
+
+# 写线程收到第一个修改后再等待多少秒，收集同一窗口内的其他修改
+GROUP_COMMIT_WINDOW = 0.002
+
+# 每个事务最多合并的修改数
+GROUP_COMMIT_MAX_BATCH = 200
+
+# 写线程空闲超过该秒数后退出（下次有修改时重新启动）
+WRITER_IDLE_SECONDS = 60
+
+# 数据库文件路径 -> 写线程
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+class _Writer:
+    """一个数据库文件的写线程及其队列"""
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name=f"writer-{db_file}", daemon=True)
+
+    def _next_batch(self):
+        """
+        等待并收集下一批修改：阻塞到第一个修改到达，然后在GROUP_COMMIT_WINDOW内继续收集
+        返回: [(操作, 参数元组, Future)] 列表；空闲超时且队列为空时返回None（写线程随即退出）
+        """
+        try:
+            batch = [self.queue.get(timeout=WRITER_IDLE_SECONDS)]
+        except queue.Empty:
+            with _writers_lock:
+                # 在锁内再检查一次，submit在同一把锁内入队，不会有修改被遗留在已退出的写线程中
+                if self.queue.empty():
+                    del _writers[self.db_file]
+                    return None
+            return []
+        deadline = time.monotonic() + GROUP_COMMIT_WINDOW
+        while len(batch) < GROUP_COMMIT_MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """写线程主循环"""
+        with database_utils.use_db_file(self.db_file):
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                # 跳过调用者已取消的修改
+                batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+                if batch:
+                    _commit_batch(batch)
+
+
+def _commit_batch(batch):
+    """在一个事务中应用一批修改，并把各自的结果或异常交给对应的Future"""
+    try:
+        results = database_utils.apply_mutations([(op, args) for op, args, _ in batch])
+    except Exception as e:
+        # 整个事务失败（例如数据库被锁住超时）时，同批的修改都收到同一个异常
+        for _, _, future in batch:
+            future.set_exception(e)
+        return
+    # 提交后在后台重新生成航班快照，之后打开的会话不必从数据库全量加载
+    snapshot_utils.schedule_refresh()
+    for (_, _, future), result in zip(batch, results):
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+
+def submit(op, *args):
+    """
+    把一个修改交给当前数据库的写线程（异步）
+    op: 'save' (flight_record)、'update' (flight_id, flight_record) 或 'delete' (flight_id)
+    返回: Future，结果与database_utils.apply_mutations中对应的结果相同，失败时result()抛出原异常
+    """
+    if op not in database_utils.MUTATION_ACTIONS:
+        raise ValueError(f"未知的修改操作: {op}")
+    db_file = database_utils.current_db_file()
+    future = Future()
+    with _writers_lock:
+        writer = _writers.get(db_file)
+        if writer is None:
+            writer = _writers[db_file] = _Writer(db_file)
+            writer.thread.start()
+        writer.queue.put((op, args, future))
+    return future
+
+
+def save_flight(flight_record):
+    """
+    保存航班记录（经写入队列合并提交）
+    返回: 插入的记录ID；与已有记录重复时抛出DuplicateFlightError
+    """
+    if not GROUP_COMMIT_ENABLED:
+        return database_utils.save_flight_to_db(flight_record)
+    return submit('save', flight_record).result()
+
+
+def update_flight(flight_id, flight_record):
+    """
+    更新航班记录（经写入队列合并提交），改成与其他记录重复时抛出DuplicateFlightError
+    返回: 是否找到了该记录
+    """
+    if not GROUP_COMMIT_ENABLED:
+        database_utils.update_flight_in_db(flight_id, flight_record)
+        return True
+    return submit('update', flight_id, flight_record).result()
+
+
+def delete_flight(flight_id):
+    """
+    删除航班记录（经写入队列合并提交）
+    返回: 是否找到了该记录
+    """
+    if not GROUP_COMMIT_ENABLED:
+        database_utils.delete_flight_from_db(flight_id)
+        return True
+    return submit('delete', flight_id).result()